@@ -2,127 +2,72 @@ from dotenv import load_dotenv
 load_dotenv()  # Load environment variables from .env file
 # print("DEBUG API KEY:", os.getenv("GOOGLE_API_KEY"))
 
-import os
+import asyncio
+import time
+import uuid
 import streamlit as st
-import sqlite3
 import pandas as pd
-import plotly.express as px
-import google.generativeai as genai
-import speech_recognition as sr  # For speech-to-text conversion
+from schema_catalog import get_schema_catalog
+from db_engine import QUERY_BACKEND, get_engine
+from llm_cache import get_response_cache, history_fingerprint, prompt_history
+from result_cache import get_result_cache
+from rollups import rewrite_query
+from chart_data import prepare_chart_data
+from dataset_browser import fetch_page, get_column_profiles
+from history_store import get_history_store, make_entry, append_entry, is_latest_entry, load_result
+from index_advisor import record_query
+from query_governor import QueryKilledError, get_governor
+from pipeline import get_pipeline
+from sql_extract import extract_sql
+from sql_guard import SQLValidationError
+from intent_engine import render_sql
+from nl2sql import sql_prompt, match_fast_path, request_sql, check_sql, request_repair, generate_summary, schema_fingerprint, warm_up
+from speech import synthesize_chunks
+from voice_input import VoiceListener, recognize_wav
+from tracing import get_tracer, span, new_trace, set_session, capture, restore
 # import pyttsx3  # For text-to-speech conversion
 
-# Configure the API key
-try:
-    genai.configure(api_key=os.getenv('GOOGLE_API_KEY'))
-except Exception as e:
-    st.error(f"Error configuring Google Gemini API: {e}")
-
-def fetch_database_schema():
+def fetch_database_catalog():
     try:
-        conn = sqlite3.connect("sales_database.db")
-        cursor = conn.cursor()
-
-        # Fetch all table names
-        cursor.execute("SELECT name FROM sqlite_master WHERE type='table';")
-        tables = cursor.fetchall()
+        # The catalog is introspected once and reused until the schema or data changes
+        with span("schema") as s:
+            catalog = get_schema_catalog("sales_database.db")
+            s.set("schema.tables", len(catalog["tables"]))
 
-        if not tables:
+        if not catalog["tables"]:
             st.error("No tables found in the database.")
-            return "No schema available."
-
-        schema = "Database Schema (EXACT STRUCTURE):\n"
-        for table in tables:
-            table_name = table[0]
-            schema += f"{table_name}:\n"
-            cursor.execute(f"PRAGMA table_info({table_name});")
-            columns = cursor.fetchall()
-            for column in columns:
-                column_name = column[1]
-                column_type = column[2]
-                schema += f"  - {column_name} ({column_type})\n"
-            schema += "\n"
-
-        conn.close()
-        return schema
+            return None
+
+        return catalog
     except Exception as e:
         st.error(f"Error fetching database schema: {e}")
-        return "Error fetching schema."
+        return None
 
-def generate_prompt():
-    schema = fetch_database_schema()
-    if "Error" in schema or "No schema available" in schema:
+# Build the SQL prompt for one question: only the tables and columns it
+# needs, plus the closest verified examples (see prompt_builder.py)
+def generate_prompt(question):
+    catalog = fetch_database_catalog()
+    if catalog is None:
         st.error("Failed to generate prompt due to schema issues.")
         return None
 
-    prompt = f"""
-    You are an expert SQLite query generator that converts natural language to perfect SQL queries for the following exact schema:
-
-    {schema}
-
-    **Strict Generation Rules:**
-    1. Use ONLY these exact table and column names - never modify or guess names.
-    2. For date operations, use SQLite DATE functions.
-    3. For monetary calculations, include discount properly: (Quantity * Unit_Price * (1 - Discount)).
-    4. Always use explicit JOINs with ON clauses for relationships.
-
-    **Output Requirements:**
-    - ONLY executable SQL code.
-    - NO markdown formatting.
-    - NO database labels.
-    - NO comments or explanations.
-    - NO trailing semicolons.
-
-    **Error Prevention:**
-    1. Never use table/column names not in the provided schema.
-    2. Always verify joins use correct foreign keys.
-    3. For date filtering, use: DATE('now') or strftime().
-    4. For status checks, use exact values like 'Failed' (with quotes).
-
-    **Validation Steps (MUST DO):**
-    1. Verify all table/column names match the exact schema.
-    2. Check all JOINs use correct foreign key relationships.
-    3. Ensure monetary calculations include discount.
-    4. Confirm date operations use SQLite functions.
-    5. Remove any non-SQL text.
-
-    **Examples:**
-
-    Natural language: Show all customers who placed an order in the last 30 days  
-    SQL:
-    SELECT DISTINCT Customers.CustomerID, Customers.CustomerName  
-    FROM Orders  
-    JOIN Customers ON Orders.CustomerID = Customers.CustomerID  
-    WHERE DATE(Orders.OrderDate) >= DATE('now', '-30 days')
-
-    Natural language: Find total revenue per product after discounts  
-    SQL:
-    SELECT Products.ProductName, SUM(Order_Details.Quantity * Order_Details.Unit_Price * (1 - Order_Details.Discount)) AS TotalRevenue  
-    FROM Order_Details  
-    JOIN Products ON Order_Details.ProductID = Products.ProductID  
-    GROUP BY Products.ProductID
-
-    Natural language: Get list of employees who processed more than 10 orders  
-    SQL:
-    SELECT Employees.EmployeeID, Employees.EmployeeName, COUNT(Orders.OrderID) AS TotalOrders  
-    FROM Orders  
-    JOIN Employees ON Orders.EmployeeID = Employees.EmployeeID  
-    GROUP BY Employees.EmployeeID  
-    HAVING COUNT(Orders.OrderID) > 10
-
-    Natural language: List all orders with status 'Failed'  
-    SQL:
-    SELECT *  
-    FROM Orders  
-    WHERE Orders.Status = 'Failed'
-
-    Natural language: Retrieve the average discount given per product  
-    SQL:
-    SELECT Products.ProductName, AVG(Order_Details.Discount) AS AvgDiscount  
-    FROM Order_Details  
-    JOIN Products ON Order_Details.ProductID = Products.ProductID  
-    GROUP BY Products.ProductID
-    """
-    return prompt
+    try:
+        return sql_prompt(question, catalog)
+    except Exception as e:
+        st.error(f"Error building prompt: {e}")
+        return None
+
+# Answer templated questions ("failed transactions by payment mode") locally,
+# without calling Gemini; None means the question needs the model
+def get_fast_path_sql(question):
+    catalog = fetch_database_catalog()
+    if catalog is None:
+        return None
+    try:
+        return match_fast_path(question, catalog)
+    except Exception as e:
+        st.error(f"Error matching question locally: {e}")
+        return None
 
 def get_gemini_response(question, prompt, history):
     try:
@@ -130,54 +75,50 @@ def get_gemini_response(question, prompt, history):
             st.error("Prompt is empty. Cannot generate response.")
             return None
 
-        # Build the history context
-        history_context = ""
-        for i, entry in enumerate(history[-3:], 1):  # Include up to the last 3 interactions
-            history_context += f"""
-            Previous Question {i}:
-            {entry['input']}
+        # Served from the response cache for repeated and near-duplicate questions
+        response, source = request_sql(question, prompt, history)
+        return response
+    except Exception as e:
+        st.error(f"Error generating response from Gemini: {e}")
+        return None
 
-            SQL Query {i}:
-            {entry['sql_query']}
+# Validate generated SQL on a pooled connection; raises SQLValidationError
+def check_generated_sql(sql_query):
+    return check_sql(sql_query)
 
-            Result {i}:
-            {pd.DataFrame(entry['result']).head(5).to_string(index=False)}  # Show only the first 5 rows
-            """
+# Ask Gemini to fix a query that failed validation
+def get_gemini_repair(question, prompt, sql_query, error):
+    try:
+        return request_repair(question, prompt, sql_query, error)
+    except Exception as e:
+        st.error(f"Error correcting SQL with Gemini: {e}")
+        return None
 
-        # Combine the history context with the current question
-        full_prompt = f"""
-        {prompt}
+# Drop a cached Gemini response whose SQL cannot run, so it is not served again
+def discard_cached_response(question, response):
+    get_response_cache().discard(
+        question,
+        history_fingerprint(prompt_history(st.session_state.history, question)),
+        schema_fingerprint("sales_database.db"),
+        response,
+    )
 
-        Conversation History:
-        {history_context}
+def report_speech_error(error):
+    import speech_recognition as sr
 
-        Current Question:
-        {question}
-        """
+    if isinstance(error, sr.UnknownValueError):
+        st.error("❌ Could not understand the audio. Please try again.")
+    elif isinstance(error, sr.RequestError):
+        st.error(f"❌ Could not request results from Google Speech Recognition service; {error}")
+    else:
+        st.error(f"❌ An error occurred: {error}")
 
-        # Send the full prompt to Gemini
-        model = genai.GenerativeModel('gemini-2.0-flash')
-        response = model.generate_content([full_prompt])
-        return response.text
+# Function to convert a clip recorded in the browser to text
+def speech_to_text(recording):
+    try:
+        return recognize_wav(recording)
     except Exception as e:
-        st.error(f"Error generating response from Gemini: {e}")
-        return None
-
-# Function to convert speech to text
-def speech_to_text():
-    recognizer = sr.Recognizer()
-    with sr.Microphone() as source:
-        st.info("🎙️ Listening... Please speak your question.")
-        try:
-            audio = recognizer.listen(source, timeout=12)  # Listen for 12 seconds
-            text = recognizer.recognize_google(audio)  # Use Google Speech Recognition
-            return text
-        except sr.UnknownValueError:
-            st.error("❌ Could not understand the audio. Please try again.")
-        except sr.RequestError as e:
-            st.error(f"❌ Could not request results from Google Speech Recognition service; {e}")
-        except Exception as e:
-            st.error(f"❌ An error occurred: {e}")
+        report_speech_error(e)
     return ""
 # def speech_to_text():
 #     recognizer = sr.Recognizer()
@@ -196,8 +137,7 @@ def speech_to_text():
 
 
 # Function to handle speech input for both questions and visualization types
-def handle_speech_input():
-    recognized_text = speech_to_text()
+def handle_speech_input(recognized_text):
     if recognized_text:
         # Map recognized text to visualization types
         visualization_mapping = {
@@ -220,6 +160,59 @@ def handle_speech_input():
         st.session_state.user_question = recognized_text
         st.success(f"✅ Your question: {recognized_text}")
 
+# Speech input captured in the browser. With streamlit-webrtc, audio streams
+# to the server as the user speaks and recognition finishes when they stop
+# talking; a fragment polls for the result without holding a script thread.
+# Without it, a clip is recorded in the browser and recognized when it ends.
+def show_voice_input():
+    try:
+        # Live browser audio capture; loads aiortc and av, so only when the input is shown
+        from streamlit_webrtc import webrtc_streamer, WebRtcMode
+    except ImportError:
+        webrtc_streamer = None
+    if webrtc_streamer is None:
+        recording = st.audio_input("🎤 Speak Your Question")
+        if recording is not None and recording.file_id != st.session_state.get("speech_file_id"):
+            st.session_state.speech_file_id = recording.file_id  # Recognize each recording once
+            with st.spinner("Recognizing..."):
+                handle_speech_input(speech_to_text(recording.getvalue()))
+        return
+
+    if "voice_listener" not in st.session_state:
+        st.session_state.voice_listener = VoiceListener()
+    listener = st.session_state.voice_listener
+    ctx = webrtc_streamer(
+        key="speech",
+        mode=WebRtcMode.SENDRECV,
+        audio_frame_callback=listener.on_frame,
+        sendback_audio=False,
+        media_stream_constraints={"audio": True, "video": False},
+        rtc_configuration={"iceServers": [{"urls": ["stun:stun.l.google.com:19302"]}]},
+    )
+    if not ctx.state.playing:
+        listener.stop()  # Recognize whatever was said before the user pressed stop
+    polling = ctx.state.playing or listener.status() in ("listening", "recognizing")
+
+    @st.fragment(run_every=0.5 if polling else None)
+    def poll_voice_input():
+        text, error = listener.take_result()
+        if error is not None or text:
+            st.session_state.speech_error = error  # Shown until the next utterance
+        if text:
+            handle_speech_input(text)
+            st.rerun()
+        if st.session_state.get("speech_error") is not None:
+            report_speech_error(st.session_state.speech_error)
+        status = listener.status()
+        if ctx.state.playing and status == "waiting":
+            st.info("🎙️ Listening... Please speak your question.")
+        elif status == "listening":
+            st.info("🎙️ Hearing you...")
+        elif status == "recognizing":
+            st.info("⏳ Recognizing...")
+
+    poll_voice_input()
+
 # Function to convert text to speech
 # def text_to_speech(text):
 #     try:
@@ -229,44 +222,161 @@ def handle_speech_input():
 #     except Exception as e:
 #         st.error(f"Error in text-to-speech conversion: {e}")
 
-from gtts import gTTS
-from io import BytesIO
-import streamlit as st
+INTRO_MESSAGE = (
+    "Hello! I’m your assistant here to help you communicate with your database. "
+    "Click the button and tell me what data you need, along with your query. "
+    "I can also help visualize the results if you'd like."
+)
+
+# Background job: synthesize the introductory message
+async def speak_intro(job):
+    job.publish("audio_parts", await asyncio.to_thread(
+        lambda: list(synthesize_chunks(INTRO_MESSAGE, cancel=job.cancel_event))
+    ))
+
+# Speak the introductory message once per session. The first render only
+# places a polling fragment; its next run, after the page is out, starts the
+# synthesis in the background, so the first page neither loads the TTS
+# engine nor waits for the service. When the audio is ready the page reruns
+# and plays it.
+def show_intro_audio():
+    job = st.session_state.get("intro_job")
+    if job is not None and job.done():
+        st.session_state.intro_message_spoken = True
+        if job.error() is not None:
+            st.error(f"Error in text-to-speech: {job.error()}")
+        for audio, mime in job.partial.get("audio_parts", []):
+            st.audio(audio, format=mime)  # Auto plays
+        return
+
+    @st.fragment(run_every=0.5)
+    def poll_intro_audio():
+        if not st.session_state.get("intro_page_out"):
+            st.session_state.intro_page_out = True
+            return
+        job = get_pipeline().submit(st.session_state.session_id, "intro", INTRO_MESSAGE, speak_intro)
+        st.session_state.intro_job = job
+        if job.done():
+            st.rerun()
+
+    poll_intro_audio()
 
-def text_to_speech(text):
-    try:
-        tts = gTTS(text)
-        fp = BytesIO()
-        tts.write_to_fp(fp)
-        st.audio(fp.getvalue(), format='audio/mp3')  # Auto plays
-    except Exception as e:
-        st.error(f"Error in text-to-speech: {e}")
 
 
-
-# Function to generate a summary of the SQL query output using Gemini
 def get_gemini_summary(dataframe, user_question):
     try:
-        # Convert the DataFrame to a string representation for the prompt
-        data_preview = dataframe.head(10).to_string(index=False)  # Show only the first 10 rows
-        prompt = f"""
-        You are an expert data summarizer. Summarize the following data in a concise and meaningful way.
-
-        User Question:
-        {user_question}
-
-        Data Preview:
-        {data_preview}
-
-        Provide a summary that highlights key insights, trends, or patterns in the data.
-        """
-        model = genai.GenerativeModel('gemini-2.0-flash')
-        response = model.generate_content([prompt])
-        return response.text
+        return generate_summary(dataframe, user_question)
     except Exception as e:
         st.error(f"Error generating summary from Gemini: {e}")
         return None
 
+# Background job: summarize the result, publish the summary as soon as it is
+# ready, then synthesize it to audio, publishing each chunk as it is ready.
+# The worker threads stop at the next stream or audio chunk once the job is
+# cancelled. A speech failure is published as audio_error, apart from the
+# summary.
+async def summarize_and_speak(job, dataframe, user_question, trace=None):
+    if trace is not None:
+        restore(trace)  # Attribute the summary and audio spans to the question's trace
+    summary = await asyncio.to_thread(
+        generate_summary, dataframe, user_question, lambda text: job.publish("summary_text", text), job.cancel_event
+    )
+    job.publish("summary", summary)
+    if summary:
+        def speak():
+            parts = []
+            for part in synthesize_chunks(summary, cancel=job.cancel_event):
+                parts = parts + [part]  # A new list, so the page never sees one being appended to
+                job.publish("audio_parts", parts)
+
+        try:
+            await asyncio.to_thread(speak)
+        except Exception as e:
+            job.publish("audio_error", e)
+    job.publish("audio_done", True)
+
+# Wait until a background job has published `name` (or until() is true, or
+# the job finished), calling on_tick while waiting. Reading session_state lets
+# Streamlit stop this run as soon as the user interacts.
+def wait_for(job, name=None, on_tick=None, poll=0.05, until=None):
+    def ready():
+        if until is not None:
+            return until()
+        return name is not None and name in job.partial
+
+    while not job.done() and not ready():
+        st.session_state.get("session_id")
+        if on_tick is not None:
+            on_tick()
+        time.sleep(poll)
+
+# Rows sent to the browser per page of the table view
+PAGE_ROWS = 100
+
+# Function to show a DataFrame one page at a time
+def show_paged_dataframe(df, key):
+    pages = max(1, -(-len(df) // PAGE_ROWS))
+    page = 1
+    if pages > 1:
+        page = st.number_input(f"Page (of {pages})", min_value=1, max_value=pages, value=1, step=1, key=key)
+    start = (page - 1) * PAGE_ROWS
+    st.dataframe(df.iloc[start:start + PAGE_ROWS])
+    if pages > 1:
+        st.caption(f"Rows {start + 1}–{min(start + PAGE_ROWS, len(df))} of {len(df)}")
+
+# Sidebar dataset browser: one table at a time, paged on the server, with
+# column profiles that are computed once per data version
+def show_dataset_browser():
+    catalog = fetch_database_catalog()
+    if not catalog:
+        return
+    table_name = st.selectbox("Table", list(catalog["tables"]), key="browse_table")
+    st.caption(f"{catalog['tables'][table_name]['row_count']} rows")
+    view = st.radio("Show", ["Rows", "Column profile"], horizontal=True, key="browse_view")
+    try:
+        if view == "Column profile":
+            st.dataframe(pd.DataFrame(get_column_profiles(table_name)), hide_index=True)
+            return
+        # Start rowids of the pages visited so far, for the Previous button
+        cursors = st.session_state.setdefault("browse_cursors", {}).setdefault(table_name, [None])
+        page, next_after = fetch_page(table_name, after=cursors[-1])
+        st.dataframe(page, hide_index=True)
+        previous, following = st.columns(2)
+        if previous.button("◀ Previous", disabled=len(cursors) == 1, key="browse_previous"):
+            cursors.pop()
+            st.rerun()
+        if following.button("Next ▶", disabled=next_after is None, key="browse_next"):
+            cursors.append(next_after)
+            st.rerun()
+        st.caption(f"Page {len(cursors)}")
+    except Exception as e:
+        st.error(f"Error loading {table_name}: {e}")
+
+# Sidebar panel with p50/p95 latency per pipeline stage and trace/metric export
+def show_latency_panel(session_id):
+    tracer = get_tracer()
+    st.markdown("---")
+    with st.expander("⏱️ Latency by stage"):
+        scope = st.radio("Scope", ["This session", "All sessions"], horizontal=True, key="latency_scope")
+        stats = tracer.stage_stats(session_id if scope == "This session" else None)
+        if stats:
+            rows = [
+                {"Stage": name, "Count": values["count"], "p50 (ms)": round(values["p50"], 1),
+                 "p95 (ms)": round(values["p95"], 1), "Last (ms)": round(values["last"], 1)}
+                for name, values in sorted(stats.items(), key=lambda item: item[1]["p95"], reverse=True)
+            ]
+            st.dataframe(pd.DataFrame(rows), hide_index=True)
+        else:
+            st.write("No timings recorded yet.")
+        st.download_button(
+            "Download traces (OpenTelemetry JSON)", tracer.to_otel_json(),
+            file_name="speak2db-traces.json", mime="application/json",
+        )
+        st.download_button(
+            "Download metrics (Prometheus)", tracer.to_prometheus(),
+            file_name="speak2db-metrics.prom", mime="text/plain",
+        )
+
 def main():
     st.set_page_config(page_title="Gemini SQL Query Generator", layout="wide")
 
@@ -298,6 +408,9 @@ def main():
     # Initialize session state for history and introductory message
     if "history" not in st.session_state:
         st.session_state.history = []  # Initialize history as an empty list
+    if "session_id" not in st.session_state:
+        st.session_state.session_id = uuid.uuid4().hex  # Owner of this session's spilled results
+    set_session(st.session_state.session_id)  # Spans of this run count towards the session's latency
     if "intro_message_spoken" not in st.session_state:
         st.session_state.intro_message_spoken = False  # Track if the intro message has been spoken
 
@@ -307,31 +420,9 @@ def main():
     # Sidebar content
     with st.sidebar:
         st.title("Dataset Reference")
-        # Add a link to reference the dataset
-        with st.expander("📂 Click here to reference the dataset"):
-            st.subheader("CustomerTable")
-            conn = sqlite3.connect("sales_database.db")
-            try:
-                customer_data = pd.read_sql_query("SELECT * FROM CustomerTable", conn)
-                st.dataframe(customer_data)
-            except Exception as e:
-                st.error("Error loading CustomerTable: " + str(e))
-
-            st.subheader("SalesTable")
-            try:
-                sales_data = pd.read_sql_query("SELECT * FROM SalesTable", conn)
-                st.dataframe(sales_data)
-            except Exception as e:
-                st.error("Error loading SalesTable: " + str(e))
-
-            st.subheader("TransactionLog")
-            try:
-                transaction_data = pd.read_sql_query("SELECT * FROM TransactionLog", conn)
-                st.dataframe(transaction_data)
-            except Exception as e:
-                st.error("Error loading TransactionLog: " + str(e))
-
-            conn.close()
+        # The browser only queries the database while it is switched on
+        if st.toggle("📂 Browse the dataset", key="browse_dataset"):
+            show_dataset_browser()
         st.markdown("---")
         st.info("Conversation History")
         st.caption("This section shows the last 5 interactions with the app.")
@@ -343,10 +434,16 @@ def main():
                     # Display the SQL query
                     st.markdown(f"**SQL Query:**\n```sql\n{entry['sql_query']}\n```")
 
-                    # Display the database result as a table
-                    st.markdown("**Result:**")
-                    result_df = pd.DataFrame(entry["result"])  # Convert the stored dictionary back to a DataFrame
-                    st.dataframe(result_df)
+                    # Display the preview, and the full result only when asked for
+                    st.markdown(f"**Result:** {entry['row_count']} rows")
+                    if entry["result_id"] and st.checkbox("Load full result", key=f"load_{entry['result_id']}"):
+                        result_df = load_result(entry, get_history_store())
+                        if result_df is None:
+                            st.info("The full result is no longer stored. Ask the question again to see it.")
+                        else:
+                            show_paged_dataframe(result_df, key=f"page_{entry['result_id']}")
+                    else:
+                        st.dataframe(pd.DataFrame(entry["preview"], columns=entry["columns"]))
 
                     # Display the summary output
                     if "output" in entry:
@@ -361,9 +458,8 @@ def main():
     if "user_question" not in st.session_state:
         st.session_state.user_question = ""  # Initialize with an empty string
 
-    # Add a button for speech-to-text input
-    if st.button("🎤 Speak Your Question"):
-        handle_speech_input()
+    # Speech-to-text input
+    show_voice_input()
 
     # Editable text input field
     user_question = st.text_input(
@@ -382,56 +478,143 @@ def main():
         st.session_state.intro_message_spoken = False
 
     if not st.session_state.intro_message_spoken:
-        intro_message = (
-            "Hello! I’m your assistant here to help you communicate with your database. "
-            "Click the button and tell me what data you need, along with your query. "
-            "I can also help visualize the results if you'd like."
-        )
-        text_to_speech(intro_message)
-    st.session_state.intro_message_spoken = True
+        show_intro_audio()
+
+    # The page is out; load what the first question needs while the user types
+    warm_up("sales_database.db", modules=("plotly.express", "speech_recognition"))
 
     df = pd.DataFrame()  # Initialize df to avoid reference before assignment
+    summary_job = None
+
+    # A new question cancels background work still running for the previous one
+    if user_question != st.session_state.get("last_question"):
+        get_pipeline().cancel_session(st.session_state.session_id)
+        st.session_state.last_question = user_question
 
     # Generate and Run SQL
     if user_question:
-        with st.spinner("Generating SQL query using Gemini..."):
-            try:
-                # Generate the prompt
-                prompt = generate_prompt()
-                if not prompt:
-                    st.error("Failed to generate prompt. Please check the database schema.")
-                    return
-
-                # Pass the history to the Gemini response function
-                response = get_gemini_response(user_question, prompt, st.session_state.history)
-                if not response:
-                    st.error("Failed to generate response from Gemini.")
-                    return
+        new_trace()
+        # This run replaces the previous one: stop its query if it is still running
+        get_governor().cancel_session(st.session_state.session_id)
+        # Templated questions are answered by the local intent engine with
+        # parameterized SQL; everything else goes to Gemini
+        intent = get_fast_path_sql(user_question)
+        response = None
+        if intent:
+            sql_query = render_sql(intent["sql"], intent["params"])
+            st.subheader("📝 Generated SQL Query")
+            st.code(sql_query, language="sql")
+            st.caption("⚡ Answered locally without calling Gemini.")
+        else:
+            with st.spinner("Generating SQL query using Gemini..."):
+                try:
+                    # Generate the prompt
+                    prompt = generate_prompt(user_question)
+                    if not prompt:
+                        st.error("Failed to generate prompt. Please check the database schema.")
+                        return
+
+                    # Pass the history to the Gemini response function
+                    history = prompt_history(st.session_state.history, user_question)
+                    response = get_gemini_response(user_question, prompt, history)
+                    if not response:
+                        st.error("Failed to generate response from Gemini.")
+                        return
                 
-                # Clean the SQL query
-                sql_query1 = response.strip().replace("sqlite", "").strip("```").strip()
-                sql_query = sql_query1.replace("sql", "")  # Remove sql from the query
-
-                st.subheader("📝 Generated SQL Query")
-                st.code(sql_query, language="sql")
-            except Exception as e:
-                st.error(f"Error generating SQL: {e}")
-                st.stop()
-
-        with st.spinner("📡 Executing query on SQLite..."):
+                    # Extract the first statement and check it against the schema
+                    # before it reaches the database
+                    sql_query = extract_sql(response)
+                    try:
+                        check_generated_sql(sql_query)
+                    except SQLValidationError as e:
+                        # One targeted self-repair attempt with the validation error
+                        st.warning(f"⚠️ {e} — asking Gemini to correct the query...")
+                        repaired = get_gemini_repair(user_question, prompt, sql_query, str(e))
+                        if not repaired:
+                            st.error("Failed to correct the generated SQL.")
+                            return
+                        sql_query = extract_sql(repaired)
+                        cache_key = (
+                            user_question,
+                            history_fingerprint(history),
+                            schema_fingerprint("sales_database.db"),
+                        )
+                        get_response_cache().discard(*cache_key, response)
+                        try:
+                            check_generated_sql(sql_query)
+                        except SQLValidationError as e:
+                            st.code(sql_query, language="sql")
+                            st.error(f"Generated SQL was rejected: {e}")
+                            return
+                        get_response_cache().put(*cache_key, sql_query)
+                        response = sql_query
+
+                    st.subheader("📝 Generated SQL Query")
+                    st.code(sql_query, language="sql")
+                except Exception as e:
+                    st.error(f"Error generating SQL: {e}")
+                    st.stop()
+
+        # Fast path SQL is written for SQLite; Gemini's runs on the engine it
+        # was prompted for (SPEAK2DB_QUERY_BACKEND)
+        backend = "sqlite" if intent else QUERY_BACKEND
+        engine = get_engine("sales_database.db", backend)
+        with st.spinner(f"📡 Executing query on {engine.name}..."):
             try:
-                conn = sqlite3.connect("sales_database.db")
-                df = pd.read_sql_query(sql_query, conn)
-                conn.close()
+                # Reruns (e.g. changing the chart axis) are served from the result cache
+                # Show the first batch while the rest of the result is fetched
+                first_page = st.empty()
+
+                run_sql, run_params = intent["sql"] if intent else sql_query, intent["params"] if intent else None
+                if backend == "sqlite":
+                    # Aggregates over the fact tables are answered from the rollup
+                    # tables when one gives the same result (see rollups.py)
+                    run_sql, run_params = rewrite_query(run_sql, run_params, "sales_database.db")
+
+                def execute():
+                    return engine.query_capped(
+                        run_sql,
+                        run_params,
+                        on_first_batch=lambda part: first_page.dataframe(part.head(PAGE_ROWS)),
+                    )
+
+                df = get_result_cache().fetch(sql_query, execute, backend=backend)
+                if backend == "sqlite":
+                    # Feeds the index advisor, counting results served from the cache too
+                    record_query(sql_query)
+                first_page.empty()
                 st.success("✅ Query executed successfully!")
 
-                # Add the SQL query and result to history
-                st.session_state.history.append({
-                    "input": user_question,
-                    "sql_query": sql_query,
-                    "result": df.to_dict()  # Convert DataFrame to a dictionary for storage
-                })
+                # Add the SQL query and result to history, once per question
+                # Only a preview stays in session state, the full result is spilled to disk
+                if not is_latest_entry(st.session_state.history, user_question, sql_query):
+                    store = get_history_store()
+                    append_entry(
+                        st.session_state.history,
+                        make_entry(user_question, sql_query, df, store, st.session_state.session_id),
+                        store,
+                    )
+
+                # Summary and audio are produced in the background while the
+                # table and chart render. A new question cancels the old job;
+                # reruns for the same question reuse its results.
+                if not df.empty:
+                    summary_job = get_pipeline().submit(
+                        st.session_state.session_id, "summary", (user_question, sql_query),
+                        lambda job, result=df, trace=capture(): summarize_and_speak(job, result, user_question, trace),
+                    )
+            except QueryKilledError as e:
+                if e.reason == "superseded":
+                    st.stop()  # A newer run of this session took over
+                # A query over its budget would be killed again; refusals are transient
+                if response and e.reason in ("timeout", "steps"):
+                    discard_cached_response(user_question, response)
+                st.error(f"⏱️ {e}")
+                st.stop()
             except Exception as e:
+                # Do not keep serving a cached query that fails to run
+                if response:
+                    discard_cached_response(user_question, response)
                 st.error(f"SQL Execution Error: {e}")
                 st.stop()
 
@@ -439,7 +622,14 @@ def main():
     if not df.empty:
         # Always show the table view
         st.subheader("📋 Table View of the Data")
-        st.dataframe(df)
+        if df.attrs.get("truncated") == "rows":
+            st.warning(f"⚠️ Result truncated at {len(df)} rows (row limit {df.attrs['row_limit']}).")
+        elif df.attrs.get("truncated") == "bytes":
+            st.warning(
+                f"⚠️ Result truncated at {len(df)} rows "
+                f"(size limit {df.attrs['byte_limit'] // (1024 * 1024)} MB)."
+            )
+        show_paged_dataframe(df, key="result_page")
 
         # Handle single-number or single-cell result
         if df.shape == (1, 1):
@@ -468,18 +658,31 @@ def main():
                         y_col = st.selectbox("Y-axis", df.columns, index=1)
                         theme_color = st.color_picker("🎨 Pick a chart color", "#636EFA")
 
+                        # Large results are aggregated or downsampled before plotting,
+                        # so the figure sent to the browser stays small
+                        chart_df, chart_note = prepare_chart_data(
+                            df, x_col, y_col, output_type,
+                            intent["sql"] if intent else sql_query, intent["params"] if intent else None,
+                            backend=backend,
+                        )
+                        import plotly.express as px  # Loaded with the first chart, not at start-up
+
                         if output_type == "Bar Chart":
-                            fig = px.bar(df, x=x_col, y=y_col, color_discrete_sequence=[theme_color])
+                            fig = px.bar(chart_df, x=x_col, y=y_col, color_discrete_sequence=[theme_color])
                         elif output_type == "Line Chart":
-                            fig = px.line(df, x=x_col, y=y_col, color_discrete_sequence=[theme_color])
+                            fig = px.line(chart_df, x=x_col, y=y_col, color_discrete_sequence=[theme_color])
                         elif output_type == "Pie Chart":
-                            fig = px.pie(df, names=x_col, values=y_col)
+                            fig = px.pie(chart_df, names=x_col, values=y_col)
                         elif output_type == "Area Chart":
-                            fig = px.area(df, x=x_col, y=y_col, color_discrete_sequence=[theme_color])
+                            fig = px.area(chart_df, x=x_col, y=y_col, color_discrete_sequence=[theme_color])
                         elif output_type == "Histogram":
-                            fig = px.histogram(df, x=y_col, nbins=20, color_discrete_sequence=[theme_color])
+                            fig = px.bar(chart_df, x=y_col, y="count", color_discrete_sequence=[theme_color])
+                            fig.update_layout(bargap=0)
 
-                        st.plotly_chart(fig, use_container_width=True)
+                        if chart_note:
+                            st.caption(chart_note)
+                        with span("chart", **{"chart.type": output_type, "db.rows": len(chart_df)}):
+                            st.plotly_chart(fig, use_container_width=True)
 
             else:
                 # Summary section
@@ -492,17 +695,48 @@ def main():
                 else:
                     st.info("Not enough data to summarize.")
 
-    # Generate and display the summary using Gemini
-    if not df.empty:  # Ensure the DataFrame is not empty
+    # Display the summary and its audio as the background job produces them
+    if summary_job is not None:
         st.subheader("📄 Summary of the Output")
+        summary_placeholder = st.empty()
+        streamed = {"text": ""}
+
+        # Render summary tokens as they stream in
+        def show_partial_summary():
+            text = summary_job.partial.get("summary_text", "")
+            if text != streamed["text"]:
+                summary_placeholder.write(text)
+                streamed["text"] = text
+
         with st.spinner("Generating summary using Gemini..."):
-            summary = get_gemini_summary(df, user_question)  # Generate the summary
-            if summary:
-                st.write(summary)  # Display the summary
-                # Automatically play the summary as audio
-                text_to_speech(summary)
-                # Update the history with the summary
-                st.session_state.history[-1]["output"] = summary  # Add the summary to the last history entry
+            wait_for(summary_job, "summary", on_tick=show_partial_summary)
+        summary = summary_job.partial.get("summary")
+        if summary:
+            summary_placeholder.write(summary)  # Display the summary
+            # Update the history with the summary
+            st.session_state.history[-1]["output"] = summary  # Add the summary to the last history entry
+            # Play the summary as audio, showing each chunk as soon as it is synthesized
+            shown = 0
+            with st.spinner("Generating audio..."):
+                while True:
+                    wait_for(
+                        summary_job,
+                        until=lambda: len(summary_job.partial.get("audio_parts", ())) > shown
+                        or "audio_done" in summary_job.partial,
+                    )
+                    parts = summary_job.partial.get("audio_parts", [])
+                    for audio, mime in parts[shown:]:
+                        st.audio(audio, format=mime)  # Auto plays
+                    shown = len(parts)
+                    if "audio_done" in summary_job.partial or summary_job.done():
+                        break
+        if summary_job.partial.get("audio_error") is not None:
+            st.error(f"Error generating speech: {summary_job.partial['audio_error']}")
+        if summary_job.error():
+            st.error(f"Error generating summary: {summary_job.error()}")
+
+    with st.sidebar:
+        show_latency_panel(st.session_state.session_id)
 
 
 # Run the main function
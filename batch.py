@@ -0,0 +1,250 @@
+import argparse
+import asyncio
+import csv
+import hashlib
+import json
+import os
+import random
+import re
+import sys
+import time
+
+from db_engine import get_engine
+from llm_cache import normalize_question
+from model_backend import transient_errors
+from nl2sql import DB_PATH, generate_sql
+
+# Headless question -> SQL -> result runs, e.g. to pre-warm the response
+# cache before business hours or to run a nightly regression set:
+#
+#   python batch.py questions.txt --out results.jsonl
+#   python batch.py questions.jsonl --out results.parquet --concurrency 8
+#   python batch.py questions.txt --no-execute  # only generate (cache warm-up)
+
+BATCH_CONCURRENCY = int(os.getenv("SPEAK2DB_BATCH_CONCURRENCY", "4"))
+BATCH_SIZE = 50  # Questions read, answered and written out together
+MAX_RETRIES = 4
+RETRY_BASE_DELAY = 2.0  # Seconds before the first retry; doubles per attempt
+RETRY_MAX_DELAY = 60.0
+
+
+# Questions from a .txt (one per line, # comments), .jsonl ({"question",
+# optional "id"}) or .csv (a "question" column, optional "id") file.
+# Returns [{"id", "question"}].
+def read_questions(path):
+    questions = []
+    with open(path, newline="", encoding="utf-8") as f:
+        if path.endswith(".jsonl"):
+            rows = [json.loads(line) for line in f if line.strip()]
+        elif path.endswith(".csv"):
+            rows = list(csv.DictReader(f))
+        else:
+            rows = [{"question": line.strip()} for line in f if line.strip() and not line.lstrip().startswith("#")]
+    for number, row in enumerate(rows, 1):
+        question = (row.get("question") or "").strip()
+        if question:
+            questions.append({"id": str(row.get("id") or number), "question": question})
+    return questions
+
+
+# Seconds to wait before retrying: the server's retry hint when it gives
+# one, otherwise exponential backoff with jitter
+def retry_delay(error, attempt):
+    hint = re.search(r"retry(?:_delay)?\D{0,20}?(\d+(?:\.\d+)?)\s*s", str(error), re.I)
+    if hint:
+        return min(float(hint.group(1)), RETRY_MAX_DELAY)
+    delay = min(RETRY_BASE_DELAY * 2 ** attempt, RETRY_MAX_DELAY)
+    return delay / 2 + random.uniform(0, delay / 2)
+
+
+# Stable digest of a result's rows, so regression runs can spot changed answers
+def result_hash(df):
+    digest = hashlib.sha1(json.dumps(list(df.columns)).encode())
+    for row in df.itertuples(index=False, name=None):
+        digest.update(json.dumps(row, default=str).encode())
+    return digest.hexdigest()
+
+
+# Generate (and optionally run) the SQL for one question. Never raises: the
+# record's status is "ok" or "error".
+def answer_question(question, db_path=DB_PATH, execute=True, sample_rows=0):
+    record = {"question": question, "status": "ok", "error": None, "sql": None, "source": None}
+    started = time.perf_counter()
+    try:
+        generated = generate_sql(question, db_path=db_path)
+        record["sql"] = generated["sql"]
+        record["source"] = generated["source"]
+        record["generate_ms"] = round((time.perf_counter() - started) * 1000, 1)
+        if execute:
+            executed = time.perf_counter()
+            df = get_engine(db_path, generated["backend"]).query_capped(generated["query"], generated["params"])
+            record["execute_ms"] = round((time.perf_counter() - executed) * 1000, 1)
+            record["row_count"] = len(df)
+            record["columns"] = list(df.columns)
+            record["truncated"] = df.attrs.get("truncated")
+            record["result_hash"] = result_hash(df)
+            if sample_rows:
+                record["rows"] = json.loads(df.head(sample_rows).to_json(orient="values", date_format="iso"))
+    except Exception as e:
+        # Rate limits and transient server failures are retried by BatchRunner
+        if isinstance(e, transient_errors()[0]):
+            raise
+        record["status"] = "error"
+        record["error"] = f"{type(e).__name__}: {e}"
+    record["total_ms"] = round((time.perf_counter() - started) * 1000, 1)
+    return record
+
+
+class BatchRunner:
+    def __init__(self, db_path=DB_PATH, concurrency=BATCH_CONCURRENCY, max_retries=MAX_RETRIES,
+                 execute=True, sample_rows=0):
+        self.db_path = db_path
+        self.concurrency = concurrency
+        self.max_retries = max_retries
+        self.execute = execute
+        self.sample_rows = sample_rows
+        self._paused_until = 0.0  # A rate limit pauses every worker, not just the one that hit it
+
+    async def _answer(self, question, semaphore):
+        attempt = 0
+        while True:
+            async with semaphore:
+                wait = self._paused_until - time.monotonic()
+                if wait > 0:
+                    await asyncio.sleep(wait)
+                try:
+                    record = await asyncio.to_thread(
+                        answer_question, question, self.db_path, self.execute, self.sample_rows
+                    )
+                    record["attempts"] = attempt + 1
+                    return record
+                except Exception as e:
+                    retryable, rate_limits = transient_errors()
+                    if not isinstance(e, retryable):
+                        raise
+                    if attempt >= self.max_retries:
+                        return {
+                            "question": question, "status": "error", "error": f"{type(e).__name__}: {e}",
+                            "sql": None, "source": None, "attempts": attempt + 1,
+                        }
+                    delay = retry_delay(e, attempt)
+                    if isinstance(e, rate_limits):
+                        self._paused_until = max(self._paused_until, time.monotonic() + delay)
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    # Answer one batch of {"id", "question"} items; duplicate questions in a
+    # batch are generated and executed once
+    async def run_batch(self, items):
+        semaphore = asyncio.Semaphore(self.concurrency)
+        tasks = {}
+        for item in items:
+            key = normalize_question(item["question"])
+            if key not in tasks:
+                tasks[key] = asyncio.ensure_future(self._answer(item["question"], semaphore))
+        await asyncio.gather(*tasks.values())
+        records = []
+        for item in items:
+            record = dict(tasks[normalize_question(item["question"])].result())
+            record["id"] = item["id"]
+            record["question"] = item["question"]
+            records.append(record)
+        return records
+
+    # Answer items batch_size at a time, passing each batch's records to
+    # on_batch as soon as it is done. Returns every record, in input order.
+    def run(self, items, batch_size=BATCH_SIZE, on_batch=None):
+        async def run_all():
+            records = []
+            for start in range(0, len(items), batch_size):
+                batch = await self.run_batch(items[start:start + batch_size])
+                if on_batch is not None:
+                    on_batch(batch)
+                records.extend(batch)
+            return records
+
+        return asyncio.run(run_all())
+
+
+# Python API: answer a list of questions (strings or {"id", "question"}
+# dicts) and return one record per question
+def run_questions(questions, db_path=DB_PATH, concurrency=BATCH_CONCURRENCY, execute=True,
+                  max_retries=MAX_RETRIES, batch_size=BATCH_SIZE, sample_rows=0, on_batch=None):
+    items = [
+        question if isinstance(question, dict) else {"id": str(number), "question": question}
+        for number, question in enumerate(questions, 1)
+    ]
+    runner = BatchRunner(db_path, concurrency, max_retries, execute, sample_rows)
+    return runner.run(items, batch_size, on_batch)
+
+
+def write_parquet(records, path):
+    import pandas as pd
+
+    df = pd.DataFrame.from_records(records)
+    # Nested values do not have one Parquet type; store them as JSON text
+    for column in ("columns", "rows"):
+        if column in df:
+            df[column] = df[column].map(lambda value: None if value is None else json.dumps(value, default=str))
+    df.to_parquet(path, index=False)
+
+
+def print_summary(records, elapsed, out=sys.stderr):
+    errors = sum(1 for record in records if record["status"] != "ok")
+    sources = {}
+    for record in records:
+        if record.get("source"):
+            sources[record["source"]] = sources.get(record["source"], 0) + 1
+    times = sorted(record["total_ms"] for record in records if "total_ms" in record)
+    print(f"{len(records)} questions in {elapsed:.1f}s, {errors} errors", file=out)
+    print("Sources: " + ", ".join(f"{source} {count}" for source, count in sorted(sources.items())), file=out)
+    if times:
+        p50 = times[len(times) // 2]
+        p95 = times[min(len(times) - 1, int(len(times) * 0.95))]
+        print(f"Per question: p50 {p50:.0f} ms, p95 {p95:.0f} ms", file=out)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Answer a file of questions without the Streamlit UI")
+    parser.add_argument("questions", help=".txt (one per line), .jsonl or .csv file of questions")
+    parser.add_argument("--out", default="-", help="results file, .jsonl or .parquet (default: JSONL on stdout)")
+    parser.add_argument("--db", default=DB_PATH)
+    parser.add_argument("--concurrency", type=int, default=BATCH_CONCURRENCY)
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    parser.add_argument("--retries", type=int, default=MAX_RETRIES)
+    parser.add_argument("--rows", type=int, default=0, help="include up to this many result rows per question")
+    parser.add_argument("--no-execute", action="store_true", help="only generate SQL, e.g. to warm the cache")
+    args = parser.parse_args()
+
+    from dotenv import load_dotenv
+
+    load_dotenv()  # GOOGLE_API_KEY, read when the first Gemini model is created
+
+    items = read_questions(args.questions)
+    parquet = args.out.endswith(".parquet")
+    out = None
+    if not parquet:
+        out = sys.stdout if args.out == "-" else open(args.out, "w", encoding="utf-8")
+
+    def write_batch(batch):
+        if out is not None:
+            for record in batch:
+                out.write(json.dumps(record, default=str) + "\n")
+            out.flush()
+
+    started = time.perf_counter()
+    try:
+        records = run_questions(
+            items, args.db, args.concurrency, not args.no_execute, args.retries,
+            args.batch_size, args.rows, on_batch=write_batch,
+        )
+    finally:
+        if out is not None and out is not sys.stdout:
+            out.close()
+    if parquet:
+        write_parquet(records, args.out)
+    print_summary(records, time.perf_counter() - started)
+
+
+if __name__ == "__main__":
+    main()
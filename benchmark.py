@@ -0,0 +1,433 @@
+import argparse
+import json
+import os
+import re
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter
+
+# Benchmark runs get their own response cache and logs, so they neither
+# depend on nor disturb the app's, unless SPEAK2DB_CACHE_DIR is set
+os.environ.setdefault("SPEAK2DB_CACHE_DIR", tempfile.mkdtemp(prefix="speak2db-bench-"))
+
+from db_engine import get_engine
+from llm_cache import normalize_question
+from model_backend import set_backend, register_backend, StubModel
+from nl2sql import DB_PATH, generate_sql, generate_summary
+
+# Accuracy and latency of the question -> SQL -> answer pipeline over a gold
+# set of question/SQL pairs on sales_database.db:
+#
+#   python benchmark.py                               # offline, stub model
+#   python benchmark.py --backend gemini --summary    # real model, with summaries
+#   python benchmark.py --out today.json --baseline last_release.json
+#   python benchmark.py --cold-start                  # app start-up and first answer
+#   python benchmark.py --rollup-check                # rollup rewrites vs the original SQL
+
+GOLD_PATH = "benchmark_gold.jsonl"
+STAGES = ("fast_path", "prompt", "llm", "validation", "repair", "execution", "summary", "tts", "total")
+REGRESSION_TOLERANCE = 0.2  # Allowed relative p95 slowdown per stage
+REGRESSION_FLOOR_MS = 5.0  # Slowdowns smaller than this are noise
+
+# Queries the rollup rewriter must either leave alone or answer exactly like
+# the source table, next to the gold SQL: near misses of the stored
+# measures, groupings and result column names
+ROLLUP_CHECKS = (
+    "SELECT Category, SUM(Quantity * Unit_Price * (1 - Discount)) FROM SalesTable GROUP BY Category",
+    "SELECT Category, SUM((1 - Discount) * Unit_Price * Quantity) AS Revenue FROM SalesTable GROUP BY Category",
+    "SELECT Category, SUM(Quantity * Unit_Price * 1 - Discount) FROM SalesTable GROUP BY Category",
+    "SELECT Category, SUM(Quantity * Unit_Price - Discount) FROM SalesTable GROUP BY Category",
+    "SELECT Category, SUM(Unit_Price * -Quantity) FROM SalesTable GROUP BY Category",
+    "SELECT Category, SUM(Quantity * Unit_Price / (1 - Discount)) FROM SalesTable GROUP BY Category",
+    "SELECT Category, AVG(Quantity * Unit_Price) FROM SalesTable GROUP BY Category ORDER BY 2 DESC",
+    "SELECT Category, CAST(SUM(Quantity) AS INTEGER) FROM SalesTable GROUP BY Category",
+    "SELECT Category, CAST(SUM(Quantity) AS REAL) AS Units FROM SalesTable GROUP BY Category",
+    "SELECT lower(Category), COUNT(*) FROM SalesTable GROUP BY lower(Category)",
+    "SELECT Category, COUNT(*) FROM SalesTable GROUP BY Category COLLATE NOCASE",
+    "SELECT lower(Category) AS c, COUNT(*) FROM SalesTable GROUP BY c",
+    "SELECT Payment_Mode, Status, SUM(Amount), COUNT(*) FROM TransactionLog GROUP BY Payment_Mode, Status",
+    "SELECT Payment_Mode, AVG(Amount) FROM TransactionLog GROUP BY Payment_Mode HAVING COUNT(*) > 10",
+    "SELECT Channel, MAX(Amount) FROM TransactionLog GROUP BY Channel",
+    "SELECT COUNT(*) FROM SalesTable WHERE Category = 'Nope'",
+)
+
+
+# One case per line: {"id", "question", "sql"}, plus "fast_path": false for
+# questions the local grammar must not answer
+def load_gold(path=GOLD_PATH):
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def _normalize(value):
+    if isinstance(value, bool) or value is None:
+        return value
+    if isinstance(value, (int, float)):
+        return float(f"{float(value):.6g}")  # 12 == 12.0, float noise ignored
+    return str(value)
+
+
+# Whether pred_df holds the same answer as gold_df: the same rows, with
+# every gold column present in the prediction under any name and position
+# (extra predicted columns are allowed). Row order only matters when the
+# gold query orders its result.
+def results_match(gold_df, pred_df, ordered=False):
+    if len(gold_df) != len(pred_df) or pred_df.shape[1] < gold_df.shape[1]:
+        return False
+    gold_columns = [[_normalize(v) for v in gold_df.iloc[:, i]] for i in range(gold_df.shape[1])]
+    pred_columns = [[_normalize(v) for v in pred_df.iloc[:, i]] for i in range(pred_df.shape[1])]
+    gold_rows = list(zip(*gold_columns))
+    if not ordered:
+        gold_rows = Counter(gold_rows)
+
+    def assign(index, used):
+        if index == len(gold_columns):
+            rows = list(zip(*(pred_columns[i] for i in used))) if used else [()] * len(pred_df)
+            return (rows if ordered else Counter(rows)) == gold_rows
+        for i, column in enumerate(pred_columns):
+            if i in used:
+                continue
+            same = column == gold_columns[index] if ordered else Counter(column) == Counter(gold_columns[index])
+            if same and assign(index + 1, used + [i]):
+                return True
+        return False
+
+    return assign(0, [])
+
+
+def _orders_result(sql):
+    # ORDER BY outside parentheses, i.e. on the outermost query
+    depth = 0
+    for token in re.findall(r"\(|\)|\border\s+by\b", sql, re.I):
+        if token == "(":
+            depth += 1
+        elif token == ")":
+            depth -= 1
+        elif depth == 0:
+            return True
+    return False
+
+
+# Run one gold case through the pipeline, timing every stage. With the
+# offline stub, a case it had no answer for is marked skipped: its
+# placeholder SQL says nothing about model accuracy.
+def run_case(case, db_path=DB_PATH, summary=False, tts=False, stub=None):
+    engine = get_engine(db_path)  # Gold SQL is written for SQLite
+    timings = {}
+    record = {"id": case["id"], "question": case["question"], "match": False, "error": None, "skipped": False}
+    started = time.perf_counter()
+    try:
+        generated = generate_sql(case["question"], db_path=db_path, timings=timings)
+        record["sql"] = generated["sql"]
+        record["source"] = generated["source"]
+        executed = time.perf_counter()
+        df = get_engine(db_path, generated["backend"]).query_capped(generated["query"], generated["params"])
+        timings["execution"] = (time.perf_counter() - executed) * 1000
+        record["match"] = results_match(engine.query_df(case["sql"]), df, _orders_result(case["sql"]))
+        record["skipped"] = (
+            stub is not None and generated["source"] != "fast_path"
+            and normalize_question(case["question"]) in stub.unanswered
+        )
+        if case.get("fast_path") is False and generated["source"] == "fast_path":
+            # Negative case: a phrasing the local grammar must leave to the model
+            record["match"] = False
+            record["error"] = "answered by the fast path, which should have declined"
+        if summary and not df.empty:
+            summarized = time.perf_counter()
+            text = generate_summary(df, case["question"])
+            timings["summary"] = (time.perf_counter() - summarized) * 1000
+            if tts and text:
+                from speech import synthesize_chunks
+
+                spoken = time.perf_counter()
+                for _ in synthesize_chunks(text):
+                    pass
+                timings["tts"] = (time.perf_counter() - spoken) * 1000
+    except Exception as e:
+        record["error"] = f"{type(e).__name__}: {e}"
+    timings["total"] = (time.perf_counter() - started) * 1000
+    record["timings"] = {stage: round(ms, 2) for stage, ms in timings.items()}
+    return record
+
+
+# Run each query as written and as rewritten onto the rollups, on a copy of
+# db_path with freshly built rollups. The rewrite must keep the result and
+# its column names. Returns (sql, rewritten or None, problem or None) per query.
+def check_rollups(queries, db_path=DB_PATH):
+    import shutil
+    import sqlite3
+
+    from rollups import refresh_rollups, rewrite_query
+
+    results = []
+    with tempfile.TemporaryDirectory(prefix="speak2db-rollups-") as directory:
+        path = os.path.join(directory, os.path.basename(db_path))
+        shutil.copyfile(db_path, path)
+        conn = sqlite3.connect(path)
+        try:
+            refresh_rollups(conn)
+        finally:
+            conn.close()
+        engine = get_engine(path)
+        try:
+            for sql in queries:
+                rewritten, params = rewrite_query(sql, None, path)
+                if rewritten == sql:
+                    results.append((sql, None, None))
+                    continue
+                original, answer = engine.query_df(sql), engine.query_df(rewritten, params)
+                problem = None
+                if list(original.columns) != list(answer.columns):
+                    problem = f"columns {list(answer.columns)} instead of {list(original.columns)}"
+                elif not results_match(original, answer, _orders_result(sql)):
+                    problem = "result differs"
+                results.append((sql, rewritten, problem))
+        finally:
+            engine.close()
+    return results
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    if not values:
+        return None
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+# Accuracy, sources and p50/p95 per stage of a list of case records
+# Accuracy over the scored (not skipped) cases, split into the fast path's
+# coverage and accuracy and the model's accuracy (answers from the model or
+# its response cache)
+def summarize(records):
+    stages = {}
+    for stage in STAGES:
+        values = [record["timings"][stage] for record in records if stage in record["timings"]]
+        if values:
+            stages[stage] = {"count": len(values), "p50": percentile(values, 0.5), "p95": percentile(values, 0.95)}
+    scored = [record for record in records if not record["skipped"]]
+    fast = [record for record in scored if record.get("source") == "fast_path"]
+    model = [record for record in scored if record.get("source") != "fast_path"]
+    return {
+        "cases": len(records),
+        "scored": len(scored),
+        "skipped": len(records) - len(scored),
+        "accuracy": sum(record["match"] for record in scored) / max(len(scored), 1),
+        "fast_path": {
+            "answered": len(fast),
+            "coverage": len(fast) / max(len(records), 1),
+            "accuracy": sum(record["match"] for record in fast) / max(len(fast), 1),
+        },
+        "model": {"answered": len(model), "accuracy": sum(record["match"] for record in model) / max(len(model), 1)},
+        "errors": sum(1 for record in records if record["error"]),
+        "sources": dict(Counter(record.get("source") for record in records if record.get("source"))),
+        "stages": stages,
+    }
+
+
+def run_benchmark(gold, db_path=DB_PATH, repeat=1, summary=False, tts=False, stub=None):
+    passes = []
+    for number in range(repeat):
+        # The first pass is cold; later passes show the cached path
+        records = [run_case(case, db_path, summary, tts, stub) for case in gold]
+        passes.append({"pass": number + 1, "summary": summarize(records), "cases": records})
+    return passes
+
+
+# Regressions of a report's first pass against a baseline report's
+def compare(report, baseline, tolerance=REGRESSION_TOLERANCE):
+    current = report["passes"][0]["summary"]
+    previous = baseline["passes"][0]["summary"]
+    problems = []
+    if current["accuracy"] < previous["accuracy"]:
+        problems.append(f"accuracy {previous['accuracy']:.1%} -> {current['accuracy']:.1%}")
+    for stage, stats in current["stages"].items():
+        before = previous["stages"].get(stage)
+        if before and stats["p95"] > before["p95"] * (1 + tolerance) and stats["p95"] - before["p95"] > REGRESSION_FLOOR_MS:
+            problems.append(f"{stage} p95 {before['p95']:.1f} ms -> {stats['p95']:.1f} ms")
+    return problems
+
+
+def print_report(report, out=sys.stdout):
+    for result in report["passes"]:
+        summary = result["summary"]
+        fast, model = summary["fast_path"], summary["model"]
+        print(
+            f"Pass {result['pass']}: accuracy {summary['accuracy']:.1%} "
+            f"({summary['scored']} of {summary['cases']} cases scored, {summary['errors']} errors), "
+            f"sources {summary['sources']}",
+            file=out,
+        )
+        print(
+            f"  fast path: {fast['answered']} answered ({fast['coverage']:.1%} coverage), "
+            f"{fast['accuracy']:.1%} correct",
+            file=out,
+        )
+        if model["answered"]:
+            print(
+                f"  model ({report['backend']}): {model['answered']} answered, {model['accuracy']:.1%} correct",
+                file=out,
+            )
+        else:
+            print(f"  model ({report['backend']}): no answers scored", file=out)
+        if summary["skipped"]:
+            skipped = ", ".join(record["id"] for record in result["cases"] if record["skipped"])
+            print(f"  skipped {summary['skipped']} (no stub answer): {skipped}", file=out)
+        for stage, stats in summary["stages"].items():
+            print(f"  {stage:<11} p50 {stats['p50']:8.1f} ms   p95 {stats['p95']:8.1f} ms   n={stats['count']}", file=out)
+        for record in result["cases"]:
+            if not record["match"] and not record["skipped"]:
+                reason = record["error"] or "result differs"
+                print(f"  MISMATCH {record['id']}: {reason}\n    {record.get('sql')}", file=out)
+
+
+# Run in a fresh interpreter under python -X importtime: render app.py once,
+# wait while the user would be typing, then ask one question, the way a new
+# server process serves its first user
+_COLD_START_SCRIPT = """
+import json, sys, time
+started = time.perf_counter()
+from streamlit.testing.v1 import AppTest
+app = AppTest.from_file(sys.argv[1], default_timeout=300)
+app.run()
+rendered = time.perf_counter()
+sys.stderr.write("cold-start: typing\\n")
+time.sleep(float(sys.argv[3]) / 1000)
+sys.stderr.write("cold-start: answer\\n")
+sys.stderr.flush()
+asked = time.perf_counter()
+app.text_input(key="user_question_input").set_value(sys.argv[2]).run()
+answered = time.perf_counter()
+print(json.dumps({
+    "render_ms": (rendered - started) * 1000,
+    "answer_ms": (answered - asked) * 1000,
+    "errors": [str(element.value) for element in app.error] + [str(element.value) for element in app.exception],
+}))
+"""
+COLD_START_PHASES = ("render", "typing", "answer")
+_IMPORT_TIME = re.compile(r"^import time:\s+\d+ \|\s+(\d+) \| (\S.*)$")
+
+
+# Milliseconds of import time per top-level package, from -X importtime lines
+def _import_costs(lines):
+    costs = Counter()
+    for line in lines:
+        match = _IMPORT_TIME.match(line)
+        if match:  # Indented names were imported by another module and are already counted
+            costs[match.group(2).split(".")[0]] += int(match.group(1)) / 1000
+    return costs
+
+
+# Time to the first rendered page and to the first answer of a new app
+# process, and the packages imported in each phase. typing_ms is the pause
+# between the two, in which the app may load things in the background.
+def measure_cold_start(question, backend="stub", typing_ms=2000, app_path="app.py"):
+    env = dict(os.environ, SPEAK2DB_MODEL_BACKEND=backend)
+    started = time.perf_counter()
+    process = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", _COLD_START_SCRIPT, os.path.abspath(app_path), question,
+         str(typing_ms)],
+        capture_output=True, text=True, env=env, cwd=os.path.dirname(os.path.abspath(app_path)),
+    )
+    if process.returncode != 0:
+        raise RuntimeError(f"cold start run failed:\n{process.stderr[-2000:]}")
+    result = json.loads(process.stdout.strip().splitlines()[-1])
+    result["process_ms"] = (time.perf_counter() - started) * 1000
+    phases = re.split(r"^cold-start: \w+\n", process.stderr, flags=re.M)
+    for phase, lines in zip(COLD_START_PHASES, phases):
+        result[f"{phase}_imports"] = dict(_import_costs(lines.splitlines()).most_common())
+    result["question"] = question
+    result["typing_ms"] = typing_ms
+    return result
+
+
+def print_cold_start(result, top=8, out=sys.stdout):
+    print(f"Cold start ({result['question']!r} asked {result['typing_ms']:g} ms after the first render):", file=out)
+    print(f"  first render {result['render_ms']:8.1f} ms", file=out)
+    print(f"  first answer {result['answer_ms']:8.1f} ms", file=out)
+    for phase in COLD_START_PHASES:
+        imports = result[f"{phase}_imports"]
+        total = sum(imports.values())
+        listed = ", ".join(f"{name} {ms:.0f}" for name, ms in list(imports.items())[:top])
+        print(f"  imports while {phase:<7} {total:6.0f} ms ({listed or 'none'})", file=out)
+    for error in result["errors"]:
+        print(f"  APP ERROR: {error}", file=out)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure NL->SQL accuracy and per-stage latency")
+    parser.add_argument("--gold", default=GOLD_PATH)
+    parser.add_argument("--db", default=DB_PATH)
+    parser.add_argument("--backend", default="stub", help="model backend: stub (offline, default) or gemini")
+    parser.add_argument("--stub-latency-ms", type=float, default=0.0, help="simulated model latency for the stub")
+    parser.add_argument("--repeat", type=int, default=1, help="passes over the gold set (later ones hit the cache)")
+    parser.add_argument("--summary", action="store_true", help="also time the result summary")
+    parser.add_argument("--tts", action="store_true", help="also time speech synthesis of the summary (needs network)")
+    parser.add_argument("--out", help="write the full report as JSON")
+    parser.add_argument("--baseline", help="report JSON to compare against; exits 1 on regressions")
+    parser.add_argument("--tolerance", type=float, default=REGRESSION_TOLERANCE)
+    parser.add_argument(
+        "--cold-start", action="store_true",
+        help="instead, time a new app process to its first page and first answer (the first gold question)",
+    )
+    parser.add_argument("--typing-ms", type=float, default=2000, help="cold start: pause before the question")
+    parser.add_argument(
+        "--rollup-check", action="store_true",
+        help="instead, run the gold SQL and known near misses both as written and rewritten onto rollups; "
+             "exits 1 when a rewrite changes a result",
+    )
+    args = parser.parse_args()
+
+    if args.rollup_check:
+        results = check_rollups([case["sql"] for case in load_gold(args.gold)] + list(ROLLUP_CHECKS), args.db)
+        for sql, rewritten, problem in results:
+            print(f"{'KEEP' if rewritten is None else 'DIFF' if problem else 'OK':<5} {sql}")
+            if problem:
+                print(f"      {problem}: {rewritten}")
+        failed = sum(1 for _, _, problem in results if problem)
+        print(f"{sum(1 for _, rewritten, _ in results if rewritten)} of {len(results)} rewritten, {failed} changed results")
+        if failed:
+            sys.exit(1)
+        return
+
+    if args.cold_start:
+        result = measure_cold_start(load_gold(args.gold)[0]["question"], args.backend, args.typing_ms)
+        print_cold_start(result)
+        if args.out:
+            with open(args.out, "w", encoding="utf-8") as f:
+                json.dump(result, f, indent=2)
+        return
+
+    if args.backend == "gemini":
+        from dotenv import load_dotenv
+
+        load_dotenv()  # GOOGLE_API_KEY, read when the first Gemini model is created
+    stub = None
+    if args.backend == "stub":
+        stub = StubModel(latency_ms=args.stub_latency_ms, db_path=args.db)
+        register_backend("stub", lambda name: stub)
+    set_backend(args.backend)
+
+    gold = load_gold(args.gold)
+    report = {
+        "backend": args.backend,
+        "gold": args.gold,
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "passes": run_benchmark(gold, args.db, args.repeat, args.summary, args.tts, stub),
+    }
+    print_report(report)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            problems = compare(report, json.load(f), args.tolerance)
+        for problem in problems:
+            print(f"REGRESSION: {problem}")
+        if problems:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,181 @@
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+from db_engine import get_engine
+from result_cache import canonicalize_sql
+from schema_catalog import get_database_version
+from tracing import span
+
+CHART_POINTS = int(os.getenv("SPEAK2DB_CHART_POINTS", "1000"))  # Points kept per line/area series
+TOP_CATEGORIES = {"Bar Chart": 20, "Pie Chart": 10}  # Larger categories kept; the rest become "Other"
+HISTOGRAM_BINS = 20
+MAX_CACHED_SERIES = 64
+
+_series = OrderedDict()  # (db_path, backend, canonical sql, params, version, x, y, chart type) -> prepared data
+_lock = threading.Lock()
+
+
+# Indices of the `threshold` points of (x, y) that best preserve the shape
+# of the line (Largest-Triangle-Three-Buckets). The first and last points are
+# always kept.
+def lttb(x, y, threshold):
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    edges = np.linspace(1, n - 1, threshold - 1).astype(np.int64)  # threshold - 2 buckets
+    selected = np.empty(threshold, dtype=np.int64)
+    selected[0], selected[-1] = 0, n - 1
+    previous = 0
+    for i in range(threshold - 2):
+        start, end = edges[i], edges[i + 1]
+        if i + 2 < len(edges):
+            next_x, next_y = x[end:edges[i + 2]].mean(), y[end:edges[i + 2]].mean()
+        else:
+            next_x, next_y = x[-1], y[-1]
+        # Pick the point forming the largest triangle with the previous pick
+        # and the average of the next bucket
+        area = np.abs(
+            (x[previous] - next_x) * (y[start:end] - y[previous])
+            - (x[previous] - x[start:end]) * (next_y - y[previous])
+        )
+        previous = start + int(area.argmax())
+        selected[i + 1] = previous
+    return selected
+
+
+# Numeric positions for x values: numbers, dates (ISO or M/D/YYYY) as
+# nanoseconds, or None when x is categorical
+def _numeric_axis(values):
+    if pd.api.types.is_numeric_dtype(values):
+        return values.astype(np.float64)
+    if pd.api.types.is_datetime64_any_dtype(values):
+        return values.astype("int64").astype(np.float64)
+    parsed = pd.to_datetime(values, errors="coerce", format="mixed")
+    if parsed.notna().all():
+        return parsed.astype("int64").astype(np.float64)
+    return None
+
+
+# Sum y per x and keep the top categories, folding the rest into "Other"
+def _top_categories(data, x, y, top):
+    totals = data.groupby(x, sort=False, dropna=False)[y].sum()
+    if totals.index.is_unique and len(totals) == len(data) and len(totals) <= top:
+        return data, None  # Already one row per category: keep the query's order
+    totals = totals.sort_values(ascending=False)
+    if len(totals) <= top:
+        return totals.reset_index(), None
+    kept = totals.iloc[:top - 1]
+    other = pd.Series([totals.iloc[top - 1:].sum()], index=["Other"])
+    note = f"Showing the top {top - 1} of {len(totals)} {x} values; the rest are grouped as Other."
+    return pd.concat([kept, other]).rename_axis(x).rename(y).reset_index(), note
+
+
+def _histogram(values, column):
+    values = values.dropna()
+    if not pd.api.types.is_numeric_dtype(values):
+        counts = values.astype(str).value_counts()
+        return counts.rename_axis(column).rename("count").reset_index(), None
+    counts, edges = np.histogram(values.to_numpy(dtype=np.float64), bins=HISTOGRAM_BINS)
+    centers = (edges[:-1] + edges[1:]) / 2
+    return pd.DataFrame({column: centers, "count": counts}), None
+
+
+def _line(data, x, y, points):
+    data = data.dropna(subset=[y])
+    axis = _numeric_axis(data[x])
+    if axis is not None:
+        order = np.argsort(axis.to_numpy(), kind="stable")
+        data, axis = data.iloc[order], axis.to_numpy()[order]
+    if len(data) <= points:
+        return data, None
+    positions = axis if axis is not None else np.arange(len(data), dtype=np.float64)
+    keep = lttb(positions, data[y].to_numpy(dtype=np.float64), points)
+    return data.iloc[keep], f"Showing {points} of {len(data)} points, downsampled to keep the line's shape."
+
+
+# Bin index of a value for the histogram query, per engine dialect
+_BIN_SQL = {
+    "sqlite": 'MIN(CAST(("{y}" - ?) / ? AS INTEGER), ?)',
+    "duckdb": 'LEAST(CAST(FLOOR(("{y}" - ?) / ?) AS INTEGER), ?)',
+}
+
+
+# Group or bin the complete result in the database when only part of it was fetched
+def _aggregate_in_database(query, params, x, y, chart_type, db_path, backend):
+    engine = get_engine(db_path, backend)
+    inner = f"({query}) AS result"
+    if chart_type in TOP_CATEGORIES:
+        return engine.query_df(
+            f'SELECT "{x}" AS "{x}", SUM("{y}") AS "{y}" FROM {inner} GROUP BY 1 ORDER BY 2 DESC', params
+        )
+    if chart_type == "Histogram":
+        low, high = engine.query_df(f'SELECT MIN("{y}"), MAX("{y}") FROM {inner}', params).iloc[0]
+        if pd.isna(low) or pd.isna(high) or not isinstance(low, (int, float, np.number)):
+            return None
+        width = (high - low) / HISTOGRAM_BINS or 1
+        counts = engine.query_df(
+            f'SELECT {_BIN_SQL[engine.dialect].format(y=y)} AS bin, COUNT(*) AS "count" '
+            f'FROM {inner} WHERE "{y}" IS NOT NULL GROUP BY 1',
+            tuple(params or ()) + (low, width, HISTOGRAM_BINS - 1),
+        )
+        return pd.DataFrame({y: low + (counts["bin"] + 0.5) * width, "count": counts["count"]})
+    return engine.query_df(f'SELECT "{x}" AS "{x}", "{y}" AS "{y}" FROM {inner}', params)
+
+
+def _prepare(df, x, y, chart_type, query, params, db_path, backend):
+    if x == y:
+        return df[[x]].head(CHART_POINTS), None
+    data = df[[x, y]]
+    note = None
+    if df.attrs.get("truncated") and query:
+        aggregated = _aggregate_in_database(query, params, x, y, chart_type, db_path, backend)
+        if aggregated is not None:
+            if chart_type == "Histogram":
+                return aggregated, "Histogram of the complete result, binned in the database."
+            data = aggregated
+            note = "Charted from the complete result, not only the rows shown."
+    if chart_type == "Histogram":
+        return _histogram(data[y], y)
+    if chart_type in TOP_CATEGORIES:
+        if not pd.api.types.is_numeric_dtype(data[y]):
+            return data.head(TOP_CATEGORIES[chart_type]), f"Showing the first {TOP_CATEGORIES[chart_type]} rows."
+        data, top_note = _top_categories(data, x, y, TOP_CATEGORIES[chart_type])
+    else:
+        data, top_note = _line(data, x, y, CHART_POINTS)
+    return data, top_note or note
+
+
+# Chart-ready data for a result: at most CHART_POINTS points for line and
+# area charts (LTTB), the top categories plus "Other" for bar and pie charts,
+# and bin counts for histograms. Returns (data, note) where note explains any
+# reduction. query runs on the get_engine backend it was written for.
+# Prepared series are cached per query, columns and chart type.
+def prepare_chart_data(df, x, y, chart_type, query=None, params=None, db_path="sales_database.db",
+                       backend="sqlite"):
+    key = None
+    if query:
+        key = (
+            db_path, backend, canonicalize_sql(query), tuple(params or ()), get_database_version(db_path),
+            x, y, chart_type,
+        )
+        with _lock:
+            cached = _series.get(key)
+            if cached is not None:
+                _series.move_to_end(key)
+    with span("chart_data", **{"chart.type": chart_type, "db.rows": len(df)}) as s:
+        s.set("cache.result", "hit" if key is not None and cached is not None else "miss")
+        if key is None or cached is None:
+            cached = _prepare(df, x, y, chart_type, query, params, db_path, backend)
+            if key is not None:
+                with _lock:
+                    _series[key] = cached
+                    while len(_series) > MAX_CACHED_SERIES:
+                        _series.popitem(last=False)
+        s.set("chart.points", len(cached[0]))
+        return cached
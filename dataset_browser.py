@@ -0,0 +1,84 @@
+import threading
+
+from db_engine import get_engine
+from schema_catalog import get_schema_catalog, get_database_version, iso_date_sql
+from tracing import span
+
+BROWSE_ROWS = 50  # Rows per page of the sidebar dataset browser
+TOP_VALUES = 5  # Most frequent values listed per column profile
+
+_profiles = {}  # (db_path, table) -> (database version, profile rows)
+_lock = threading.Lock()
+
+
+def _table(catalog, table_name):
+    table = catalog["tables"].get(table_name)
+    if table is None:
+        raise ValueError(f"Unknown table {table_name!r}")
+    return table
+
+
+# One page of table_name in rowid order, starting after rowid `after`
+# (keyset pagination: no OFFSET, so every page costs the same). Returns the
+# rows as a DataFrame and the rowid to pass for the next page, or None on the
+# last page.
+def fetch_page(table_name, after=None, limit=BROWSE_ROWS, db_path="sales_database.db"):
+    _table(get_schema_catalog(db_path), table_name)
+    sql = f'SELECT rowid AS "_rowid", * FROM "{table_name}" WHERE rowid > ? ORDER BY rowid LIMIT ?'
+    with span("browse", **{"db.table": table_name}):
+        df = get_engine(db_path).query_df(sql, (after if after is not None else -1, limit + 1))
+    next_after = int(df["_rowid"].iloc[limit - 1]) if len(df) > limit else None
+    return df.head(limit).drop(columns="_rowid"), next_after
+
+
+def _profile(catalog, table_name, db_path):
+    table = _table(catalog, table_name)
+    engine = get_engine(db_path)
+    # Counts, distinct counts and min/max of every column in one table scan;
+    # dates are compared in ISO form so min/max are chronological
+    selects = []
+    for column in table["columns"]:
+        name = f'"{column["name"]}"'
+        ordered = iso_date_sql(column) or name
+        selects.append(f"COUNT({name}), COUNT(DISTINCT {name}), MIN({ordered}), MAX({ordered})")
+    totals = engine.query_df(f'SELECT COUNT(*), {", ".join(selects)} FROM "{table_name}"').iloc[0].tolist()
+    row_count = totals[0]
+    rows = []
+    for index, column in enumerate(table["columns"]):
+        count, distinct, low, high = totals[1 + 4 * index:5 + 4 * index]
+        top = engine.query_df(
+            f'SELECT "{column["name"]}" AS value, COUNT(*) AS n FROM "{table_name}" '
+            f'WHERE "{column["name"]}" IS NOT NULL GROUP BY 1 ORDER BY n DESC, 1 LIMIT ?',
+            (TOP_VALUES,),
+        )
+        # Values that all occur once are not worth listing (keys, e-mails)
+        top_values = ", ".join(f"{value} ({n})" for value, n in top.itertuples(index=False) if n > 1)
+        rows.append({
+            "Column": column["name"],
+            "Type": column["type"],
+            "Non-null": int(count),
+            "Null %": round(100 * (row_count - count) / row_count, 1) if row_count else 0.0,
+            "Distinct": int(distinct),
+            # As text: one column holds numbers, dates and names
+            "Min": None if low is None else str(low),
+            "Max": None if high is None else str(high),
+            "Top values": top_values,
+        })
+    return rows
+
+
+# Per-column profile of table_name (non-null count, null rate, distinct
+# count, min, max, top values), computed once per database version
+def get_column_profiles(table_name, db_path="sales_database.db"):
+    version = get_database_version(db_path)
+    key = (db_path, table_name)
+    with _lock:
+        cached = _profiles.get(key)
+    if cached is not None and cached[0] == version:
+        return cached[1]
+    with span("profile", **{"db.table": table_name}) as s:
+        rows = _profile(get_schema_catalog(db_path), table_name, db_path)
+        s.set("db.columns", len(rows))
+    with _lock:
+        _profiles[key] = (version, rows)
+    return rows
@@ -0,0 +1,220 @@
+import os
+import queue
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+import pandas as pd
+
+from query_governor import get_governor
+from tracing import span
+
+DB_PATH = "sales_database.db"
+# Engine that runs the model's SQL: "sqlite", or "duckdb" for the embedded
+# columnar engine (duckdb_engine.py; pip install duckdb). The fast path,
+# rollups and every internal query always run on SQLite.
+QUERY_BACKEND = os.getenv("SPEAK2DB_QUERY_BACKEND", "sqlite")
+POOL_SIZE = int(os.getenv("SPEAK2DB_POOL_SIZE", "4"))
+POOL_TIMEOUT = 30  # Seconds to wait for a free connection before giving up
+
+# Budgets for results of generated SQL, which may be unbounded
+MAX_RESULT_ROWS = int(os.getenv("SPEAK2DB_MAX_ROWS", "10000"))
+MAX_RESULT_BYTES = int(os.getenv("SPEAK2DB_MAX_RESULT_MB", "50")) * 1024 * 1024
+FETCH_BATCH_ROWS = 1000
+
+# Pragmas applied to every pooled connection, tuned for read-mostly analytics
+CONNECTION_PRAGMAS = (
+    "PRAGMA query_only = ON",
+    "PRAGMA mmap_size = 268435456",  # Map up to 256 MiB of the file
+    "PRAGMA cache_size = -65536",  # 64 MiB page cache per connection
+    "PRAGMA temp_store = MEMORY",  # Sorts and temp B-trees stay in RAM
+)
+
+
+class PoolExhaustedError(Exception):
+    pass
+
+
+# Rough in-memory size of a result row, used for the byte budget
+def _row_size(row):
+    size = 0
+    for value in row:
+        if isinstance(value, (str, bytes)):
+            size += len(value) + 49
+        else:
+            size += 8
+    return size
+
+
+class QueryEngine:
+    name = "SQLite"
+    dialect = "sqlite"  # SQL dialect the prompt asks the model for
+
+    def __init__(self, db_path=DB_PATH, pool_size=POOL_SIZE):
+        self.db_path = db_path
+        self.pool_size = pool_size
+        # LIFO so the most recently used (warmest) connection is handed out first
+        self._idle = queue.LifoQueue()
+        self._created = 0
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        # A pooled connection is only ever used by one thread at a time (it is
+        # checked out exclusively), so it is safe to hand it across Streamlit's
+        # script threads.
+        conn = sqlite3.connect(
+            f"file:{self.db_path}?mode=ro", uri=True, check_same_thread=False
+        )
+        for pragma in CONNECTION_PRAGMAS:
+            conn.execute(pragma)
+        return conn
+
+    def _acquire(self, timeout):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            if self._created < self.pool_size:
+                self._created += 1
+                create = True
+            else:
+                create = False
+        if create:
+            try:
+                return self._connect()
+            except Exception:
+                with self._lock:
+                    self._created -= 1
+                raise
+        try:
+            return self._idle.get(timeout=timeout)
+        except queue.Empty:
+            raise PoolExhaustedError(
+                f"No database connection became free within {timeout} seconds"
+            )
+
+    def _release(self, conn):
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except sqlite3.Error:
+            # Connection is unusable, drop it and let the pool open a new one
+            conn.close()
+            with self._lock:
+                self._created -= 1
+            return
+        self._idle.put(conn)
+
+    # Check a connection out of the pool for the duration of the with block
+    @contextmanager
+    def connection(self, timeout=POOL_TIMEOUT):
+        conn = self._acquire(timeout)
+        try:
+            yield conn
+        finally:
+            self._release(conn)
+
+    # Run a read-only query and return the result as a DataFrame. Every query
+    # runs under the governor's budgets (query_governor.py).
+    def query_df(self, sql, params=None):
+        with span("read_sql") as s, get_governor().run(s) as query, self.connection() as conn, query.watch(conn):
+            df = pd.read_sql_query(sql, conn, params=params)
+            s.set("db.rows", len(df))
+            return df
+
+    # Run a query fetching rows in fetchmany batches and stop early once
+    # max_rows rows or max_bytes bytes have been read. on_first_batch, if
+    # given, receives the first batch as a DataFrame so it can be shown before
+    # the rest arrives. The result's attrs record whether it was truncated.
+    def query_capped(self, sql, params=None, max_rows=MAX_RESULT_ROWS,
+                     max_bytes=MAX_RESULT_BYTES, batch_size=FETCH_BATCH_ROWS,
+                     on_first_batch=None):
+        with span("query") as s, get_governor().run(s) as query:
+            df = self._query_capped(sql, params, max_rows, max_bytes, batch_size, on_first_batch, query)
+            s.set("db.rows", len(df))
+            s.set("db.bytes", df.attrs["result_bytes"])
+            s.set("db.truncated", df.attrs["truncated"] or "no")
+            return df
+
+    def _query_capped(self, sql, params, max_rows, max_bytes, batch_size, on_first_batch, query):
+        rows = []
+        size = 0
+        truncated = None
+        with self.connection() as conn, query.watch(conn):
+            cursor = conn.execute(sql, params or ())
+            try:
+                columns = [d[0] for d in cursor.description] if cursor.description else []
+                while truncated is None:
+                    batch = cursor.fetchmany(batch_size)
+                    if not batch:
+                        break
+                    for row in batch:
+                        if len(rows) >= max_rows:
+                            truncated = "rows"
+                            break
+                        size += _row_size(row)
+                        if size > max_bytes:
+                            truncated = "bytes"
+                            break
+                        rows.append(row)
+                    if on_first_batch is not None:
+                        on_first_batch(pd.DataFrame.from_records(rows, columns=columns))
+                        on_first_batch = None
+            finally:
+                cursor.close()
+        with span("to_dataframe", **{"db.rows": len(rows)}):
+            df = pd.DataFrame.from_records(rows, columns=columns)
+        df.attrs["result_bytes"] = min(size, max_bytes)
+        df.attrs["truncated"] = truncated
+        df.attrs["row_limit"] = max_rows
+        df.attrs["byte_limit"] = max_bytes
+        return df
+
+    def close(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+        with self._lock:
+            self._created = 0
+
+
+def _duckdb_engine(db_path):
+    from duckdb_engine import DuckDBEngine
+
+    return DuckDBEngine(db_path)
+
+
+_backend_factories = {"sqlite": QueryEngine, "duckdb": _duckdb_engine}
+_engines = {}
+_engines_lock = threading.Lock()
+
+
+# Register factory(db_path) -> engine under name. An engine has name, dialect,
+# connection(), query_df(), query_capped() and close() like QueryEngine.
+def register_backend(name, factory):
+    with _engines_lock:
+        _backend_factories[name] = factory
+        for key in [key for key in _engines if key[0] == name]:
+            _engines.pop(key).close()
+
+
+# Shared, process-wide engine for db_path
+def get_engine(db_path=DB_PATH, backend="sqlite"):
+    with _engines_lock:
+        engine = _engines.get((backend, db_path))
+        if engine is None:
+            if backend not in _backend_factories:
+                raise ValueError(
+                    f"Unknown database backend {backend!r}; choose from {', '.join(sorted(_backend_factories))}"
+                )
+            engine = _backend_factories[backend](db_path)
+            _engines[(backend, db_path)] = engine
+        return engine
+
+
+# Engine for generated SQL (SPEAK2DB_QUERY_BACKEND)
+def get_query_engine(db_path=DB_PATH):
+    return get_engine(db_path, QUERY_BACKEND)
@@ -0,0 +1,230 @@
+import argparse
+import os
+import threading
+from contextlib import contextmanager
+
+from db_engine import DB_PATH, FETCH_BATCH_ROWS, MAX_RESULT_BYTES, MAX_RESULT_ROWS
+from query_governor import get_governor
+from schema_catalog import date_format, get_schema_catalog
+from tracing import span
+
+# Embedded columnar engine for the model's SQL (SPEAK2DB_QUERY_BACKEND=duckdb,
+# needs pip install "duckdb>=1.3"). It reads the SQLite file in place, or the
+# Parquet files in SPEAK2DB_PARQUET_DIR when set, and runs each query
+# vectorized on every core. Tables are exposed as views with real DATE
+# columns, whatever text layout the SQLite file stores them in:
+#
+#   python duckdb_engine.py --export exports/   # write <table>.parquet files
+PARQUET_DIR = os.getenv("SPEAK2DB_PARQUET_DIR")
+
+
+def _quote(name):
+    return '"' + name.replace('"', '""') + '"'
+
+
+def _literal(text):
+    return "'" + text.replace("'", "''") + "'"
+
+
+# Column of the attached SQLite table as the view exposes it
+def _column_sql(column):
+    name = _quote(column["name"])
+    fmt = date_format(column)
+    if fmt == "M/D/YYYY":
+        return f"CAST(try_strptime({name}, '%m/%d/%Y') AS DATE) AS {name}"
+    if fmt == "iso":
+        return f"TRY_CAST(substr(CAST({name} AS VARCHAR), 1, 10) AS DATE) AS {name}"
+    return name
+
+
+def _parquet_path(parquet_dir, table_name):
+    return os.path.join(parquet_dir, f"{table_name}.parquet")
+
+
+# View over a table, or None when the Parquet export lacks it
+def _view_sql(table_name, table, parquet_dir):
+    if parquet_dir:
+        path = _parquet_path(parquet_dir, table_name)
+        if not os.path.exists(path):
+            return None
+        return f"CREATE OR REPLACE VIEW {_quote(table_name)} AS SELECT * FROM read_parquet({_literal(path)})"
+    columns = ", ".join(_column_sql(column) for column in table["columns"])
+    return f"CREATE OR REPLACE VIEW {_quote(table_name)} AS SELECT {columns} FROM src.{_quote(table_name)}"
+
+
+# DataFrame of an Arrow table or batch. DuckDB returns SUM over integers as
+# HUGEINT and fixed-point math as DECIMAL, which pandas would hold as Python
+# Decimal objects; those become int64 when whole and in range, else float64.
+def _to_pandas(data):
+    import pyarrow as pa
+    import pyarrow.compute as pc
+
+    for index, field in enumerate(data.schema):
+        if pa.types.is_decimal(field.type):
+            column = data.column(index)
+            converted = None
+            if field.type.scale == 0:
+                try:
+                    converted = pc.cast(column, pa.int64())
+                except pa.ArrowInvalid:
+                    pass  # Beyond int64
+            if converted is None:
+                converted = pc.cast(column, pa.float64(), safe=False)
+            data = data.set_column(index, field.name, converted)
+    return data.to_pandas()
+
+
+def _open(duckdb, db_path, parquet_dir):
+    db = duckdb.connect(":memory:")
+    if not parquet_dir:
+        db.execute("INSTALL sqlite")
+        db.execute("LOAD sqlite")
+        db.execute(f"ATTACH {_literal(os.path.abspath(db_path))} AS src (TYPE sqlite, READ_ONLY)")
+    return db
+
+
+class DuckDBEngine:
+    name = "DuckDB"
+    dialect = "duckdb"
+
+    def __init__(self, db_path=DB_PATH, parquet_dir=PARQUET_DIR):
+        import duckdb
+
+        self.db_path = db_path
+        self.parquet_dir = parquet_dir and os.path.abspath(parquet_dir)
+        self._db = _open(duckdb, db_path, self.parquet_dir)
+        self._fingerprint = None
+        self._readable = None  # Parquet files the views may read once access is off
+        self._lock = threading.Lock()
+        self._sync_views()
+        # Generated SQL may only read the data: the attached SQLite file needs
+        # no file access, and the Parquet views may open only their own files.
+        # Nothing else on disk (.env sits next to the database), no extensions,
+        # and no way to undo the settings.
+        self._readable = {_parquet_path(self.parquet_dir, name) for name in get_schema_catalog(db_path)["tables"]
+                          if self.parquet_dir and os.path.exists(_parquet_path(self.parquet_dir, name))}
+        if self._readable:
+            paths = ", ".join(_literal(path) for path in sorted(self._readable))
+            self._db.execute(f"SET allowed_paths = [{paths}]")
+        self._db.execute("SET enable_external_access = false")
+        self._db.execute("SET lock_configuration = true")
+
+    # (Re)create the table views whenever the SQLite schema changes
+    def _sync_views(self):
+        catalog = get_schema_catalog(self.db_path)
+        with self._lock:
+            if catalog["fingerprint"] == self._fingerprint:
+                return
+            for table_name, table in catalog["tables"].items():
+                if self._readable is not None and self.parquet_dir \
+                        and _parquet_path(self.parquet_dir, table_name) not in self._readable:
+                    continue  # Exported after start-up; file access is already off
+                view = _view_sql(table_name, table, self.parquet_dir)
+                if view is not None:
+                    self._db.execute(view)
+            self._fingerprint = catalog["fingerprint"]
+
+    # A cursor on the shared database for the duration of the with block.
+    # DuckDB cursors are cheap, independent connections, so none are pooled.
+    @contextmanager
+    def connection(self, timeout=None):
+        self._sync_views()
+        cursor = self._db.cursor()
+        try:
+            yield cursor
+        finally:
+            cursor.close()
+
+    # Run a query and return the result as an Arrow table, without a pandas copy
+    def query_arrow(self, sql, params=None):
+        with span("read_sql", **{"db.backend": self.dialect}) as s, get_governor().run(s) as query, \
+                self.connection() as conn, query.watch(conn):
+            table = conn.execute(sql, params or ()).fetch_arrow_table()
+            s.set("db.rows", table.num_rows)
+            return table
+
+    def query_df(self, sql, params=None):
+        table = self.query_arrow(sql, params)
+        with span("to_dataframe", **{"db.rows": table.num_rows}):
+            return _to_pandas(table)
+
+    # Same contract as QueryEngine.query_capped; the result is read in Arrow
+    # record batches and converted to a DataFrame once
+    def query_capped(self, sql, params=None, max_rows=MAX_RESULT_ROWS,
+                     max_bytes=MAX_RESULT_BYTES, batch_size=FETCH_BATCH_ROWS,
+                     on_first_batch=None):
+        with span("query", **{"db.backend": self.dialect}) as s, get_governor().run(s) as query:
+            df = self._query_capped(sql, params, max_rows, max_bytes, batch_size, on_first_batch, query)
+            s.set("db.rows", len(df))
+            s.set("db.bytes", df.attrs["result_bytes"])
+            s.set("db.truncated", df.attrs["truncated"] or "no")
+            return df
+
+    def _query_capped(self, sql, params, max_rows, max_bytes, batch_size, on_first_batch, query):
+        import pyarrow as pa
+
+        batches = []
+        rows = 0
+        size = 0
+        truncated = None
+        with self.connection() as conn, query.watch(conn):
+            reader = conn.execute(sql, params or ()).fetch_record_batch(batch_size)
+            schema = reader.schema
+            for batch in reader:
+                if rows >= max_rows:
+                    truncated = "rows"
+                    break
+                if rows + batch.num_rows > max_rows:
+                    batch, truncated = batch.slice(0, max_rows - rows), "rows"
+                if size + batch.nbytes > max_bytes:
+                    # Keep the share of the batch that fits, assuming even row sizes
+                    keep = int(batch.num_rows * (max_bytes - size) / batch.nbytes)
+                    batch, truncated = batch.slice(0, keep), "bytes"
+                batches.append(batch)
+                rows += batch.num_rows
+                size += batch.nbytes
+                if on_first_batch is not None:
+                    on_first_batch(_to_pandas(batch))
+                    on_first_batch = None
+                if truncated:
+                    break
+        with span("to_dataframe", **{"db.rows": rows}):
+            df = _to_pandas(pa.Table.from_batches(batches, schema=schema))
+        df.attrs["result_bytes"] = min(size, max_bytes)
+        df.attrs["truncated"] = truncated
+        df.attrs["row_limit"] = max_rows
+        df.attrs["byte_limit"] = max_bytes
+        return df
+
+    def close(self):
+        self._db.close()
+
+
+# Write every table of db_path to directory/<table>.parquet, with the same
+# types the views expose. Point SPEAK2DB_PARQUET_DIR at directory to query them.
+def export_parquet(db_path=DB_PATH, directory="exports"):
+    import duckdb
+
+    os.makedirs(directory, exist_ok=True)
+    db = _open(duckdb, db_path, None)
+    try:
+        for table_name, table in get_schema_catalog(db_path)["tables"].items():
+            db.execute(_view_sql(table_name, table, None))
+            path = _parquet_path(directory, table_name)
+            db.execute(f"COPY (SELECT * FROM {_quote(table_name)}) TO {_literal(path)} (FORMAT parquet)")
+            yield table_name, path
+    finally:
+        db.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export the sales database to Parquet for the DuckDB backend")
+    parser.add_argument("--db", default=DB_PATH)
+    parser.add_argument("--export", metavar="DIR", required=True, help="directory to write <table>.parquet files to")
+    args = parser.parse_args()
+    for table_name, path in export_parquet(args.db, args.export):
+        print(f"{table_name}: {path}")
+
+
+if __name__ == "__main__":
+    main()
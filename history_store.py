@@ -0,0 +1,162 @@
+import os
+import sqlite3
+import threading
+import time
+import uuid
+import zlib
+from io import StringIO
+
+import pandas as pd
+
+HISTORY_DIR = os.getenv("SPEAK2DB_CACHE_DIR", ".speak2db_cache")
+MAX_HISTORY_ENTRIES = 20  # Entries kept in a session's history
+PREVIEW_ROWS = 5  # Rows kept in memory per entry (also what the prompt uses)
+MAX_SESSION_SPILL_BYTES = 20 * 1024 * 1024  # Compressed full results kept on disk per session
+SPILL_TTL = 24 * 3600  # Seconds before spilled results of any session are removed
+
+
+# Per-column summary statistics kept in memory instead of the full result
+def summarize_result(df):
+    stats = {}
+    for column in df.columns.unique():
+        series = df[column]
+        if isinstance(series, pd.DataFrame):
+            series = series.iloc[:, 0]  # Duplicate column names
+        column_stats = {"nulls": int(series.isna().sum())}
+        if pd.api.types.is_numeric_dtype(series) and not pd.api.types.is_bool_dtype(series):
+            if series.notna().any():
+                column_stats.update(
+                    min=series.min().item(), max=series.max().item(),
+                    mean=float(series.mean()), sum=series.sum().item(),
+                )
+        else:
+            column_stats["distinct"] = int(series.nunique())
+        stats[str(column)] = column_stats
+    return stats
+
+
+# On-disk store for full results that no longer live in session_state
+class HistoryStore:
+    def __init__(self, path=None, max_session_bytes=MAX_SESSION_SPILL_BYTES, ttl=SPILL_TTL):
+        if path is None:
+            os.makedirs(HISTORY_DIR, exist_ok=True)
+            path = os.path.join(HISTORY_DIR, "history.db")
+        self.max_session_bytes = max_session_bytes
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        # Single connection guarded by _lock
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode = WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS results (
+                result_id TEXT PRIMARY KEY,
+                session_id TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                nbytes INTEGER NOT NULL,
+                payload BLOB NOT NULL
+            )
+        """)
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS results_session ON results (session_id, created_at)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS results_created ON results (created_at)")
+        self._conn.commit()
+
+    def save(self, session_id, df):
+        result_id = uuid.uuid4().hex
+        payload = zlib.compress(df.to_json(orient="split", date_format="iso").encode("utf-8"))
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO results (result_id, session_id, created_at, nbytes, payload) VALUES (?, ?, ?, ?, ?)",
+                (result_id, session_id, now, len(payload), payload),
+            )
+            self._evict(session_id, now)
+            self._conn.commit()
+        return result_id
+
+    def load(self, result_id):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT payload FROM results WHERE result_id = ?", (result_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        data = zlib.decompress(row[0]).decode("utf-8")
+        return pd.read_json(StringIO(data), orient="split", dtype=False, convert_dates=False)
+
+    def delete(self, result_ids):
+        with self._lock:
+            self._conn.executemany(
+                "DELETE FROM results WHERE result_id = ?", [(result_id,) for result_id in result_ids]
+            )
+            self._conn.commit()
+
+    def _evict(self, session_id, now):
+        self._conn.execute("DELETE FROM results WHERE created_at < ?", (now - self.ttl,))
+        # Oldest results of this session beyond its byte budget
+        self._conn.execute(
+            """
+            DELETE FROM results WHERE result_id IN (
+                SELECT result_id FROM (
+                    SELECT result_id,
+                           SUM(nbytes) OVER (ORDER BY created_at DESC) AS running_bytes
+                    FROM results WHERE session_id = ?
+                ) WHERE running_bytes > ?
+            )
+            """,
+            (session_id, self.max_session_bytes),
+        )
+
+
+# Build a compact history entry: a bounded preview and summary statistics in
+# memory, with the full result spilled to the store
+def make_entry(question, sql_query, df, store, session_id):
+    preview = df.head(PREVIEW_ROWS)
+    return {
+        "input": question,
+        "sql_query": sql_query,
+        "row_count": len(df),
+        "columns": [str(column) for column in df.columns],
+        "preview": preview.values.tolist(),
+        "preview_text": preview.to_string(index=False),
+        "stats": summarize_result(df),
+        "result_id": store.save(session_id, df) if len(df) > PREVIEW_ROWS else None,
+    }
+
+
+# True when the latest entry already answers question with sql_query, as on
+# a Streamlit rerun; such a run must not store (and spill) the result again
+def is_latest_entry(history, question, sql_query):
+    return bool(history) and history[-1]["input"] == question and history[-1]["sql_query"] == sql_query
+
+
+# Append an entry, dropping (and deleting the spilled results of) the oldest
+# entries beyond MAX_HISTORY_ENTRIES
+def append_entry(history, entry, store):
+    history.append(entry)
+    evicted = history[:-MAX_HISTORY_ENTRIES]
+    if evicted:
+        del history[:-MAX_HISTORY_ENTRIES]
+        store.delete([old["result_id"] for old in evicted if old.get("result_id")])
+
+
+# Full result of an entry: the preview when it was not spilled, the spilled
+# result otherwise, or None once it has been evicted from the store
+def load_result(entry, store):
+    if entry.get("result_id") is None:
+        return pd.DataFrame(entry["preview"], columns=entry["columns"])
+    return store.load(entry["result_id"])
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+# Shared, process-wide history store
+def get_history_store():
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = HistoryStore()
+        return _store
@@ -0,0 +1,400 @@
+import argparse
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import time
+
+from query_governor import QueryKilledError, get_governor
+from result_cache import canonicalize_sql
+from schema_catalog import date_format
+
+DB_PATH = "sales_database.db"
+LOG_DIR = os.getenv("SPEAK2DB_CACHE_DIR", ".speak2db_cache")
+MIN_QUERY_COUNT = 3  # Executions before a query's plan is considered for indexing
+MAX_INDEX_COLUMNS = 5  # Upper bound on columns in a proposed (covering) index
+# Build proposed indexes automatically from the app, not just report them
+AUTO_INDEX = os.getenv("SPEAK2DB_AUTO_INDEX", "0") == "1"
+
+_STOP_WORDS = (
+    "on", "where", "join", "inner", "left", "right", "full", "outer", "cross",
+    "natural", "group", "order", "limit", "having", "union", "using",
+)
+_TABLE_REF = re.compile(
+    r"\b(?:from|join)\s+[\"`\[]?(\w+)[\"`\]]?"
+    r"(?:\s+(?:as\s+)?(?!(?:%s)\b)(\w+))?" % "|".join(_STOP_WORDS),
+    re.I,
+)
+# A column reference, optionally wrapped in DATE(...) or strftime('fmt', ...),
+# followed by a comparison operator
+_PREDICATE = re.compile(
+    r"(?P<func>\b(?:date|strftime)\s*\(\s*(?P<fmt>'[^']*'\s*,\s*)?)?"
+    r"(?:(?P<qual>\w+)\.)?[\"`\[]?(?P<col>\w+)[\"`\]]?\s*(?P<close>\))?\s*"
+    r"(?P<op>==|=|<>|!=|>=|<=|>|<|\bbetween\b|\blike\b|\bin\b)",
+    re.I,
+)
+# Right-hand side column of an equality, as in a JOIN ... ON a.x = b.y
+_RHS_COLUMN = re.compile(r"(?:==|=)\s*(?:(\w+)\.)[\"`\[]?(\w+)[\"`\]]?", re.I)
+_GROUP_BY = re.compile(r"\bgroup\s+by\s+(.+?)(?:\bhaving\b|\border\s+by\b|\blimit\b|$)", re.I | re.S)
+_COLUMN_REF = re.compile(r"(?:\b(\w+)\.)?[\"`\[]?\b(\w+)\b[\"`\]]?")
+
+
+# Recorded executions of generated SQL, persisted so the advisor CLI can use them
+class QueryLog:
+    def __init__(self, path=None):
+        if path is None:
+            os.makedirs(LOG_DIR, exist_ok=True)
+            path = os.path.join(LOG_DIR, "query_log.db")
+        self._lock = threading.Lock()
+        # Single connection guarded by _lock
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS query_log (
+                canonical TEXT PRIMARY KEY,
+                sql TEXT NOT NULL,
+                executions INTEGER NOT NULL,
+                last_seen REAL NOT NULL
+            )
+        """)
+        self._conn.commit()
+
+    # Count an execution of sql and return how often it has run
+    def record(self, sql):
+        canonical = canonicalize_sql(sql)
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO query_log (canonical, sql, executions, last_seen) VALUES (?, ?, 1, ?) "
+                "ON CONFLICT(canonical) DO UPDATE SET executions = executions + 1, last_seen = excluded.last_seen",
+                (canonical, sql, time.time()),
+            )
+            self._conn.commit()
+            return self._conn.execute(
+                "SELECT executions FROM query_log WHERE canonical = ?", (canonical,)
+            ).fetchone()[0]
+
+    def frequent(self, min_count=MIN_QUERY_COUNT):
+        with self._lock:
+            return self._conn.execute(
+                "SELECT sql, executions FROM query_log WHERE executions >= ? ORDER BY executions DESC",
+                (min_count,),
+            ).fetchall()
+
+
+# Plan problems worth an index: full table scans, automatic (transient)
+# indexes built by SQLite for a join, and temp B-trees for GROUP BY/ORDER BY
+def plan_findings(conn, sql):
+    plan = [row[3] for row in conn.execute("EXPLAIN QUERY PLAN " + sql)]
+    findings = []
+    for detail in plan:
+        automatic = re.match(r"(?:SEARCH|SCAN) (\w+) USING AUTOMATIC (?:COVERING |PARTIAL )*INDEX \((.*)\)", detail)
+        if automatic:
+            columns = [part.split("=")[0].split(">")[0].split("<")[0] for part in automatic.group(2).split(" AND ")]
+            findings.append({"kind": "automatic_index", "alias": automatic.group(1), "columns": columns})
+            continue
+        scan = re.match(r"SCAN (\w+)(.*)", detail)
+        if scan and "COVERING INDEX" not in scan.group(2) and scan.group(1) != "CONSTANT":
+            findings.append({"kind": "full_scan", "alias": scan.group(1)})
+            continue
+        temp = re.match(r"USE TEMP B-TREE FOR (.+)", detail)
+        if temp:
+            findings.append({"kind": "temp_btree", "purpose": temp.group(1)})
+    return plan, findings
+
+
+def _table_columns(conn):
+    tables = {}
+    for (name,) in conn.execute("SELECT name FROM sqlite_master WHERE type='table' AND name NOT LIKE 'sqlite_%'"):
+        tables[name.lower()] = (name, {row[1].lower(): row[1] for row in conn.execute(f'PRAGMA table_info("{name}")')})
+    return tables
+
+
+class _Resolver:
+    # Maps (qualifier, column) references in a query to (table, column)
+    def __init__(self, sql, tables):
+        self.aliases = {}
+        for table, alias in _TABLE_REF.findall(sql):
+            if table.lower() in tables:
+                name = tables[table.lower()][0]
+                self.aliases[table.lower()] = name
+                if alias:
+                    self.aliases[alias.lower()] = name
+        self.tables = tables
+
+    def resolve(self, qualifier, column):
+        column = column.lower()
+        if qualifier:
+            table = self.aliases.get(qualifier.lower())
+            if table and column in self.tables[table.lower()][1]:
+                return table, self.tables[table.lower()][1][column]
+            return None
+        matches = [
+            table for table in set(self.aliases.values())
+            if column in self.tables[table.lower()][1]
+        ]
+        if len(matches) == 1:
+            return matches[0], self.tables[matches[0].lower()][1][column]
+        return None
+
+
+# Whether table.column holds dates as 'M/D/YYYY' text, on which DATE() and
+# strftime() give NULL: an index on such an expression can never be used
+def _text_dates(conn, table, column):
+    declared = {row[1]: row[2] for row in conn.execute(f'PRAGMA table_info("{table}")')}
+    samples = [
+        value for (value,) in conn.execute(f'SELECT "{column}" FROM "{table}" WHERE "{column}" IS NOT NULL LIMIT 20')
+    ]
+    return date_format({"name": column, "type": declared.get(column, ""), "samples": samples}) == "M/D/YYYY"
+
+
+def _strip_literals(sql):
+    return re.sub(r"'(?:[^']|'')*'", "''", sql)
+
+
+def _literal_spans(sql):
+    return [match.span() for match in re.finditer(r"'(?:[^']|'')*'", sql)]
+
+
+# Propose indexes for one query. Each proposal is (table, key parts) where a
+# key part is a column name or an indexed expression such as DATE(Sale_Date).
+def propose_indexes(conn, sql):
+    plan, findings = plan_findings(conn, sql)
+    if not findings:
+        return plan, []
+    tables = _table_columns(conn)
+    resolver = _Resolver(sql, tables)
+    problem_tables = set()
+    for finding in findings:
+        if "alias" in finding:
+            table = resolver.aliases.get(finding["alias"].lower())
+            if table:
+                problem_tables.add(table)
+
+    proposals = []
+    # Transient indexes SQLite already builds on every run are the safest bet
+    for finding in findings:
+        if finding["kind"] == "automatic_index":
+            table = resolver.aliases.get(finding["alias"].lower())
+            if table:
+                proposals.append((table, tuple(finding["columns"])))
+
+    # Filters and join keys: equality columns first, then one range column
+    equality, ranges = {}, {}
+    body = _strip_literals(sql)
+    literals = _literal_spans(sql)
+    # Matched on the original text so strftime formats survive, skipping
+    # anything inside a string literal
+    for match in _PREDICATE.finditer(sql):
+        if any(start <= match.start("col") < end for start, end in literals):
+            continue
+        if match.group("func") and not match.group("close"):
+            continue
+        resolved = resolver.resolve(match.group("qual"), match.group("col"))
+        if not resolved:
+            continue
+        table, column = resolved
+        key = column
+        if match.group("func"):
+            if _text_dates(conn, table, column):
+                continue
+            func = match.group("func").split("(")[0].strip().upper()
+            key = f"{func}({(match.group('fmt') or '').strip()} {column})".replace("( ", "(")
+        op = match.group("op").lower()
+        target = equality if op in ("=", "==", "in") else ranges
+        target.setdefault(table, [])
+        if key not in target[table]:
+            target[table].append(key)
+    for match in _RHS_COLUMN.finditer(body):
+        resolved = resolver.resolve(match.group(1), match.group(2))
+        if resolved:
+            equality.setdefault(resolved[0], [])
+            if resolved[1] not in equality[resolved[0]]:
+                equality[resolved[0]].append(resolved[1])
+    for table in problem_tables:
+        key = list(equality.get(table, []))[:MAX_INDEX_COLUMNS - 1]
+        key += [part for part in ranges.get(table, []) if part not in key][:1]
+        if key:
+            proposals.append((table, tuple(key)))
+
+    # GROUP BY on a single table: index the grouping columns, covering the
+    # other columns the query reads from that table when they fit
+    if any(f["kind"] == "temp_btree" and "GROUP BY" in f["purpose"] for f in findings):
+        group = _GROUP_BY.search(body)
+        if group:
+            grouped = [resolver.resolve(q, c) for q, c in _COLUMN_REF.findall(group.group(1))]
+            grouped = [ref for ref in grouped if ref]
+            grouped_tables = {table for table, _ in grouped}
+            if len(grouped_tables) == 1:
+                table = grouped_tables.pop()
+                key = []
+                for _, column in grouped:
+                    if column not in key:
+                        key.append(column)
+                for qualifier, column in _COLUMN_REF.findall(body):
+                    resolved = resolver.resolve(qualifier, column)
+                    if resolved and resolved[0] == table and resolved[1] not in key:
+                        key.append(resolved[1])
+                if len(key) > MAX_INDEX_COLUMNS:
+                    key = key[:len({c for _, c in grouped})]
+                proposals.append((table, tuple(key)))
+
+    unique = []
+    for proposal in proposals:
+        if proposal not in unique and not _already_indexed(conn, *proposal):
+            unique.append(proposal)
+    return plan, unique
+
+
+def index_name(table, key):
+    digest = hashlib.sha1(",".join(key).encode("utf-8")).hexdigest()[:8]
+    readable = "_".join(re.sub(r"\W+", "", part) for part in key)[:40]
+    return f"idx_{table}_{readable}_{digest}"
+
+
+def index_ddl(table, key):
+    parts = ", ".join(part if "(" in part else f'"{part}"' for part in key)
+    return f'CREATE INDEX IF NOT EXISTS "{index_name(table, key)}" ON "{table}" ({parts})'
+
+
+def _already_indexed(conn, table, key):
+    if conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type='index' AND name = ?", (index_name(table, key),)
+    ).fetchone():
+        return True
+    # An existing index whose leading columns are the proposed key
+    for index in conn.execute(f'PRAGMA index_list("{table}")').fetchall():
+        columns = [row[2] for row in conn.execute(f'PRAGMA index_info("{index[1]}")')]
+        if tuple(columns[:len(key)]) == tuple(key):
+            return True
+    return False
+
+
+# Best of repeat runs, each admitted and budgeted by the query governor like
+# the app's own queries
+def time_query(conn, sql, repeat=3):
+    best = None
+    for _ in range(repeat):
+        with get_governor().run() as query, query.watch(conn):
+            start = time.perf_counter()
+            conn.execute(sql).fetchall()
+            elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+# Analyse sql and, when apply is set, build the proposed indexes. The report
+# holds the plan and timing before and (if applied) after. The database is
+# opened read-only unless indexes are to be built.
+def advise_query(sql, db_path=DB_PATH, apply=False):
+    if apply:
+        conn = sqlite3.connect(db_path)
+    else:
+        conn = sqlite3.connect(f"file:{os.path.abspath(db_path)}?mode=ro", uri=True)
+    try:
+        plan, proposals = propose_indexes(conn, sql)
+        report = {
+            "sql": sql,
+            "plan_before": plan,
+            "indexes": [index_ddl(table, key) for table, key in proposals],
+            "seconds_before": time_query(conn, sql),
+        }
+        if apply and proposals:
+            for ddl in report["indexes"]:
+                conn.execute(ddl)
+            conn.execute("ANALYZE")
+            conn.commit()
+            report["plan_after"] = [row[3] for row in conn.execute("EXPLAIN QUERY PLAN " + sql)]
+            report["seconds_after"] = time_query(conn, sql)
+        return report
+    finally:
+        conn.close()
+
+
+# Advise on every query run at least min_count times
+def advise(db_path=DB_PATH, min_count=MIN_QUERY_COUNT, apply=False, log=None):
+    log = log or get_query_log()
+    reports = []
+    for sql, executions in log.frequent(min_count):
+        try:
+            report = advise_query(sql, db_path, apply)
+        except (sqlite3.Error, QueryKilledError) as e:
+            report = {"sql": sql, "error": str(e)}
+        report["executions"] = executions
+        reports.append(report)
+    return reports
+
+
+_log = None
+_log_lock = threading.Lock()
+
+
+def get_query_log():
+    global _log
+    with _log_lock:
+        if _log is None:
+            _log = QueryLog()
+        return _log
+
+
+# Record an execution of generated SQL. With SPEAK2DB_AUTO_INDEX=1 the indexes
+# for a query are built in the background once it becomes frequent.
+def record_query(sql, db_path=DB_PATH):
+    executions = get_query_log().record(sql)
+    if AUTO_INDEX and executions == MIN_QUERY_COUNT:
+        threading.Thread(target=_auto_index, args=(sql, db_path), daemon=True).start()
+    return executions
+
+
+def _auto_index(sql, db_path):
+    try:
+        advise_query(sql, db_path, apply=True)
+    except (sqlite3.Error, QueryKilledError):
+        pass  # Best effort: the database may be read-only or busy, or the query over budget
+
+
+def print_report(report):
+    print("=" * 72)
+    print(report["sql"])
+    if "executions" in report:
+        print(f"executions: {report['executions']}")
+    if "error" in report:
+        print(f"error: {report['error']}")
+        return
+    print("plan before:")
+    for line in report["plan_before"]:
+        print(f"  {line}")
+    print(f"time before: {report['seconds_before'] * 1000:.2f} ms")
+    if not report["indexes"]:
+        print("no index proposed")
+    for ddl in report["indexes"]:
+        print(f"index: {ddl}")
+    if "plan_after" in report:
+        print("plan after:")
+        for line in report["plan_after"]:
+            print(f"  {line}")
+        print(f"time after: {report['seconds_after'] * 1000:.2f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Propose or build indexes for generated SQL")
+    parser.add_argument("--db", default=DB_PATH)
+    parser.add_argument("--sql", help="analyse this query instead of the recorded query log")
+    parser.add_argument("--min-count", type=int, default=MIN_QUERY_COUNT)
+    parser.add_argument("--apply", action="store_true", help="create the proposed indexes")
+    args = parser.parse_args()
+
+    if args.sql:
+        try:
+            reports = [advise_query(args.sql, args.db, args.apply)]
+        except (sqlite3.Error, QueryKilledError) as e:
+            reports = [{"sql": args.sql, "error": str(e)}]
+    else:
+        reports = advise(args.db, args.min_count, args.apply)
+    if not reports:
+        print("No recorded queries to analyse.")
+    for report in reports:
+        print_report(report)
+
+
+if __name__ == "__main__":
+    main()
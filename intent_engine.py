@@ -0,0 +1,412 @@
+import calendar
+import os
+import re
+import threading
+from datetime import date, timedelta
+
+from prompt_builder import tokenize
+from schema_catalog import iso_date_sql
+
+# Fraction of the question's words the grammar must account for before its
+# SQL is used instead of asking Gemini
+FAST_PATH_CONFIDENCE = float(os.getenv("SPEAK2DB_FAST_PATH_CONFIDENCE", "0.8"))
+
+REVENUE = "SUM(Quantity * Unit_Price * (1 - Discount))"
+
+# Columns whose values can be named in a question ("failed", "Texas", "UPI")
+SLOT_COLUMNS = {
+    ("SalesTable", "Category"),
+    ("SalesTable", "Product_Name"),
+    ("CustomerTable", "State"),
+    ("TransactionLog", "Status"),
+    ("TransactionLog", "Payment_Mode"),
+    ("TransactionLog", "Channel"),
+    ("TransactionLog", "Transaction_Type"),
+}
+
+# Question words for values that do not appear verbatim in the data
+VALUE_SYNONYMS = {
+    "successful": ("TransactionLog", "Status", "Success"),
+    "succeeded": ("TransactionLog", "Status", "Success"),
+    "unsuccessful": ("TransactionLog", "Status", "Failed"),
+    "in store": ("TransactionLog", "Channel", "In-store"),
+    "instore": ("TransactionLog", "Channel", "In-store"),
+}
+
+DATE_COLUMNS = {
+    "SalesTable": "Sale_Date",
+    "TransactionLog": "Transaction_Date",
+    "CustomerTable": "Registration_Date",
+}
+
+# Aggregates, tried in order: (pattern, table, expression, alias)
+MEASURES = [
+    (r"\baverage discount\b|\bavg discount\b", "SalesTable", "AVG(Discount)", "Avg_Discount"),
+    (r"\b(?:units|quantity|items) sold\b|\bunits\b|\bquantity\b", "SalesTable", "SUM(Quantity)", "Units_Sold"),
+    (r"\baverage (?:transaction )?amount\b|\baverage transaction\b", "TransactionLog", "AVG(Amount)", "Avg_Amount"),
+    (r"\b(?:transaction )?amount(?: spent| paid)?\b|\bspen[td]\b|\bspending\b", "TransactionLog", "SUM(Amount)", "Total_Amount"),
+    (r"\b(?:revenue|income|earnings|sales amount|sales value|sales)\b", "SalesTable", REVENUE, "Revenue"),
+]
+
+# Nouns that name a table, and what COUNT(*) over it is called
+NOUNS = {
+    "SalesTable": (r"sales?|orders?", "Sales"),
+    "TransactionLog": (r"transactions?|payments?", "Transactions"),
+    "CustomerTable": (r"customers?|clients?|buyers?", "Customers"),
+}
+
+# Grouping dimensions: (pattern, table, column); None columns group by date
+DIMENSIONS = [
+    (r"categor(?:y|ies)", "SalesTable", "Category"),
+    (r"products?(?: names?)?|items?", "SalesTable", "Product_Name"),
+    (r"(?:customers? )?states?", "CustomerTable", "State"),
+    (r"cit(?:y|ies)", "CustomerTable", "City"),
+    (r"customers?", "CustomerTable", "Customer_ID"),
+    (r"status(?:es)?", "TransactionLog", "Status"),
+    (r"payment (?:modes?|methods?|types?)|modes? of payment", "TransactionLog", "Payment_Mode"),
+    (r"channels?", "TransactionLog", "Channel"),
+    (r"transaction types?|types?", "TransactionLog", "Transaction_Type"),
+    (r"months?", None, "Month"),
+    (r"years?", None, "Year"),
+]
+_DIMENSION_WORDS = "|".join(f"(?:{pattern})" for pattern, _, _ in DIMENSIONS)
+
+_MONTHS = {name.lower(): number for number, name in enumerate(calendar.month_name) if name}
+_MONTHS.update({name.lower(): number for number, name in enumerate(calendar.month_abbr) if name})
+
+_COUNT = re.compile(r"\b(?:number of|count of|how many|count)\b")
+_TOP = re.compile(rf"\b(top|bottom|highest|lowest|best|worst|most|least)(?:\s+(\d+))?(?:\s+({_DIMENSION_WORDS})\b)?")
+# "Revenue per order" or "amount per transaction": a ratio over the rows of
+# a table, not a total
+_PER_ROW = re.compile(
+    r"\bper\s+(?:" + "|".join(noun for table_name, (noun, _) in NOUNS.items() if table_name != "CustomerTable") + r")\b"
+)
+_PERIODIC = re.compile(r"\b(?:(month)ly|(year)ly|annual(?:ly)?)\b")
+_GROUP = re.compile(rf"\b(?:by|per|for each|for every|in each|each|across|which|what)\s+({_DIMENSION_WORDS})\b")
+
+# Words that carry no meaning for the query beyond what tokenize() drops
+_FILLER = {
+    "has", "have", "had", "made", "generated", "were", "was", "did", "do", "does",
+    "there", "been", "be", "display", "tell", "overall", "data", "record",
+    "row", "result", "want", "see", "please", "can", "you", "we", "our", "us", "my",
+    "breakdown", "break", "down", "grouped", "group", "time", "period", "date",
+    "trend", "so", "far",
+}
+
+# Words asking for something the grammar cannot express (ratios, comparisons,
+# negation, other aggregates); if any is left unmatched the model answers
+_UNSUPPORTED = {
+    "share", "percent", "percentage", "rate", "ratio", "proportion", "average", "avg",
+    "mean", "median", "more", "less", "fewer", "than", "above", "below", "over", "under",
+    "exceed", "exceeding", "never", "not", "no", "without", "except", "excluding",
+    "largest", "smallest", "biggest", "maximum", "max", "minimum", "min", "distinct",
+    "unique", "compare", "versus", "vs", "growth", "change", "difference", "between",
+}
+
+
+# Question text with the span of a match blanked out, so that every word is
+# consumed by at most one slot and leftovers can be counted
+def _consume(text, match):
+    return text[:match.start()] + " " * (match.end() - match.start()) + text[match.end():]
+
+
+def _shift_months(day, months):
+    month = day.month - 1 + months
+    year = day.year + month // 12
+    month = month % 12 + 1
+    return date(year, month, min(day.day, calendar.monthrange(year, month)[1]))
+
+
+def _period_start(day, unit):
+    if unit == "week":
+        return day - timedelta(days=day.weekday())
+    if unit == "month":
+        return day.replace(day=1)
+    return day.replace(month=1, day=1)
+
+
+def _period_shift(start, unit, count):
+    if unit == "week":
+        return start + timedelta(weeks=count)
+    if unit == "month":
+        return _shift_months(start, count)
+    return start.replace(year=start.year + count)
+
+
+# Find one date range in text. Returns (text, (start, end)) with ISO bounds,
+# end exclusive, or (text, None).
+def _match_dates(text, today):
+    tomorrow = today + timedelta(days=1)
+    match = re.search(r"\b(?:in |over |during )?(?:the )?(?:last|past|previous)\s+(\d+)\s+(day|week|month|year)s?\b", text)
+    if match:
+        count, unit = int(match.group(1)), match.group(2)
+        if unit == "day":
+            start = today - timedelta(days=count - 1)
+        elif unit == "week":
+            start = today - timedelta(weeks=count) + timedelta(days=1)
+        else:
+            start = _shift_months(today, -count * (12 if unit == "year" else 1)) + timedelta(days=1)
+        return _consume(text, match), (start, tomorrow)
+    match = re.search(r"\b(?:in |during )?(?:the )?(last|previous|past|this|current)\s+(week|month|year)\b", text)
+    if match:
+        unit = match.group(2)
+        start = _period_start(today, unit)
+        if match.group(1) in ("this", "current"):
+            return _consume(text, match), (start, tomorrow)
+        return _consume(text, match), (_period_shift(start, unit, -1), start)
+    match = re.search(r"\b(today|yesterday)\b", text)
+    if match:
+        day = today if match.group(1) == "today" else today - timedelta(days=1)
+        return _consume(text, match), (day, day + timedelta(days=1))
+    month_names = "|".join(sorted(_MONTHS, key=len, reverse=True))
+    match = re.search(rf"\b(?:in |during )?({month_names})\s+((?:19|20)\d\d)\b", text)
+    if match:
+        start = date(int(match.group(2)), _MONTHS[match.group(1)], 1)
+        return _consume(text, match), (start, _shift_months(start, 1))
+    match = re.search(r"\b(?:in |during |for )?((?:19|20)\d\d)\b", text)
+    if match:
+        start = date(int(match.group(1)), 1, 1)
+        return _consume(text, match), (start, start.replace(year=start.year + 1))
+    return text, None
+
+
+_value_patterns = {}  # catalog version -> (compiled pattern, {lowered value: (table, column, value)})
+_value_lock = threading.Lock()
+
+
+# One alternation over every slot value, longest first so that "Credit Card"
+# wins over a shorter value it contains; compiled once per catalog version
+def _value_pattern(catalog, value_index):
+    with _value_lock:
+        compiled = _value_patterns.get(catalog["version"])
+        if compiled is not None:
+            return compiled
+    lookup = {}
+    for (table_name, column_name), values in value_index.items():
+        if (table_name, column_name) not in SLOT_COLUMNS:
+            continue
+        for value in values:
+            if isinstance(value, str) and len(value) > 1:
+                lookup.setdefault(value.lower(), (table_name, column_name, value))
+    for phrase, slot in VALUE_SYNONYMS.items():
+        if (slot[0], slot[1]) in value_index and slot[2] in value_index[(slot[0], slot[1])]:
+            lookup.setdefault(phrase, slot)
+    alternation = "|".join(re.escape(value) for value in sorted(lookup, key=len, reverse=True))
+    compiled = (re.compile(rf"(?<![\w-])({alternation})(?:e?s)?(?![\w-])") if lookup else None, lookup)
+    with _value_lock:
+        _value_patterns.clear()
+        _value_patterns[catalog["version"]] = compiled
+    return compiled
+
+
+# ISO date expression for a date column, or None if its format is unknown
+def _iso_date(catalog, table_name, qualify):
+    column_name = DATE_COLUMNS.get(table_name)
+    table = catalog["tables"].get(table_name)
+    column = next((c for c in table["columns"] if c["name"] == column_name), None) if table else None
+    if column is None:
+        return None
+    return iso_date_sql(column, f"{table_name}.{column_name}" if qualify else column_name)
+
+
+# Match a question against the intent grammar. Returns {"intent", "sql",
+# "params", "confidence"} with parameterized SQL, or None when the question
+# is not one the grammar understands. today is the reference for "last month".
+def match_intent(question, catalog, value_index, today=None):
+    today = today or date.today()
+    text = " " + re.sub(r"[^\w\s-]", " ", question.lower()) + " "
+
+    text, date_range = _match_dates(text, today)
+    if _PER_ROW.search(text):
+        return None
+
+    top = None
+    top_dimension = None  # What "top" ranks when it names it
+    group = []  # (table, column)
+    match = _TOP.search(text)
+    if match:
+        ascending = match.group(1) in ("bottom", "lowest", "worst", "least")
+        top = (int(match.group(2)) if match.group(2) else (5 if match.group(1) in ("top", "bottom") else 1), ascending)
+        dimension = match.group(3) and _dimension(match.group(3))
+        if dimension == ("CustomerTable", "Customer_ID") and match.group(1) in ("most", "least"):
+            # "The most customers" is what is counted; leave the noun to count it
+            text = text[:match.start()] + " " * (match.start(3) - match.start()) + text[match.start(3):]
+        else:
+            if dimension:
+                group.append(dimension)
+                top_dimension = dimension
+            text = _consume(text, match)
+
+    filters = {}  # (table, column) -> [values]
+    pattern, lookup = _value_pattern(catalog, value_index)
+    while pattern is not None:
+        match = pattern.search(text)
+        if not match:
+            break
+        table_name, column_name, value = lookup[match.group(1)]
+        values = filters.setdefault((table_name, column_name), [])
+        if value not in values:
+            values.append(value)
+        text = _consume(text, match)
+
+    measure = None
+    count = False
+    match = _COUNT.search(text)
+    if match:
+        count = True
+        text = _consume(text, match)
+    for measure_pattern, table_name, expression, alias in MEASURES:
+        match = re.search(measure_pattern, text)
+        # "How many sales" counts rows; the noun only means revenue when nothing is counted
+        if match and not (count and re.fullmatch(NOUNS[table_name][0], match.group(0))):
+            measure = (table_name, expression, alias)
+            text = _consume(text, match)
+            break
+
+    matches = list(_GROUP.finditer(text)) + list(_PERIODIC.finditer(text))
+    for match in matches:
+        dimension = _dimension(match.group(1) or match.group(2) or "year")
+        others = group + [_dimension(other.group(1) or other.group(2) or "year") for other in matches if other is not match]
+        if dimension == ("CustomerTable", "Customer_ID") and match.group(0).startswith("by") and any(
+            other != dimension for other in others
+        ):
+            # "Top 5 states by customers" counts the customers of each state
+            text = text[:match.start()] + "  " + text[match.start() + 2:]
+            continue
+        if dimension not in group:
+            group.append(dimension)
+        text = _consume(text, match)
+    if top is not None and not group:
+        return None  # "Top 5 sales" asks for ranked rows, which the grammar does not build
+    if top_dimension and any(dimension != top_dimension for dimension in group):
+        return None  # "Sales by product for top customers" ranks one thing and groups by another
+
+    noun_table = None
+    for table_name, (noun, _) in NOUNS.items():
+        match = re.search(rf"\b(?:{noun})\b", text)
+        if match:
+            noun_table = noun_table or table_name
+            text = _consume(text, match)
+
+    # The table being measured or listed; others are reached by joining on Customer_ID
+    main = (
+        (measure and measure[0]) or noun_table
+        or next((table for table, _ in filters if table != "CustomerTable"), None)
+        or next((table for table, _ in group if table), None)
+        or next((table for table, _ in filters), None)
+    )
+    if main is None or main not in catalog["tables"]:
+        return None
+    tables = {table for table, _ in filters} | {table for table, _ in group if table}
+    if tables - {main, "CustomerTable"} or (tables - {main} and main == "CustomerTable"):
+        return None
+    if main == "CustomerTable" and ("CustomerTable", "Customer_ID") in group:
+        return None  # One row per customer: every count would be 1
+    join = "CustomerTable" in tables and main != "CustomerTable"
+    for table_name, column_name in list(filters) + [d for d in group if d[0]]:
+        if table_name not in catalog["tables"] or column_name not in {
+            c["name"] for c in catalog["tables"][table_name]["columns"]
+        }:
+            return None
+
+    if set(re.findall(r"[a-z]+", text)) & _UNSUPPORTED:
+        return None
+    words = tokenize(question)
+    leftover = [word for word in tokenize(text) if word not in _FILLER]
+    confidence = 1 - len(leftover) / max(len(words), 1)
+
+    def name(table_name, column_name):
+        return f"{table_name}.{column_name}" if join else column_name
+
+    params = []
+    conditions = []
+    for (table_name, column_name), values in filters.items():
+        if len(values) == 1:
+            conditions.append(f"{name(table_name, column_name)} = ?")
+        else:
+            conditions.append(f"{name(table_name, column_name)} IN ({', '.join('?' * len(values))})")
+        params.extend(values)
+    iso_date = _iso_date(catalog, main, join)
+    if date_range:
+        if iso_date is None:
+            return None
+        conditions.append(f"{iso_date} BETWEEN ? AND ?")
+        params.extend([date_range[0].isoformat(), (date_range[1] - timedelta(days=1)).isoformat()])
+
+    aggregate = measure is not None or count or group or top is not None
+    if not aggregate and not (conditions and noun_table):
+        return None
+
+    if not aggregate:
+        sql = f"SELECT *\nFROM {main}"
+        intent = "list"
+    else:
+        if measure is None:
+            measure = (main, "COUNT(*)", NOUNS[main][1])
+        expression = measure[1]
+        if join:
+            expression = re.sub(r"\b(Quantity|Unit_Price|Discount|Amount)\b", rf"{main}.\1", expression)
+        columns = []
+        for table_name, column_name in group:
+            if table_name is None:
+                if iso_date is None:
+                    return None
+                length = 7 if column_name == "Month" else 4
+                columns.append((f"substr({iso_date}, 1, {length}) AS {column_name}", column_name))
+            elif column_name == "Customer_ID":
+                for customer_column in ("Customer_ID", "First_Name", "Last_Name"):
+                    columns.append((f"CustomerTable.{customer_column}" if join else customer_column, None))
+            else:
+                columns.append((name(table_name, column_name), None))
+        select = ", ".join([column for column, _ in columns] + [f"{expression} AS {measure[2]}"])
+        sql = f"SELECT {select}\nFROM {main}"
+        intent = "aggregate"
+    if join:
+        sql += f"\nJOIN CustomerTable ON {main}.Customer_ID = CustomerTable.Customer_ID"
+    if conditions:
+        sql += "\nWHERE " + " AND ".join(conditions)
+    if intent == "aggregate":
+        if group:
+            keys = [alias or column for column, alias in columns]
+            sql += "\nGROUP BY " + ", ".join(
+                key for key in keys if not key.endswith(("First_Name", "Last_Name"))
+            )
+        if top is not None:
+            sql += f"\nORDER BY {measure[2]} {'ASC' if top[1] else 'DESC'}\nLIMIT {top[0]}"
+        elif any(table_name is None for table_name, _ in group):
+            sql += "\nORDER BY " + ", ".join(column for table_name, column in group if table_name is None)
+        elif group:
+            sql += f"\nORDER BY {measure[2]} DESC"
+    return {"intent": intent, "sql": sql, "params": params, "confidence": confidence}
+
+
+def _dimension(word):
+    for pattern, table_name, column_name in DIMENSIONS:
+        if re.fullmatch(pattern, word):
+            return (table_name, column_name)
+    return None
+
+
+# The intent for a question if the grammar is confident enough, else None
+# (the caller falls back to Gemini)
+def fast_path(question, catalog, value_index, today=None, min_confidence=FAST_PATH_CONFIDENCE):
+    intent = match_intent(question, catalog, value_index, today)
+    if intent is None or intent["confidence"] < min_confidence:
+        return None
+    return intent
+
+
+# SQL with its parameters written in as literals, for display, history and
+# cache keys; execution still binds the parameters
+def render_sql(sql, params):
+    values = iter(params)
+
+    def literal(match):
+        if match.group(0) != "?":
+            return match.group(0)
+        value = next(values)
+        if isinstance(value, (int, float)):
+            return repr(value)
+        return "'" + str(value).replace("'", "''") + "'"
+
+    return re.sub(r"'(?:[^']|'')*'|\?", literal, sql)
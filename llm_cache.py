@@ -0,0 +1,226 @@
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import time
+
+CACHE_DIR = os.getenv("SPEAK2DB_CACHE_DIR", ".speak2db_cache")
+CACHE_TTL = 7 * 24 * 3600  # Seconds before a cached response expires
+CACHE_MAX_ENTRIES = 5000  # Least recently used entries beyond this are evicted
+SIMILARITY_THRESHOLD = 0.85  # Minimum trigram similarity for a near-duplicate hit
+SIMILARITY_CANDIDATES = 500  # Most recently used entries compared on an exact miss
+
+
+# Lowercase, drop punctuation and collapse whitespace so trivially different
+# phrasings of the same question share a cache entry
+def normalize_question(question):
+    question = question.lower().strip()
+    question = re.sub(r"[^\w\s'.-]", " ", question)
+    question = re.sub(r"\s+", " ", question)
+    return question.strip(" .")
+
+
+# History the prompt for question is built from. Streamlit reruns the
+# script on every widget change, and a rerun must not see the question's own
+# entries, or its prompt and cache key would change with each rerun.
+def prompt_history(history, question):
+    end = len(history)
+    while end and history[end - 1]["input"] == question:
+        end -= 1
+    return history[:end]
+
+
+# Hash of the part of the history that goes into the prompt
+def history_fingerprint(history, limit=3):
+    digest = hashlib.sha1()
+    for entry in history[-limit:]:
+        digest.update(entry["input"].encode("utf-8"))
+        digest.update(b"\0")
+        digest.update(entry["sql_query"].encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()[:16]
+
+
+def _trigrams(text):
+    padded = f"  {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def _similarity(a, b):
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+NEGATIONS = {"not", "no", "without", "except", "excluding", "never", "non"}
+DIRECTIONS = {
+    "max", "maximum", "min", "minimum", "highest", "lowest", "top", "bottom", "most", "least",
+    "largest", "smallest", "biggest", "greatest", "fewest", "asc", "ascending", "desc", "descending",
+}
+MONTHS = {
+    name: number
+    for number, names in enumerate(
+        [("january", "jan"), ("february", "feb"), ("march", "mar"), ("april", "apr"), ("may",), ("june", "jun"),
+         ("july", "jul"), ("august", "aug"), ("september", "sep", "sept"), ("october", "oct"),
+         ("november", "nov"), ("december", "dec")],
+        1,
+    )
+    for name in names
+}
+
+
+def _guard_tokens(text, values=()):
+    # Questions differing only in a number ("top 5" vs "top 10", "2023" vs
+    # "2024"), a negation, a direction ("maximum" vs "minimum", "ascending"
+    # vs "descending"), a month or a value from the data ("Apparel" vs
+    # "Footwear") look alike to trigrams but need different SQL
+    words = text.split()
+    numbers = re.findall(r"\d+(?:\.\d+)?", text)
+    negations = [word for word in words if word in NEGATIONS or word.endswith("n't")]
+    directions = [word for word in words if word in DIRECTIONS]
+    months = [MONTHS[word] for word in words if word in MONTHS]
+    slots = [value for value in values if re.search(rf"(?<!\w){re.escape(value)}(?!\w)", text)]
+    return sorted(numbers), sorted(negations), sorted(directions), sorted(months), sorted(slots)
+
+
+class ResponseCache:
+    def __init__(self, path=None, ttl=CACHE_TTL, max_entries=CACHE_MAX_ENTRIES,
+                 threshold=SIMILARITY_THRESHOLD):
+        if path is None:
+            os.makedirs(CACHE_DIR, exist_ok=True)
+            path = os.path.join(CACHE_DIR, "llm_cache.db")
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.threshold = threshold
+        self._trigram_index = {}  # key -> trigram set of the normalized question
+        self._lock = threading.Lock()
+        # Single connection guarded by _lock
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode = WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS llm_cache (
+                key TEXT PRIMARY KEY,
+                question TEXT NOT NULL,
+                history_hash TEXT NOT NULL,
+                schema_fp TEXT NOT NULL,
+                response TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                last_used REAL NOT NULL,
+                hits INTEGER NOT NULL DEFAULT 0
+            )
+        """)
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS llm_cache_context ON llm_cache (schema_fp, history_hash, last_used)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS llm_cache_last_used ON llm_cache (last_used)")
+        self._conn.commit()
+
+    @staticmethod
+    def make_key(question, history_hash, schema_fp):
+        raw = f"{normalize_question(question)}\0{history_hash}\0{schema_fp}"
+        return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+    def _touch(self, key, now):
+        self._conn.execute(
+            "UPDATE llm_cache SET last_used = ?, hits = hits + 1 WHERE key = ?", (now, key)
+        )
+        self._conn.commit()
+
+    def _grams(self, key, question):
+        grams = self._trigram_index.get(key)
+        if grams is None:
+            grams = _trigrams(question)
+            self._trigram_index[key] = grams
+        return grams
+
+    # Return (response, match) where match is "exact", "similar" or None on a
+    # miss. values are the data's known column values (categories, states,
+    # ...); a near duplicate must mention the same ones.
+    def lookup(self, question, history_hash, schema_fp, values=()):
+        normalized = normalize_question(question)
+        key = self.make_key(question, history_hash, schema_fp)
+        now = time.time()
+        oldest = now - self.ttl
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT response FROM llm_cache WHERE key = ? AND created_at >= ?", (key, oldest)
+            ).fetchone()
+            if row:
+                self._touch(key, now)
+                return row[0], "exact"
+
+            # Near-duplicate search among recent entries with the same context
+            grams = _trigrams(normalized)
+            values = {normalize_question(str(value)) for value in values} - {""}
+            guard = _guard_tokens(normalized, values)
+            best_key, best_response, best_score = None, None, 0.0
+            candidates = self._conn.execute(
+                "SELECT key, question, response FROM llm_cache "
+                "WHERE schema_fp = ? AND history_hash = ? AND created_at >= ? "
+                "ORDER BY last_used DESC LIMIT ?",
+                (schema_fp, history_hash, oldest, SIMILARITY_CANDIDATES),
+            ).fetchall()
+            for candidate_key, candidate_question, response in candidates:
+                score = _similarity(grams, self._grams(candidate_key, candidate_question))
+                if score < self.threshold or score <= best_score:
+                    continue
+                if _guard_tokens(candidate_question, values) == guard:
+                    best_key, best_response, best_score = candidate_key, response, score
+            if best_key is not None:
+                self._touch(best_key, now)
+                return best_response, "similar"
+        return None, None
+
+    def get(self, question, history_hash, schema_fp):
+        return self.lookup(question, history_hash, schema_fp)[0]
+
+    def put(self, question, history_hash, schema_fp, response):
+        key = self.make_key(question, history_hash, schema_fp)
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO llm_cache "
+                "(key, question, history_hash, schema_fp, response, created_at, last_used, hits) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, 0)",
+                (key, normalize_question(question), history_hash, schema_fp, response, now, now),
+            )
+            self._evict(now)
+            self._conn.commit()
+
+    # Remove the entry for question, and any near-duplicate entry that served
+    # the same response, e.g. after the SQL failed to execute
+    def discard(self, question, history_hash, schema_fp, response=None):
+        key = self.make_key(question, history_hash, schema_fp)
+        with self._lock:
+            self._conn.execute("DELETE FROM llm_cache WHERE key = ?", (key,))
+            if response is not None:
+                self._conn.execute(
+                    "DELETE FROM llm_cache WHERE schema_fp = ? AND history_hash = ? AND response = ?",
+                    (schema_fp, history_hash, response),
+                )
+            self._conn.commit()
+            self._trigram_index.pop(key, None)
+
+    def _evict(self, now):
+        self._conn.execute("DELETE FROM llm_cache WHERE created_at < ?", (now - self.ttl,))
+        self._conn.execute(
+            "DELETE FROM llm_cache WHERE key IN ("
+            "SELECT key FROM llm_cache ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+            (self.max_entries,),
+        )
+        if len(self._trigram_index) > self.max_entries:
+            self._trigram_index.clear()
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+# Shared, process-wide response cache
+def get_response_cache():
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = ResponseCache()
+        return _cache
@@ -0,0 +1,157 @@
+import os
+import re
+import threading
+import time
+from types import SimpleNamespace
+
+# Which model answers prompts: "gemini" (google.generativeai) or "stub", a
+# deterministic local stand-in for offline and reproducible runs. Anything
+# with generate_content(parts, stream=False) can be registered as a backend.
+MODEL_BACKEND = os.getenv("SPEAK2DB_MODEL_BACKEND", "gemini")
+STUB_LATENCY_MS = float(os.getenv("SPEAK2DB_STUB_LATENCY_MS", "0"))
+
+
+_gemini_configured = False
+
+
+# The Gemini SDK takes about a second to import, so it is loaded and
+# configured on the first model request rather than at app start
+def _gemini_model(name):
+    global _gemini_configured
+    import google.generativeai as genai
+
+    if not _gemini_configured:
+        genai.configure(api_key=os.getenv("GOOGLE_API_KEY"))
+        _gemini_configured = True
+    return genai.GenerativeModel(name)
+
+
+# Errors of the Gemini API worth retrying: (retryable, of which rate limits)
+def _gemini_errors():
+    from google.api_core import exceptions
+
+    rate_limits = (exceptions.ResourceExhausted, exceptions.TooManyRequests)
+    transient = (exceptions.ServiceUnavailable, exceptions.DeadlineExceeded, exceptions.InternalServerError)
+    return rate_limits + transient, rate_limits
+
+
+_backends = {"gemini": _gemini_model}
+_error_factories = {"gemini": _gemini_errors}
+_backend_lock = threading.Lock()
+_models = {}  # (backend, model name) -> shared model client
+_model_lock = threading.Lock()
+
+
+# Register factory(model_name) -> model under name. errors, if given, is
+# called to get the backend's (retryable, rate limit) exception classes.
+def register_backend(name, factory, errors=None):
+    with _backend_lock:
+        _backends[name] = factory
+        if errors is not None:
+            _error_factories[name] = errors
+    with _model_lock:
+        for key in [key for key in _models if key[0] == name]:
+            del _models[key]
+
+
+def set_backend(name):
+    global MODEL_BACKEND
+    with _backend_lock:
+        if name not in _backends:
+            raise ValueError(f"Unknown model backend {name!r}; choose from {', '.join(sorted(_backends))}")
+        MODEL_BACKEND = name
+
+
+def create_model(name, backend=None):
+    with _backend_lock:
+        backend = backend or MODEL_BACKEND
+        factory = _backends.get(backend)
+    if factory is None:
+        raise ValueError(f"Unknown model backend {backend!r}")
+    return factory(name)
+
+
+# Exception classes of the current backend that are worth retrying, as
+# (retryable, rate limits). Only the active backend's SDK is imported, so
+# the stub needs none of Gemini's packages.
+def transient_errors():
+    with _backend_lock:
+        factory = _error_factories.get(MODEL_BACKEND)
+    return factory() if factory is not None else ((), ())
+
+
+# Process-wide model client for name on the current backend, created on
+# first use and shared by every request and session
+def get_model(name):
+    with _backend_lock:
+        backend = MODEL_BACKEND
+    with _model_lock:
+        model = _models.get((backend, name))
+        if model is None:
+            model = _models[(backend, name)] = create_model(name, backend)
+        return model
+
+
+# Stand-in for genai.GenerativeModel that needs no network. SQL prompts are
+# answered from `answers` (normalized question -> SQL) or else by the local
+# intent grammar at any confidence; summary prompts get a fixed description
+# of the data preview. Output is streamed in chunk_chars pieces after
+# latency_ms, so streaming and timing code paths are exercised too.
+class StubModel:
+    def __init__(self, answers=None, latency_ms=STUB_LATENCY_MS, chunk_chars=24, db_path="sales_database.db"):
+        self.answers = answers or {}
+        self.latency_ms = latency_ms
+        self.chunk_chars = chunk_chars
+        self.db_path = db_path
+        self.unanswered = set()  # Normalized questions given the placeholder query
+
+    def generate_content(self, parts, stream=False):
+        prompt = "\n".join(str(part) for part in parts)
+        text = self.respond(prompt)
+        if self.latency_ms:
+            time.sleep(self.latency_ms / 1000)
+        chunks = [
+            SimpleNamespace(text=text[i:i + self.chunk_chars])
+            for i in range(0, len(text), self.chunk_chars)
+        ] or [SimpleNamespace(text="")]
+        if stream:
+            return iter(chunks)
+        return SimpleNamespace(text=text)
+
+    def respond(self, prompt):
+        if "expert data summarizer" in prompt:
+            return self._summary(prompt)
+        question = _section(prompt, "Current Question:") or _section(prompt, "Question:") or ""
+        return self._sql(question.strip()).rstrip().rstrip(";") + ";"  # Terminated, as the prompt asks
+
+    def _sql(self, question):
+        from intent_engine import match_intent, render_sql
+        from llm_cache import normalize_question
+        from nl2sql import load_column_values
+        from schema_catalog import get_schema_catalog
+
+        answer = self.answers.get(normalize_question(question))
+        if answer:
+            return answer
+        catalog = get_schema_catalog(self.db_path)
+        intent = match_intent(question, catalog, load_column_values(catalog, self.db_path))
+        if intent:
+            return render_sql(intent["sql"], intent["params"])
+        # No answer: a placeholder that runs, so the pipeline can still be timed
+        self.unanswered.add(normalize_question(question))
+        return f"SELECT COUNT(*) AS Rows FROM {next(iter(catalog['tables']))}"
+
+    def _summary(self, prompt):
+        preview = (_section(prompt, "Data Preview:") or "").strip().splitlines()
+        rows = max(len(preview) - 1, 0)
+        header = preview[0].split() if preview else []
+        return f"The result has {rows} rows in the preview with columns {', '.join(header)}."
+
+
+# Text after a heading line, up to the next blank line
+def _section(prompt, heading):
+    match = re.search(rf"{re.escape(heading)}\s*\n(.*?)(?:\n\s*\n|\Z)", prompt, re.S)
+    return match.group(1) if match else None
+
+
+register_backend("stub", lambda name: StubModel())
@@ -0,0 +1,260 @@
+import importlib
+import threading
+import time
+from contextlib import contextmanager
+
+from db_engine import QUERY_BACKEND, get_engine, get_query_engine
+from intent_engine import fast_path, render_sql
+from llm_cache import get_response_cache, history_fingerprint
+from model_backend import get_model
+from prompt_builder import DIALECTS, build_history_context, build_prompt, estimate_tokens, get_value_index
+from rollups import rewrite_query
+from schema_catalog import get_schema_catalog
+from sql_extract import complete_statement, extract_sql
+from sql_guard import VALIDATORS, SQLValidationError
+from tracing import span
+
+# Question -> SQL without any Streamlit UI, shared by app.py and the headless
+# batch runner. Errors are raised; callers decide how to report them.
+
+DB_PATH = "sales_database.db"
+MODEL_NAME = "gemini-2.0-flash"
+
+
+# Add the duration of the block to timings[name] in milliseconds, if timings
+# is a dict
+@contextmanager
+def _timed(timings, name):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        if timings is not None:
+            timings[name] = timings.get(name, 0) + (time.perf_counter() - started) * 1000
+
+
+# Distinct values of the low-cardinality text columns, cached per catalog version
+def load_column_values(catalog, db_path=DB_PATH):
+    with get_engine(db_path).connection() as conn:
+        return get_value_index(catalog, conn)
+
+
+def sql_prompt(question, catalog, db_path=DB_PATH):
+    with span("prompt") as s:
+        prompt = build_prompt(
+            question, catalog, load_column_values(catalog, db_path), dialect=get_query_engine(db_path).dialect
+        )
+        s.set("prompt.tokens", estimate_tokens(prompt))
+        return prompt
+
+
+# The local intent engine's SQL for a question, or None
+def match_fast_path(question, catalog, db_path=DB_PATH):
+    with span("fast_path") as s:
+        intent = fast_path(question, catalog, load_column_values(catalog, db_path))
+        s.set("fast_path.hit", intent is not None)
+        return intent
+
+
+# Token counts of a model call on its span: the API's usage metadata when
+# the response carries it, otherwise an estimate from the text
+def _record_tokens(s, prompt, text, usage):
+    s.set("llm.prompt_tokens", getattr(usage, "prompt_token_count", None) or estimate_tokens(prompt))
+    s.set("llm.completion_tokens", getattr(usage, "candidates_token_count", None) or estimate_tokens(text))
+
+
+# Gemini's SQL for a question, served from the response cache when possible.
+# Returns (response text, "cache" or "model").
+def request_sql(question, prompt, history=(), db_path=DB_PATH):
+    with span("llm", model=MODEL_NAME) as s:
+        return _request_sql(s, question, prompt, history, db_path)
+
+
+def _request_sql(s, question, prompt, history, db_path):
+    cache = get_response_cache()
+    history_hash = history_fingerprint(history)
+    schema_fp = schema_fingerprint(db_path)
+    value_index = load_column_values(get_schema_catalog(db_path), db_path)
+    values = [value for column_values in value_index.values() for value in column_values]
+    cached, match = cache.lookup(question, history_hash, schema_fp, values)
+    s.set("cache.result", match or "miss")
+    if cached:
+        return cached, "cache"
+
+    # Recent history, trimmed to its own token budget
+    history_context = build_history_context(history)
+
+    # Combine the history context with the current question
+    full_prompt = f"""{prompt}
+Conversation History:
+{history_context or "None"}
+
+Current Question:
+{question}
+"""
+
+    # Stream the response from Gemini and stop reading as soon as a
+    # complete statement has arrived, so execution does not wait for
+    # trailing tokens
+    model = get_model(MODEL_NAME)
+    text = ""
+    usage = None
+    for chunk in model.generate_content([full_prompt], stream=True):
+        text += chunk.text
+        usage = getattr(chunk, "usage_metadata", None) or usage
+        statement = complete_statement(text)
+        if statement:
+            text = statement
+            break
+    _record_tokens(s, full_prompt, text, usage)
+    cache.put(question, history_hash, schema_fp, text)
+    return text, "model"
+
+
+# Schema part of the response cache key. SQL written for another dialect
+# must not be served, so it is part of the key for non-SQLite engines.
+def schema_fingerprint(db_path=DB_PATH):
+    fingerprint = get_schema_catalog(db_path)["fingerprint"]
+    dialect = get_query_engine(db_path).dialect
+    return fingerprint if dialect == "sqlite" else f"{fingerprint}:{dialect}"
+
+
+# Validate generated SQL on a connection of the engine that will run it;
+# raises SQLValidationError
+def check_sql(sql_query, db_path=DB_PATH):
+    engine = get_query_engine(db_path)
+    with span("validation"), engine.connection() as conn:
+        return VALIDATORS[engine.dialect](sql_query, conn, get_schema_catalog(db_path))
+
+
+# Ask Gemini to fix a query that failed validation
+def request_repair(question, prompt, sql_query, error, db_path=DB_PATH):
+    dialect = DIALECTS[get_query_engine(db_path).dialect]["name"]
+    repair_prompt = f"""
+    {prompt}
+
+    Question:
+    {question}
+
+    This SQL query was generated for the question but was rejected:
+    {sql_query}
+
+    Reason:
+    {error}
+
+    Return only the corrected {dialect} query, ending with a semicolon.
+    """
+    with span("repair", model=MODEL_NAME) as s:
+        model = get_model(MODEL_NAME)
+        response = model.generate_content([repair_prompt])
+        _record_tokens(s, repair_prompt, response.text, getattr(response, "usage_metadata", None))
+        return response.text
+
+
+# The whole generation path for one question: local fast path, then Gemini
+# (or its cache), validation and one repair attempt. Returns {"sql" (with
+# parameters rendered), "query" and "params" (to execute), "backend" (the
+# get_engine backend to execute on), "source"} where source is "fast_path",
+# "cache", "model" or "repair". on_repair(error) is
+# called before a repair is requested. Raises SQLValidationError if the SQL
+# is still invalid after the repair. timings, if a dict, receives the
+# milliseconds spent in each stage.
+def generate_sql(question, history=(), db_path=DB_PATH, on_repair=None, timings=None):
+    catalog = get_schema_catalog(db_path)
+    with _timed(timings, "fast_path"):
+        intent = match_fast_path(question, catalog, db_path)
+    if intent:
+        # "query" is what runs: answered from a rollup table when one matches
+        query, params = rewrite_query(intent["sql"], intent["params"], db_path)
+        return {
+            "sql": render_sql(intent["sql"], intent["params"]),
+            "query": query,
+            "params": params,
+            "backend": "sqlite",  # Fast path SQL is written for SQLite
+            "source": "fast_path",
+        }
+
+    with _timed(timings, "prompt"):
+        prompt = sql_prompt(question, catalog, db_path)
+    with _timed(timings, "llm"):
+        response, source = request_sql(question, prompt, history, db_path)
+    sql_query = extract_sql(response)
+    try:
+        with _timed(timings, "validation"):
+            check_sql(sql_query, db_path)
+    except SQLValidationError as e:
+        if on_repair is not None:
+            on_repair(e)
+        cache_key = (question, history_fingerprint(history), schema_fingerprint(db_path))
+        get_response_cache().discard(*cache_key, response)
+        with _timed(timings, "repair"):
+            sql_query = extract_sql(request_repair(question, prompt, sql_query, str(e), db_path))
+        with _timed(timings, "validation"):
+            check_sql(sql_query, db_path)
+        get_response_cache().put(*cache_key, sql_query)
+        source = "repair"
+    backend = QUERY_BACKEND
+    query, params = rewrite_query(sql_query, None, db_path) if backend == "sqlite" else (sql_query, None)
+    return {"sql": sql_query, "query": query, "params": params, "backend": backend, "source": source}
+
+
+_warmed_up = set()  # db_paths whose warm-up has been started
+_warm_up_lock = threading.Lock()
+
+
+# Create the model client, the query engine, and the schema catalog and value
+# index of db_path in a background thread, once per process, so the first
+# question does not pay for them. modules (e.g. "plotly.express") are
+# imported too. Failures are left for the first real use to report.
+def warm_up(db_path=DB_PATH, modules=()):
+    with _warm_up_lock:
+        if db_path in _warmed_up:
+            return
+        _warmed_up.add(db_path)
+    threading.Thread(target=_warm_up, args=(db_path, modules), daemon=True).start()
+
+
+def _warm_up(db_path, modules):
+    try:
+        with span("warm_up"):
+            for module in modules:
+                importlib.import_module(module)
+            get_model(MODEL_NAME)
+            get_query_engine(db_path)
+            load_column_values(get_schema_catalog(db_path), db_path)
+    except Exception:
+        pass
+
+
+# Summary of a query result by the model
+# on_text, if given, receives the summary so far as tokens stream in. Once
+# cancel (a threading.Event) is set, the stream stops and the summary so
+# far is returned.
+def generate_summary(dataframe, user_question, on_text=None, cancel=None):
+    # Convert the DataFrame to a string representation for the prompt
+    data_preview = dataframe.head(10).to_string(index=False)  # Show only the first 10 rows
+    prompt = f"""
+    You are an expert data summarizer. Summarize the following data in a concise and meaningful way.
+
+    User Question:
+    {user_question}
+
+    Data Preview:
+    {data_preview}
+
+    Provide a summary that highlights key insights, trends, or patterns in the data.
+    """
+    with span("summary", model=MODEL_NAME) as s:
+        model = get_model(MODEL_NAME)
+        summary = ""
+        usage = None
+        for chunk in model.generate_content([prompt], stream=True):
+            if cancel is not None and cancel.is_set():
+                s.set("summary.cancelled", True)
+                break
+            summary += chunk.text
+            usage = getattr(chunk, "usage_metadata", None) or usage
+            if on_text is not None:
+                on_text(summary)
+        _record_tokens(s, prompt, summary, usage)
+        return summary
@@ -0,0 +1,99 @@
+import asyncio
+import threading
+import time
+
+JOB_TTL = 3600  # Seconds a finished job's results are kept for reruns
+
+
+# A unit of background work for one session. The coroutine publishes partial
+# results (e.g. the summary before its audio) so the page can show them early.
+# Cancelling a job only cancels its coroutine, not the threads it awaits
+# (asyncio.to_thread), so blocking work checks cancel_event between steps.
+class Job:
+    def __init__(self, key):
+        self.key = key
+        self.partial = {}
+        self.future = None
+        self.finished_at = None
+        self.cancel_event = threading.Event()
+
+    def publish(self, name, value):
+        self.partial[name] = value
+
+    def done(self):
+        return self.future.done()
+
+    def cancel(self):
+        self.cancel_event.set()
+        self.future.cancel()
+
+    def cancelled(self):
+        return self.future.cancelled()
+
+    # Exception raised by the coroutine, or None
+    def error(self):
+        if not self.future.done() or self.future.cancelled():
+            return None
+        return self.future.exception()
+
+
+# Runs coroutines on an asyncio event loop in a daemon thread, so slow work
+# (Gemini calls, speech synthesis) never blocks a Streamlit script thread
+class BackgroundPipeline:
+    def __init__(self):
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(
+            target=self._loop.run_forever, name="speak2db-pipeline", daemon=True
+        )
+        self._thread.start()
+        self._jobs = {}  # (session_id, stage) -> Job
+        self._lock = threading.Lock()
+
+    # Start coroutine_factory(job) for this session and stage. A running or
+    # finished job with the same key is reused; a job with a different key
+    # (the user asked something new) is cancelled and replaced.
+    def submit(self, session_id, stage, key, coroutine_factory):
+        with self._lock:
+            self._prune()
+            job = self._jobs.get((session_id, stage))
+            if job is not None and job.key == key and not job.cancelled():
+                return job
+            if job is not None:
+                job.cancel()
+            job = Job(key)
+            job.future = asyncio.run_coroutine_threadsafe(self._run(job, coroutine_factory), self._loop)
+            self._jobs[(session_id, stage)] = job
+            return job
+
+    async def _run(self, job, coroutine_factory):
+        try:
+            return await coroutine_factory(job)
+        finally:
+            job.finished_at = time.time()
+
+    # Cancel every job of a session, e.g. when a new question is submitted
+    def cancel_session(self, session_id):
+        with self._lock:
+            for (owner, stage), job in list(self._jobs.items()):
+                if owner == session_id:
+                    job.cancel()
+                    del self._jobs[(owner, stage)]
+
+    def _prune(self):
+        oldest = time.time() - JOB_TTL
+        for key, job in list(self._jobs.items()):
+            if job.finished_at is not None and job.finished_at < oldest:
+                del self._jobs[key]
+
+
+_pipeline = None
+_pipeline_lock = threading.Lock()
+
+
+# Shared, process-wide pipeline
+def get_pipeline():
+    global _pipeline
+    with _pipeline_lock:
+        if _pipeline is None:
+            _pipeline = BackgroundPipeline()
+        return _pipeline
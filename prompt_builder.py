@@ -0,0 +1,287 @@
+import re
+import threading
+
+from prompt_examples import EXAMPLES
+from schema_catalog import date_format, format_schema, iso_date_sql
+
+PROMPT_TOKEN_BUDGET = 1200  # Schema, rules and examples
+HISTORY_TOKEN_BUDGET = 400  # Conversation history appended to the prompt
+MAX_EXAMPLES = 3
+VALUE_INDEX_LIMIT = 200  # Text columns with more distinct values are not indexed
+
+RULES = """Rules:
+- Use only the tables and columns listed above, with their exact names.
+- Revenue is SUM(Quantity * Unit_Price * (1 - Discount)).
+- Use explicit JOIN ... ON for relationships; tables join on Customer_ID.
+- Compare text values exactly as listed, in single quotes (e.g. Status = 'Failed').
+- {dates}
+- Output only one executable {name} SELECT statement and end it with a semicolon: no markdown, comments or explanations."""
+
+# The SQL dialect of the engine that runs the query (db_engine.QueryEngine.dialect)
+DIALECTS = {
+    "sqlite": {"name": "SQLite", "dates": "Use SQLite date functions (DATE(), strftime()) for dates."},
+    "duckdb": {
+        "name": "DuckDB",
+        "dates": "Date columns are DATE values: use date_trunc(), EXTRACT(), strftime(date, format) "
+                 "and DATE 'YYYY-MM-DD' literals.",
+    },
+}
+
+_STOP_WORDS = {
+    "a", "all", "an", "and", "any", "are", "average", "by", "count", "each", "every",
+    "find", "first", "for", "from", "get", "give", "how", "i", "in", "is", "last", "list", "many",
+    "me", "most", "much", "number", "of", "on", "or", "per", "show", "sum", "table",
+    "than", "that", "the", "their", "this", "to", "top", "total", "what", "which",
+    "who", "with",
+}
+
+# Question words that point at columns whose names do not contain them
+SYNONYMS = {
+    "revenue": ["SalesTable.Quantity", "SalesTable.Unit_Price", "SalesTable.Discount"],
+    "income": ["SalesTable.Quantity", "SalesTable.Unit_Price", "SalesTable.Discount"],
+    "earning": ["SalesTable.Quantity", "SalesTable.Unit_Price", "SalesTable.Discount"],
+    "sold": ["SalesTable.Quantity", "SalesTable.Product_Name"],
+    "sell": ["SalesTable.Quantity", "SalesTable.Product_Name"],
+    "unit": ["SalesTable.Quantity"],
+    "order": ["SalesTable.Sale_ID"],
+    "bought": ["SalesTable.Product_Name"],
+    "buy": ["SalesTable.Product_Name"],
+    "spent": ["TransactionLog.Amount"],
+    "spend": ["TransactionLog.Amount"],
+    "paid": ["TransactionLog.Amount", "TransactionLog.Payment_Mode"],
+    "refund": ["TransactionLog.Transaction_Type"],
+    "failed": ["TransactionLog.Status"],
+    "fail": ["TransactionLog.Status"],
+    "success": ["TransactionLog.Status"],
+    "successful": ["TransactionLog.Status"],
+    "merchant": ["TransactionLog.Merchant_ID"],
+    "client": ["CustomerTable.Customer_ID"],
+    "buyer": ["CustomerTable.Customer_ID"],
+    "name": ["CustomerTable.First_Name", "CustomerTable.Last_Name"],
+    "where": ["CustomerTable.State", "CustomerTable.City"],
+    "contact": ["CustomerTable.Email", "CustomerTable.Phone"],
+    "registered": ["CustomerTable.Registration_Date"],
+    "signed": ["CustomerTable.Registration_Date"],
+}
+
+
+def estimate_tokens(text):
+    return len(text) // 4 + 1
+
+
+def _stem(word):
+    if len(word) > 4 and word.endswith("ies"):
+        return word[:-3] + "y"
+    if len(word) > 3 and word.endswith("s") and not word.endswith("ss"):
+        return word[:-1]
+    return word
+
+
+def tokenize(text):
+    # Split identifiers like Payment_Mode and TransactionLog into words too
+    text = re.sub(r"([a-z])([A-Z])", r"\1 \2", text)
+    return [_stem(word) for word in re.findall(r"[a-z0-9]+", text.lower()) if word not in _STOP_WORDS]
+
+
+_value_indexes = {}  # (db path, catalog version) -> {(table, column): [values]}
+_value_lock = threading.Lock()
+
+
+# Distinct values of every text column with few enough of them, so that
+# question words like "Texas" or "Smartphone" can be tied to their column
+def get_value_index(catalog, conn, key=None):
+    key = key or catalog["version"]
+    with _value_lock:
+        index = _value_indexes.get(key)
+        if index is not None:
+            return index
+    index = {}
+    for table_name, table in catalog["tables"].items():
+        for column in table["columns"]:
+            if column["type"].upper() != "TEXT" or date_format(column):
+                continue
+            values = [
+                value for (value,) in conn.execute(
+                    f'SELECT DISTINCT "{column["name"]}" FROM "{table_name}" '
+                    f'WHERE "{column["name"]}" IS NOT NULL LIMIT {VALUE_INDEX_LIMIT + 1}'
+                )
+            ]
+            if len(values) <= VALUE_INDEX_LIMIT:
+                index[(table_name, column["name"])] = values
+    with _value_lock:
+        _value_indexes.clear()  # Only the current version is worth keeping
+        _value_indexes[key] = index
+    return index
+
+
+# Pick the tables and columns relevant to the question. Returns
+# ({table: [columns]}, [(table, column, value)] matched values), or
+# (None, []) when nothing matched and the whole schema should be used.
+def select_schema(question, catalog, value_index):
+    words = set(tokenize(question))
+    lowered = question.lower()
+    scores = {}
+    matched_columns = {}
+    matched_values = []
+
+    def hit(table_name, column_name, weight):
+        scores[table_name] = scores.get(table_name, 0) + weight
+        if column_name:
+            matched_columns.setdefault(table_name, set()).add(column_name)
+
+    table_words = {table_name: set(tokenize(table_name)) for table_name in catalog["tables"]}
+    named_tables = set()
+    for table_name, table in catalog["tables"].items():
+        if words & table_words[table_name]:
+            hit(table_name, None, 2)
+            named_tables.add(table_name)
+        for column in table["columns"]:
+            column_words = set(tokenize(column["name"]))
+            # "customer" names CustomerTable, not every table with a Customer_ID key
+            if column["name"].endswith("_ID") and any(
+                column_words - {"id"} <= other_words
+                for other, other_words in table_words.items() if other != table_name
+            ):
+                continue
+            if words & column_words:
+                hit(table_name, column["name"], 1)
+    for word in words:
+        for target in SYNONYMS.get(word, []):
+            table_name, column_name = target.split(".")
+            if table_name in catalog["tables"]:
+                hit(table_name, column_name, 1)
+    for (table_name, column_name), values in value_index.items():
+        for value in values:
+            if len(str(value)) > 2 and re.search(rf"\b{re.escape(str(value).lower())}\b", lowered):
+                hit(table_name, column_name, 2)
+                matched_values.append((table_name, column_name, value))
+
+    if not scores:
+        return None, []
+    selection = {}
+    for table_name in scores:
+        columns = []
+        for column in catalog["tables"][table_name]["columns"]:
+            name = column["name"]
+            # Keys, dates and numeric measures are kept for joins, filters and aggregates
+            # A table named in the question keeps all of its columns
+            if (
+                table_name in named_tables
+                or name in matched_columns.get(table_name, ())
+                or name.endswith("_ID")
+                or date_format(column)
+                or column["type"].upper() in ("INTEGER", "REAL")
+            ):
+                columns.append(name)
+        selection[table_name] = columns
+    return selection, matched_values
+
+
+def _example_score(question_words, example):
+    example_words = set(tokenize(example["question"])) | set(tokenize(example["sql"]))
+    if not question_words:
+        return 0.0
+    return len(question_words & example_words) / len(question_words | example_words)
+
+
+# Date columns stored as 'M/D/YYYY' text, with the SQLite expression that
+# turns each into an ISO date. DATE() and strftime() return NULL on the raw
+# text; the rollups and the fast path use the same expression.
+def _text_dates(catalog, selection=None):
+    return {
+        column["name"]: iso_date_sql(column, column["name"])
+        for table_name, table in catalog["tables"].items()
+        if selection is None or table_name in selection
+        for column in table["columns"]
+        if date_format(column) == "M/D/YYYY"
+    }
+
+
+def _dates_rule(catalog, selection, dialect):
+    rule = DIALECTS[dialect]["dates"]
+    conversions = _text_dates(catalog, selection) if dialect == "sqlite" else {}
+    if conversions:
+        rule += (
+            " Dates stored as 'M/D/YYYY' text give NULL in DATE() and strftime(): wherever such a date is "
+            "filtered, compared, grouped or sorted, use its ISO form instead:"
+        )
+        rule += "".join(f"\n  {name} -> {expression}" for name, expression in conversions.items())
+    return rule
+
+
+# Few-shot examples most similar to the question that only use the selected tables
+def select_examples(question, catalog, selection, limit=MAX_EXAMPLES, dialect="sqlite"):
+    # Date examples use SQLite's date functions on ISO text; 'M/D/YYYY' columns
+    # are converted in them
+    conversions = _text_dates(catalog)
+    question_words = set(tokenize(question))
+    candidates = []
+    for example in EXAMPLES:
+        if example.get("uses_dates") and dialect != "sqlite":
+            continue
+        tables = {name for name in catalog["tables"] if re.search(rf"\b{name}\b", example["sql"])}
+        if selection is not None and not tables <= set(selection):
+            continue
+        candidates.append((_example_score(question_words, example), example))
+    candidates.sort(key=lambda item: item[0], reverse=True)
+    examples = []
+    for score, example in candidates[:limit]:
+        if score <= 0:
+            continue
+        if example.get("uses_dates") and conversions:
+            sql = example["sql"]
+            for name, expression in conversions.items():
+                sql = re.sub(rf"\b{name}\b", lambda match: expression, sql)
+            example = {**example, "sql": sql}
+        examples.append(example)
+    return examples
+
+
+def _compose(schema, matched_values, examples, dialect="sqlite", dates=None):
+    prompt = (
+        f"You are an expert {DIALECTS[dialect]['name']} query generator. "
+        "Convert the question to one SQL query for this schema.\n\n"
+    )
+    prompt += schema
+    if matched_values:
+        prompt += "Values mentioned in the question:\n"
+        for table_name, column_name, value in matched_values:
+            prompt += f"  - {table_name}.{column_name} = {value!r}\n"
+        prompt += "\n"
+    prompt += RULES.format(**{**DIALECTS[dialect], "dates": dates or DIALECTS[dialect]["dates"]}) + "\n"
+    if examples:
+        prompt += "\nExamples:\n"
+        for example in examples:
+            prompt += f"\nQuestion: {example['question']}\nSQL:\n{example['sql']};\n"
+    return prompt
+
+
+# Build the SQL generation prompt for a question: only the relevant part of
+# the schema and the closest verified examples, trimmed to the token budget
+def build_prompt(question, catalog, value_index, budget=PROMPT_TOKEN_BUDGET, dialect="sqlite"):
+    selection, matched_values = select_schema(question, catalog, value_index)
+    schema = format_schema(catalog, selection, dialect)
+    examples = select_examples(question, catalog, selection, dialect=dialect)
+    dates = _dates_rule(catalog, selection, dialect)
+    prompt = _compose(schema, matched_values, examples, dialect, dates)
+    while examples and estimate_tokens(prompt) > budget:
+        examples = examples[:-1]
+        prompt = _compose(schema, matched_values, examples, dialect, dates)
+    return prompt
+
+
+# Conversation history for the prompt, newest entries first until the token
+# budget is used up; result previews are dropped before whole entries
+def build_history_context(history, budget=HISTORY_TOKEN_BUDGET, limit=3):
+    blocks = []
+    used = 0
+    for entry in reversed(history[-limit:]):
+        block = f"Previous question: {entry['input']}\nSQL: {entry['sql_query']}\n"
+        with_result = block + f"Result (first rows):\n{entry['preview_text']}\n"
+        if used + estimate_tokens(with_result) <= budget:
+            block = with_result
+        elif used + estimate_tokens(block) > budget:
+            break
+        blocks.append(block)
+        used += estimate_tokens(block)
+    return "\n".join(reversed(blocks))
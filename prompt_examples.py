@@ -0,0 +1,72 @@
+# Verified question -> SQL pairs against the real CustomerTable / SalesTable /
+# TransactionLog schema, used as few-shot examples by the prompt builder.
+# Every query here must run on sales_database.db. Examples marked uses_dates
+# are written for ISO dates; the prompt builder converts 'M/D/YYYY' text
+# dates in them, and leaves them out for engines other than SQLite.
+EXAMPLES = [
+    {
+        "question": "Total revenue by category after discounts",
+        "sql": "SELECT Category, SUM(Quantity * Unit_Price * (1 - Discount)) AS Revenue\n"
+               "FROM SalesTable\nGROUP BY Category\nORDER BY Revenue DESC",
+    },
+    {
+        "question": "Top 5 products by units sold",
+        "sql": "SELECT Product_Name, SUM(Quantity) AS Units_Sold\n"
+               "FROM SalesTable\nGROUP BY Product_Name\nORDER BY Units_Sold DESC\nLIMIT 5",
+    },
+    {
+        "question": "Average discount per product",
+        "sql": "SELECT Product_Name, AVG(Discount) AS Avg_Discount\n"
+               "FROM SalesTable\nGROUP BY Product_Name",
+    },
+    {
+        "question": "Number of failed transactions by payment mode",
+        "sql": "SELECT Payment_Mode, COUNT(*) AS Failed_Transactions\n"
+               "FROM TransactionLog\nWHERE Status = 'Failed'\nGROUP BY Payment_Mode",
+    },
+    {
+        "question": "Total refund amount per channel",
+        "sql": "SELECT Channel, SUM(Amount) AS Refund_Amount\n"
+               "FROM TransactionLog\nWHERE Transaction_Type = 'Refund'\nGROUP BY Channel",
+    },
+    {
+        "question": "How many customers are there in each state",
+        "sql": "SELECT State, COUNT(*) AS Customers\n"
+               "FROM CustomerTable\nGROUP BY State\nORDER BY Customers DESC",
+    },
+    {
+        "question": "Revenue by customer state",
+        "sql": "SELECT CustomerTable.State, SUM(SalesTable.Quantity * SalesTable.Unit_Price * (1 - SalesTable.Discount)) AS Revenue\n"
+               "FROM SalesTable\nJOIN CustomerTable ON SalesTable.Customer_ID = CustomerTable.Customer_ID\n"
+               "GROUP BY CustomerTable.State\nORDER BY Revenue DESC",
+    },
+    {
+        "question": "Customers who bought a Smartphone",
+        "sql": "SELECT DISTINCT CustomerTable.Customer_ID, CustomerTable.First_Name, CustomerTable.Last_Name\n"
+               "FROM SalesTable\nJOIN CustomerTable ON SalesTable.Customer_ID = CustomerTable.Customer_ID\n"
+               "WHERE SalesTable.Product_Name = 'Smartphone'",
+    },
+    {
+        "question": "Top 10 customers by total transaction amount",
+        "sql": "SELECT CustomerTable.Customer_ID, CustomerTable.First_Name, CustomerTable.Last_Name, SUM(TransactionLog.Amount) AS Total_Amount\n"
+               "FROM TransactionLog\nJOIN CustomerTable ON TransactionLog.Customer_ID = CustomerTable.Customer_ID\n"
+               "GROUP BY CustomerTable.Customer_ID\nORDER BY Total_Amount DESC\nLIMIT 10",
+    },
+    {
+        "question": "Share of successful transactions for each payment mode",
+        "sql": "SELECT Payment_Mode, AVG(CASE WHEN Status = 'Success' THEN 1.0 ELSE 0 END) AS Success_Rate\n"
+               "FROM TransactionLog\nGROUP BY Payment_Mode",
+    },
+    {
+        "question": "Number of sales per month",
+        "uses_dates": True,
+        "sql": "SELECT strftime('%Y-%m', Sale_Date) AS Month, COUNT(*) AS Sales\n"
+               "FROM SalesTable\nGROUP BY Month\nORDER BY Month",
+    },
+    {
+        "question": "Transactions in the last 30 days",
+        "uses_dates": True,
+        "sql": "SELECT *\nFROM TransactionLog\n"
+               "WHERE DATE(Transaction_Date) >= DATE('now', '-30 days')",
+    },
+]
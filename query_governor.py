@@ -0,0 +1,175 @@
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from tracing import current_session
+
+# Budgets for every database query, enforced while it runs
+QUERY_TIMEOUT = float(os.getenv("SPEAK2DB_QUERY_TIMEOUT", "30"))  # Wall-clock seconds
+QUERY_MAX_STEPS = int(os.getenv("SPEAK2DB_QUERY_MAX_STEPS", "500000000"))  # SQLite VM instructions (~5 s of CPU)
+MAX_QUERIES = int(os.getenv("SPEAK2DB_MAX_QUERIES", "4"))  # Running at once in the process
+MAX_SESSION_QUERIES = int(os.getenv("SPEAK2DB_MAX_SESSION_QUERIES", "2"))  # Running at once per user session
+QUEUE_TIMEOUT = 10  # Seconds a query waits for a free slot before it is refused
+PROGRESS_STEPS = 10000  # VM instructions between two budget checks
+
+# Why a query was stopped or refused, as shown to the user
+KILL_MESSAGES = {
+    "timeout": "The query was stopped after {timeout:g} seconds.",
+    "steps": "The query was stopped: it needed more than {max_steps:,} steps of work.",
+    "superseded": "The query was cancelled because a new question was asked.",
+    "busy": "Too many queries are running right now; please try again in a moment.",
+    "session_limit": "You already have {max_session_queries} queries running; please wait for them to finish.",
+}
+
+
+class QueryKilledError(Exception):
+    def __init__(self, reason, message):
+        super().__init__(message)
+        self.reason = reason  # A key of KILL_MESSAGES
+
+
+# One admitted query. watch() applies its budgets to the connection it runs
+# on; cancel() stops it from any thread.
+class RunningQuery:
+    def __init__(self, governor, session, timeout, max_steps):
+        self.governor = governor
+        self.session = session
+        self.timeout = timeout
+        self.max_steps = max_steps
+        self.steps = 0
+        self.reason = None
+        self._deadline = None
+        self._conn = None
+        self._lock = threading.Lock()
+
+    # SQLite calls this every PROGRESS_STEPS instructions; non-zero aborts the statement
+    def _progress(self):
+        self.steps += PROGRESS_STEPS
+        if self.reason is None:
+            if self.steps > self.max_steps:
+                self.reason = "steps"
+            elif time.monotonic() > self._deadline:
+                self.reason = "timeout"
+        return 1 if self.reason else 0
+
+    # Enforce the budgets while the with block runs a query on conn. SQLite
+    # connections are checked by the progress handler; other engines (DuckDB)
+    # are interrupted by a timer at the deadline.
+    @contextmanager
+    def watch(self, conn):
+        self._deadline = time.monotonic() + self.timeout
+        timer = None
+        with self._lock:
+            if self.reason:
+                raise self._error()
+            self._conn = conn
+        if hasattr(conn, "set_progress_handler"):
+            conn.set_progress_handler(self._progress, PROGRESS_STEPS)
+        else:
+            timer = threading.Timer(self.timeout, self.cancel, ("timeout",))
+            timer.daemon = True
+            timer.start()
+        try:
+            yield self
+        except Exception as e:
+            if self.reason:
+                raise self._error() from e
+            raise
+        finally:
+            with self._lock:
+                self._conn = None
+            if timer is not None:
+                timer.cancel()
+            else:
+                conn.set_progress_handler(None, 0)
+
+    def cancel(self, reason="superseded"):
+        with self._lock:
+            if self.reason is None:
+                self.reason = reason
+            # Only while the query runs: the connection goes back to the pool after
+            if self._conn is not None:
+                self._conn.interrupt()
+
+    def _error(self):
+        message = KILL_MESSAGES[self.reason].format(
+            timeout=self.timeout, max_steps=self.max_steps, max_session_queries=self.governor.max_session_queries
+        )
+        return QueryKilledError(self.reason, message)
+
+
+# Admission control for database queries: at most max_queries run in the
+# process and max_session_queries per session; others wait up to
+# QUEUE_TIMEOUT for a slot, so one user's runaway queries cannot starve the rest
+class QueryGovernor:
+    def __init__(self, max_queries=MAX_QUERIES, max_session_queries=MAX_SESSION_QUERIES):
+        self.max_queries = max_queries
+        self.max_session_queries = max_session_queries
+        self._running = []
+        self._condition = threading.Condition()
+
+    # Admit a query for the with block and yield its RunningQuery. Kills and
+    # refusals raise QueryKilledError and are recorded on span s as
+    # query.killed, which the tracer counts per reason.
+    @contextmanager
+    def run(self, s=None, timeout=QUERY_TIMEOUT, max_steps=QUERY_MAX_STEPS):
+        query = RunningQuery(self, current_session(), timeout, max_steps)
+        try:
+            self._admit(query)
+            try:
+                yield query
+            finally:
+                with self._condition:
+                    self._running.remove(query)
+                    self._condition.notify_all()
+                if s is not None and query.steps:
+                    s.set("db.steps", query.steps)
+        except QueryKilledError as e:
+            if s is not None:
+                s.set("query.killed", e.reason)
+            raise
+
+    def _admit(self, query):
+        deadline = time.monotonic() + QUEUE_TIMEOUT
+        with self._condition:
+            while True:
+                session_full = (
+                    query.session is not None and self._session_count(query.session) >= self.max_session_queries
+                )
+                if not session_full and len(self._running) < self.max_queries:
+                    self._running.append(query)
+                    return
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    query.reason = "session_limit" if session_full else "busy"
+                    raise query._error()
+                self._condition.wait(remaining)
+
+    def _session_count(self, session):
+        return sum(1 for query in self._running if query.session == session)
+
+    # Cancel the running queries of a session, e.g. when it asks a new question
+    def cancel_session(self, session, reason="superseded"):
+        with self._condition:
+            queries = [query for query in self._running if query.session == session]
+        for query in queries:
+            query.cancel(reason)
+        return len(queries)
+
+    def running(self):
+        with self._condition:
+            return len(self._running)
+
+
+_governor = None
+_governor_lock = threading.Lock()
+
+
+# Shared, process-wide governor
+def get_governor():
+    global _governor
+    with _governor_lock:
+        if _governor is None:
+            _governor = QueryGovernor()
+        return _governor
@@ -0,0 +1,138 @@
+import os
+import re
+import threading
+from collections import OrderedDict
+
+import pandas as pd
+
+from schema_catalog import get_database_version
+from tracing import span
+
+RESULT_CACHE_BYTES = int(os.getenv("SPEAK2DB_RESULT_CACHE_MB", "256")) * 1024 * 1024
+
+# String literals, quoted identifiers and comments, which canonicalization
+# must either keep verbatim or drop
+_SQL_TOKENS = re.compile(
+    r"""('(?:[^']|'')*')|("(?:[^"]|"")*"|`[^`]*`|\[[^\]]*\])|(--[^\n]*|/\*.*?\*/)""",
+    re.S,
+)
+
+
+# Canonical form of a query for use as a cache key: comments removed,
+# whitespace collapsed, trailing semicolons dropped and everything outside
+# literals and quoted identifiers lowercased (SQLite keywords and names are
+# case-insensitive)
+def canonicalize_sql(sql):
+    parts = []
+    text = ""  # Plain SQL text since the last literal, with comments blanked
+    position = 0
+    for match in _SQL_TOKENS.finditer(sql):
+        literal, identifier, comment = match.groups()
+        text += sql[position:match.start()]
+        position = match.end()
+        if comment:
+            text += " "
+            continue
+        parts.append(_canonical_chunk(text))
+        parts.append(literal or identifier)
+        text = ""
+    parts.append(_canonical_chunk(text + sql[position:]))
+    return "".join(parts).strip().rstrip(";").strip()
+
+
+def _canonical_chunk(chunk):
+    chunk = re.sub(r"\s+", " ", chunk.lower())
+    return re.sub(r" ?([(),=<>+*/;-]) ?", r"\1", chunk)
+
+
+# Columnar copy of a DataFrame: one NumPy array per column
+class _CachedResult:
+    def __init__(self, df):
+        self.columns = list(df.columns)
+        self.arrays = [df.iloc[:, i].to_numpy(copy=True) for i in range(df.shape[1])]
+        self.attrs = dict(df.attrs)  # e.g. truncation metadata from query_capped
+        self.nbytes = int(df.memory_usage(index=False, deep=True).sum())
+
+    def to_frame(self):
+        df = pd.DataFrame({i: array for i, array in enumerate(self.arrays)}, copy=False)
+        df.columns = self.columns
+        df.attrs.update(self.attrs)
+        return df
+
+
+class ResultCache:
+    def __init__(self, max_bytes=RESULT_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # (db_path, backend, canonical sql) -> _CachedResult
+        self._versions = {}  # db_path -> database version the entries were computed at
+        self._lock = threading.Lock()
+
+    def _check_version(self, db_path):
+        # Drop every entry for db_path once the database has changed
+        version = get_database_version(db_path)
+        if self._versions.get(db_path) != version:
+            for key in [key for key in self._entries if key[0] == db_path]:
+                self.size -= self._entries.pop(key).nbytes
+            self._versions[db_path] = version
+
+    # backend is the get_engine backend that runs sql: the same text can give
+    # differently typed results on SQLite and DuckDB
+    def get(self, sql, db_path="sales_database.db", backend="sqlite"):
+        key = (db_path, backend, canonicalize_sql(sql))
+        with self._lock:
+            self._check_version(db_path)
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry.to_frame()
+
+    def put(self, sql, df, db_path="sales_database.db", backend="sqlite"):
+        entry = _CachedResult(df)
+        if entry.nbytes > self.max_bytes:
+            return  # Never let one huge result flush the whole cache
+        key = (db_path, backend, canonicalize_sql(sql))
+        with self._lock:
+            self._check_version(db_path)
+            if key in self._entries:
+                self.size -= self._entries.pop(key).nbytes
+            self._entries[key] = entry
+            self.size += entry.nbytes
+            while self.size > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.size -= evicted.nbytes
+
+    # Return the cached result for sql, running execute() to produce and
+    # cache it on a miss
+    def fetch(self, sql, execute, db_path="sales_database.db", backend="sqlite"):
+        with span("result_cache") as s:
+            df = self.get(sql, db_path, backend)
+            s.set("cache.result", "miss" if df is None else "hit")
+        if df is None:
+            df = execute()
+            self.put(sql, df, db_path, backend)
+        return df
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._versions.clear()
+            self.size = 0
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+# Shared, process-wide result cache
+def get_result_cache():
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = ResultCache()
+        return _cache
@@ -0,0 +1,638 @@
+import argparse
+import hashlib
+import json
+import re
+import sqlite3
+import threading
+
+from db_engine import get_engine
+from schema_catalog import get_schema_catalog, get_database_version, iso_date_sql
+from tracing import span
+
+# Pre-aggregated copies of the large fact tables, kept up to date as rows are
+# loaded, and a rewriter that answers matching aggregate queries from them:
+#
+#   python rollups.py                 # create or bring every rollup up to date
+#   python rollups.py --rebuild       # recompute them from scratch
+#
+# Each rollup groups one source table by a date bucket (day or month) and a
+# few low-cardinality columns, and stores COUNT(*) plus SUM and COUNT of each
+# measure, so SUM, COUNT and AVG over any coarser grouping can be recomputed
+# exactly from it.
+
+SOURCES = {
+    "SalesTable": {
+        "date": "Sale_Date",
+        "dimensions": ["Category", "Product_Name", "Product_ID"],
+        "measures": {
+            "Revenue": "Quantity * Unit_Price * (1 - Discount)",
+            "Gross": "Quantity * Unit_Price",
+            "Units": "Quantity",
+            "Discount": "Discount",
+        },
+    },
+    "TransactionLog": {
+        "date": "Transaction_Date",
+        "dimensions": ["Transaction_Type", "Payment_Mode", "Status", "Channel"],
+        "measures": {"Amount": "Amount"},
+    },
+}
+GRAINS = {"month": "Bucket_Month", "day": "Bucket_Day"}  # Coarsest first: the rewriter tries them in this order
+
+ROLLUPS = {
+    f"rollup_{source.lower()}_{grain}": {"source": source, "grain": grain}
+    for source in SOURCES for grain in GRAINS
+}
+STATE_TABLE = "rollup_state"
+
+_fresh = {}  # db_path -> (database version, {source: [(rollup name, state)]})
+_fresh_lock = threading.Lock()
+
+
+def _quote(name):
+    return '"' + name.replace('"', '""') + '"'
+
+
+def _columns(source):
+    spec = SOURCES[source]
+    measures = []
+    for name in spec["measures"]:
+        measures += [f"{name}_Sum", f"{name}_Count"]
+    return spec["dimensions"], measures
+
+
+# ISO day expression for the source's date column, judged from stored values
+def _day_sql(conn, source):
+    column = SOURCES[source]["date"]
+    declared = {row[1]: row[2] for row in conn.execute(f"PRAGMA table_info({_quote(source)})")}
+    samples = [
+        value for (value,) in conn.execute(
+            f"SELECT {_quote(column)} FROM {_quote(source)} WHERE {_quote(column)} IS NOT NULL LIMIT 20"
+        )
+    ]
+    expression = iso_date_sql({"name": column, "type": declared.get(column, ""), "samples": samples})
+    if expression is None and samples and all(isinstance(value, (int, float)) for value in samples):
+        expression = f"DATE({_quote(column)})"  # Julian day numbers
+    if expression is None and not samples:
+        expression = f"DATE({_quote(column)})"  # Empty table: any expression gives the same (empty) rollup
+    if expression is None:
+        raise ValueError(f"Cannot read the dates in {source}.{column}")
+    # Only plain YYYY-MM-DD text can stand for the day without conversion
+    bare_is_day = bool(samples) and all(re.match(r"^\d{4}-\d{2}-\d{2}$", str(value)) for value in samples)
+    return expression, bare_is_day
+
+
+def _definition(name, day_sql):
+    spec = ROLLUPS[name]
+    definition = {"source": SOURCES[spec["source"]], "grain": spec["grain"], "day": day_sql}
+    return hashlib.sha1(json.dumps(definition, sort_keys=True).encode()).hexdigest()[:16]
+
+
+def _ensure_state(conn, source):
+    conn.execute(
+        f"CREATE TABLE IF NOT EXISTS {STATE_TABLE} ("
+        "name TEXT PRIMARY KEY, source TEXT, definition TEXT, day_sql TEXT, bare_is_day INTEGER, "
+        "last_rowid INTEGER, dirty INTEGER)"
+    )
+    # Updates and deletes cannot be applied incrementally: they mark the
+    # source's rollups for a rebuild. Inserts are picked up by rowid.
+    for event in ("UPDATE", "DELETE"):
+        conn.execute(
+            f"CREATE TRIGGER IF NOT EXISTS {_trigger(source, event)} AFTER {event} ON {_quote(source)} "
+            f"BEGIN UPDATE {STATE_TABLE} SET dirty = 1 WHERE source = '{source}' AND dirty = 0; END"
+        )
+
+
+def _trigger(source, event):
+    return f"rollup_dirty_{source.lower()}_{event.lower()}"
+
+
+def _create(conn, name):
+    spec = ROLLUPS[name]
+    dimensions, measures = _columns(spec["source"])
+    keys = [GRAINS[spec["grain"]]] + dimensions
+    conn.execute(f"DROP TABLE IF EXISTS {_quote(name)}")
+    # Measures are untyped so sums of integer columns stay integers
+    columns = [f"{_quote(key)} TEXT" for key in keys] + ['"Row_Count" INTEGER'] + [_quote(m) for m in measures]
+    conn.execute(
+        f"CREATE TABLE {_quote(name)} ({', '.join(columns)}, PRIMARY KEY ({', '.join(_quote(k) for k in keys)}))"
+    )
+
+
+# Fold source rows with rowid > after into the rollup
+def _apply(conn, name, day_sql, after):
+    spec = ROLLUPS[name]
+    source = spec["source"]
+    dimensions, _ = _columns(source)
+    bucket = day_sql if spec["grain"] == "day" else f"substr({day_sql}, 1, 7)"
+    keys = [GRAINS[spec["grain"]]] + dimensions
+    selects = [bucket] + [_quote(d) for d in dimensions] + ["COUNT(*)"]
+    updates = ['"Row_Count" = "Row_Count" + excluded."Row_Count"']
+    targets = [_quote(k) for k in keys] + ['"Row_Count"']
+    for measure, expression in SOURCES[source]["measures"].items():
+        selects += [f"SUM({expression})", f"COUNT({expression})"]
+        total, count = _quote(f"{measure}_Sum"), _quote(f"{measure}_Count")
+        targets += [total, count]
+        # SUM of nothing is NULL, so NULL + x must give x, not NULL
+        updates.append(
+            f"{total} = CASE WHEN {total} IS NULL THEN excluded.{total} WHEN excluded.{total} IS NULL THEN {total} "
+            f"ELSE {total} + excluded.{total} END"
+        )
+        updates.append(f"{count} = {count} + excluded.{count}")
+    group = ", ".join(str(i) for i in range(1, len(keys) + 1))
+    conn.execute(
+        f"INSERT INTO {_quote(name)} ({', '.join(targets)}) "
+        f"SELECT {', '.join(selects)} FROM {_quote(source)} WHERE rowid > ? GROUP BY {group} "
+        f"ON CONFLICT({', '.join(_quote(k) for k in keys)}) DO UPDATE SET {', '.join(updates)}",
+        (after,),
+    )
+
+
+def _refresh(conn, name, rebuild):
+    source = ROLLUPS[name]["source"]
+    triggers = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'trigger'")}
+    # Dropping the source (e.g. a replace load) drops its triggers too
+    reloaded = not all(_trigger(source, event) in triggers for event in ("UPDATE", "DELETE"))
+    _ensure_state(conn, source)
+    day_sql, bare_is_day = _day_sql(conn, source)
+    definition = _definition(name, day_sql)
+    state = conn.execute(
+        f"SELECT definition, last_rowid, dirty FROM {STATE_TABLE} WHERE name = ?", (name,)
+    ).fetchone()
+    exists = conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (name,)).fetchone()
+    high = conn.execute(f"SELECT COALESCE(MAX(rowid), 0) FROM {_quote(source)}").fetchone()[0]
+    if rebuild or reloaded or not exists or state is None or state[0] != definition or state[2] or high < state[1]:
+        _create(conn, name)
+        after, mode = 0, "rebuilt"
+    elif high > state[1]:
+        after, mode = state[1], "incremental"
+    else:
+        return "current"
+    _apply(conn, name, day_sql, after)
+    conn.execute(
+        f"INSERT OR REPLACE INTO {STATE_TABLE} (name, source, definition, day_sql, bare_is_day, last_rowid, dirty) "
+        "VALUES (?, ?, ?, ?, ?, ?, 0)",
+        (name, source, definition, day_sql, int(bare_is_day), high),
+    )
+    return mode
+
+
+# Bring the rollups of source (or of every source) up to date on a writable
+# connection: rows inserted since the last refresh are folded in, anything
+# else (updates, deletes, a reloaded table, a changed definition) rebuilds.
+# Runs inside the caller's transaction if there is one, so a loader can call
+# it per chunk and commit data and rollups together. Returns {rollup: mode}.
+def refresh_rollups(conn, source=None, rebuild=False):
+    names = [name for name, spec in ROLLUPS.items() if source is None or spec["source"] == source]
+    own = not conn.in_transaction
+    if own:
+        conn.execute("BEGIN")
+    try:
+        with span("rollup_refresh") as s:
+            modes = {name: _refresh(conn, name, rebuild) for name in names}
+            s.set("rollup.modes", ",".join(sorted(set(modes.values()))))
+        if own:
+            conn.execute("COMMIT")
+    except Exception:
+        if own:
+            conn.execute("ROLLBACK")
+        raise
+    return modes
+
+
+# Rollups that reflect every row of their source right now, by source. The
+# check is a few index lookups and is cached per database version.
+def fresh_rollups(db_path="sales_database.db"):
+    version = get_database_version(db_path)
+    with _fresh_lock:
+        cached = _fresh.get(db_path)
+        if cached is not None and cached[0] == version:
+            return cached[1]
+    fresh = {}
+    with get_engine(db_path).connection() as conn:
+        triggers = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'trigger'")}
+        has_state = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (STATE_TABLE,)
+        ).fetchone()
+        states = {}
+        if has_state:
+            states = {
+                row[0]: {"definition": row[1], "day_sql": row[2], "bare_is_day": bool(row[3]),
+                         "last_rowid": row[4], "dirty": row[5]}
+                for row in conn.execute(
+                    f"SELECT name, definition, day_sql, bare_is_day, last_rowid, dirty FROM {STATE_TABLE}"
+                )
+            }
+        for name, spec in ROLLUPS.items():
+            source = spec["source"]
+            state = states.get(name)
+            if state is None or state["dirty"] or state["definition"] != _definition(name, state["day_sql"]):
+                continue
+            if not all(_trigger(source, event) in triggers for event in ("UPDATE", "DELETE")):
+                continue  # The source was dropped and reloaded since the refresh
+            high = conn.execute(f"SELECT COALESCE(MAX(rowid), 0) FROM {_quote(source)}").fetchone()[0]
+            if high == state["last_rowid"]:
+                fresh.setdefault(source, []).append((name, state))
+    with _fresh_lock:
+        _fresh[db_path] = (version, fresh)
+    return fresh
+
+
+# --- Query rewriting --------------------------------------------------------
+
+_TOKEN = re.compile(
+    r"""(\s+|--[^\n]*|/\*.*?\*/)|('(?:[^']|'')*')|("(?:[^"]|"")*"|`[^`]*`|\[[^\]]*\])"""
+    r"""|(\d+(?:\.\d*)?(?:e[+-]?\d+)?|\.\d+)|([A-Za-z_][\w$]*)|(\?\d*|[:@$]\w+)"""
+    r"""|(<=|>=|<>|!=|==|\|\||[(),.;*/+\-<>=%])""",
+    re.S | re.I,
+)
+_KEYWORDS = {
+    "select", "distinct", "all", "from", "where", "and", "or", "not", "in", "between", "is", "null", "like",
+    "glob", "group", "by", "having", "order", "asc", "desc", "nulls", "first", "last", "limit", "offset",
+    "as", "case", "when", "then", "else", "end", "cast", "integer", "real", "text", "numeric", "collate",
+    "nocase", "escape", "true", "false",
+}
+# Statements that combine rows in ways a rollup cannot reproduce
+_UNSUPPORTED = {"join", "union", "intersect", "except", "with", "over", "window", "filter", "values", "natural"}
+_SCALAR_FUNCTIONS = {
+    "round", "coalesce", "ifnull", "nullif", "lower", "upper", "substr", "substring", "strftime", "date",
+    "printf", "format", "instr", "length", "trim", "ltrim", "rtrim", "abs", "replace", "iif",
+}
+_AGGREGATES = {"sum", "total", "avg", "count", "min", "max", "group_concat", "string_agg"}
+_CLAUSES = {"where": "where", "group": "group", "having": "having", "order": "order", "limit": "limit"}
+
+
+# (kind, text) tokens of sql, or None if it holds anything unexpected.
+# Identifiers come back unquoted. spans, if given, receives each token's
+# (start, end) in sql.
+def _tokenize(sql, spans=None):
+    tokens = []
+    position = 0
+    for match in _TOKEN.finditer(sql):
+        if match.start() != position:
+            return None
+        position = match.end()
+        space, string, quoted, number, word, parameter, operator = match.groups()
+        if space:
+            continue
+        if spans is not None:
+            spans.append(match.span())
+        if string:
+            tokens.append(("str", string))
+        elif quoted:
+            tokens.append(("ident", quoted[1:-1].replace('""', '"') if quoted[0] == '"' else quoted[1:-1]))
+        elif number:
+            tokens.append(("num", number))
+        elif word:
+            tokens.append(("ident", word))
+        elif parameter:
+            tokens.append(("param", parameter))
+        else:
+            tokens.append(("op", operator))
+    return tokens if position == len(sql) else None
+
+
+def _canonical(token):
+    kind, text = token
+    return text.lower() if kind == "ident" else text
+
+
+def _closing(tokens, start):
+    depth = 0
+    for i in range(start, len(tokens)):
+        if tokens[i] == ("op", "("):
+            depth += 1
+        elif tokens[i] == ("op", ")"):
+            depth -= 1
+            if depth == 0:
+                return i
+    return None
+
+
+def _strip_parens(tokens):
+    while tokens and tokens[0] == ("op", "(") and _closing(tokens, 0) == len(tokens) - 1:
+        tokens = tokens[1:-1]
+    return tokens
+
+
+# Operators that bind looser than *, so an expression holding one at its top
+# level is not a plain product: Quantity * Unit_Price * 1 - Discount
+_OPERATOR_WORDS = {"and", "or", "not", "is", "in", "like", "glob", "regexp", "match", "between", "collate", "escape"}
+
+
+# Order-independent key of a product of factors, so Unit_Price * Quantity
+# and (Quantity * Unit_Price) match the same measure
+def _measure_key(tokens):
+    tokens = _strip_parens(tokens)
+    parts, depth, current = [], 0, []
+    product = True
+    for token in tokens:
+        if token == ("op", "("):
+            depth += 1
+        elif token == ("op", ")"):
+            depth -= 1
+        elif depth == 0 and (token[0] == "op" and token[1] not in ("*", ".") or _canonical(token) in _OPERATOR_WORDS):
+            product = False
+        if token == ("op", "*") and depth == 0:
+            parts.append(current)
+            current = []
+        else:
+            current.append(token)
+    parts.append(current)
+    if len(parts) == 1 or not product:
+        return (" ".join(_canonical(token) for token in tokens),)
+    return tuple(sorted(factor for part in parts for factor in _measure_key(part)))
+
+
+def _date_patterns(source, state):
+    column = SOURCES[source]["date"]
+    days = [_tokenize(state["day_sql"])]
+    if state["bare_is_day"]:
+        days += [[("ident", column)], _tokenize(f"DATE({column})")]
+    patterns = []
+    for day in days:
+        patterns.append((day, "day"))
+        for length, grain in (("7", "month"), ("4", "year")):
+            patterns.append(([("ident", "substr"), ("op", "(")] + day + [("op", ","), ("num", "1"), ("op", ","), ("num", length), ("op", ")")], grain))
+        for fmt, grain in (("'%Y-%m'", "month"), ("'%Y'", "year")):
+            patterns.append(([("ident", "strftime"), ("op", "("), ("str", fmt), ("op", ",")] + day + [("op", ")")], grain))
+    patterns.sort(key=lambda pattern: -len(pattern[0]))
+    return [([_canonical(token) for token in tokens], grain) for tokens, grain in patterns]
+
+
+# What grouping by each bucket determines: a day fixes its month and year
+_DETERMINES = {"day": {"day", "month", "year"}, "month": {"month", "year"}, "year": {"year"}}
+
+
+def _bucket_sql(grain, rollup_grain):
+    column = _quote(GRAINS[rollup_grain])
+    if grain == rollup_grain:
+        return column
+    if grain == "day" or (grain == "month" and rollup_grain != "day"):
+        return None
+    return f"substr({column}, 1, {7 if grain == 'month' else 4})"
+
+
+def _aggregate_sql(function, inner, source):
+    measures = {_measure_key(_tokenize(expression)): name for name, expression in SOURCES[source]["measures"].items()}
+    if function == "count" and [_canonical(t) for t in inner] in (["*"], ["1"]):
+        return 'COALESCE(SUM("Row_Count"), 0)'
+    if inner and _canonical(inner[0]) in ("distinct", "all"):
+        return None
+    measure = measures.get(_measure_key(inner))
+    if measure is None:
+        return None
+    total, count = _quote(f"{measure}_Sum"), _quote(f"{measure}_Count")
+    return {
+        "sum": f"SUM({total})",
+        "total": f"TOTAL({total})",
+        "avg": f"(SUM({total}) * 1.0 / SUM({count}))",
+        "count": f"COALESCE(SUM({count}), 0)",
+    }.get(function)
+
+
+# The query rewritten onto rollup `name`, or None unless it gives the same
+# result: every column it reads outside an aggregate must be a rollup
+# dimension or date bucket, every aggregate must be a stored SUM/COUNT/AVG,
+# and every selected or ordered non-aggregate must be fixed by the GROUP BY.
+# reserved holds names an alias must not shadow (source and rollup columns),
+# since SQLite resolves such names differently per clause. names gives the
+# select items that need an explicit alias to keep their column name.
+def _translate(tokens, source, name, state, reserved, names):
+    grain = ROLLUPS[name]["grain"]
+    dimensions = {d.lower(): d for d in SOURCES[source]["dimensions"]}
+    patterns = _date_patterns(source, state)
+    aliases = {_canonical(tokens[i + 1]) for i in _alias_positions(tokens)}
+    if aliases & reserved:
+        return None
+    out = []
+    clause = "select"
+    items = [{"keys": set(), "aggregate": False, "alias": None, "units": 0}]  # Select list items
+    group_items = [{"keys": set(), "units": 0}]  # units: columns, buckets, operators, ... in the item
+    clause_keys = {}  # clause -> dimensions and buckets referenced outside aggregates
+    has_aggregate = distinct = grouped = False
+    depth = 0
+    i = 0
+    while i < len(tokens):
+        token = tokens[i]
+        word = _canonical(token)
+        key = None
+        if clause == "select" and depth == 0 and (token == ("op", ",") or (token[0] == "ident" and word == "from")):
+            if len(items) <= len(names) and names[len(items) - 1]:
+                out.append(f"AS {_quote(names[len(items) - 1])}")
+        if token[0] == "ident" and word == "from":
+            out.append(f"FROM {_quote(name)}")
+            clause = "from"
+            i += 1
+            continue
+        if token[0] == "ident" and word in _CLAUSES:
+            clause = _CLAUSES[word]
+            grouped = grouped or clause == "group"
+        if token[0] == "ident" and word in _AGGREGATES and i + 1 < len(tokens) and tokens[i + 1] == ("op", "("):
+            end = _closing(tokens, i + 1)
+            replacement = end is not None and _aggregate_sql(word, tokens[i + 2:end], source)
+            if not replacement:
+                return None
+            out.append(replacement)
+            has_aggregate = True
+            if clause == "select":
+                items[-1]["aggregate"] = True
+            i = end + 1
+            continue
+        matched = next(
+            (pattern for pattern in patterns if [_canonical(t) for t in tokens[i:i + len(pattern[0])]] == pattern[0]),
+            None,
+        )
+        if matched:
+            replacement = _bucket_sql(matched[1], grain)
+            if replacement is None:
+                return None
+            out.append(replacement)
+            key = matched[1]
+            i += len(matched[0])
+        elif token[0] == "ident":
+            i += 1
+            if word in dimensions:
+                out.append(_quote(dimensions[word]))
+                key = dimensions[word]
+            elif out and out[-1] == "AS" and depth > 0:
+                out.append(token[1])  # Type name of a CAST
+            elif out and out[-1] == "AS":
+                out.append(_quote(token[1]))
+                if clause == "select":
+                    items[-1]["alias"] = word
+                    continue
+            elif word in _UNSUPPORTED or (word == "select" and out):
+                return None
+            elif word in _KEYWORDS:
+                out.append(word.upper())
+                distinct = distinct or (word == "distinct" and out == ["SELECT", "DISTINCT"])
+            elif i < len(tokens) and tokens[i] == ("op", "(") and word in _SCALAR_FUNCTIONS:
+                out.append(word)
+            elif word in aliases:
+                out.append(_quote(token[1]))
+                key = ("alias", word)
+            else:
+                return None  # A column the rollup does not have
+        else:
+            out.append(token[1])
+            i += 1
+            if token == ("op", "("):
+                depth += 1
+            elif token == ("op", ")"):
+                depth -= 1
+            elif clause == "select" and depth == 0 and token == ("op", "*"):
+                return None  # SELECT *: the rollup's columns are not the source's
+            elif token == ("op", ",") and clause == "select" and depth == 0:
+                items.append({"keys": set(), "aggregate": False, "alias": None, "units": 0})
+            elif token == ("op", ",") and clause == "group" and depth == 0:
+                group_items.append({"keys": set(), "units": 0})
+        if token != ("op", ",") and word not in ("select", "distinct", "all", "as", "group", "by"):
+            if clause == "select":
+                items[-1]["units"] += 1
+            elif clause == "group":
+                group_items[-1]["units"] += 1
+        if key is None:
+            continue
+        if clause == "select" and not isinstance(key, tuple):
+            items[-1]["keys"].add(key)
+        elif clause == "group":
+            group_items[-1]["keys"].add(key)
+        else:
+            clause_keys.setdefault(clause, set()).add(key)
+    alias_keys = {item["alias"]: item["keys"] for item in items if item["alias"] and item["units"] == 1}
+    # A GROUP BY item fixes a key only when it is a lone column, bucket or alias
+    # of one. lower(Category) or Category COLLATE NOCASE would merge groups
+    # the rollup keeps apart.
+    fixed = set()
+    for group_item in group_items:
+        if len(group_item["keys"]) != 1 or group_item["units"] != 1:
+            continue
+        (key,) = group_item["keys"]
+        if isinstance(key, tuple):
+            resolved = alias_keys.get(key[1], set())
+            key = next(iter(resolved)) if len(resolved) == 1 else None
+        if key is not None:
+            fixed |= _DETERMINES.get(key, {key})
+    if not has_aggregate and not grouped and not distinct:
+        return None  # Plain row listing: one row per source row, not per group
+    if has_aggregate or grouped:
+        if any(not item["aggregate"] and not item["keys"] <= fixed for item in items):
+            return None
+        for clause in ("having", "order"):
+            keys = {key for key in clause_keys.get(clause, ()) if not isinstance(key, tuple)}
+            if not keys <= fixed:
+                return None
+    return " ".join(out)
+
+
+# Positions of the AS keywords that name a result column or table, i.e. those
+# outside parentheses; CAST(x AS INTEGER) names a type instead
+def _alias_positions(tokens):
+    positions = []
+    depth = 0
+    for i, token in enumerate(tokens[:-1]):
+        if token == ("op", "("):
+            depth += 1
+        elif token == ("op", ")"):
+            depth -= 1
+        elif depth == 0 and token[0] == "ident" and _canonical(token) == "as":
+            positions.append(i)
+    return positions
+
+
+# Column names SQLite gives the select items of sql that have none of their
+# own: an expression is named after its text. None for aliased items and
+# plain columns, which keep their names when rewritten.
+def _result_names(tokens, spans, sql):
+    names = []
+    start = 1
+    depth = 0
+    for i in range(1, len(tokens) + 1):
+        token = tokens[i] if i < len(tokens) else ("ident", "from")
+        if token == ("op", "("):
+            depth += 1
+        elif token == ("op", ")"):
+            depth -= 1
+        elif depth == 0 and (token == ("op", ",") or _canonical(token) == "from"):
+            item = tokens[start:i]
+            if item and _canonical(item[0]) in ("distinct", "all") and not names:
+                item, start = item[1:], start + 1
+            kinds = [t[0] for t in item]
+            plain = kinds == ["ident"] or (kinds == ["ident", "op", "ident"] and item[1] == ("op", "."))
+            aliased = bool(_alias_positions(item))
+            names.append(None if not item or aliased or plain else sql[spans[start][0]:spans[i - 1][1]])
+            start = i + 1
+            if _canonical(token) == "from":
+                break
+    return names
+
+
+# Rewrite query onto the smallest up-to-date rollup that gives the same
+# result. Returns (query, params) unchanged when no rollup applies.
+def rewrite_query(query, params=None, db_path="sales_database.db"):
+    with span("rollup_rewrite") as s:
+        s.set("rollup.name", "none")
+        text = query.strip().rstrip(";").strip()
+        spans = []
+        tokens = _tokenize(text, spans)
+        if not tokens or _canonical(tokens[0]) != "select":
+            return query, params
+        words = [_canonical(t) for t in tokens if t[0] == "ident"]
+        if words.count("from") != 1 or words.count("select") != 1:
+            return query, params
+        start = next(i for i, t in enumerate(tokens) if _canonical(t) == "from" and t[0] == "ident")
+        if start + 1 >= len(tokens) or tokens[start + 1][0] != "ident":
+            return query, params
+        source = next((name for name in SOURCES if name.lower() == _canonical(tokens[start + 1])), None)
+        candidates = fresh_rollups(db_path).get(source) if source else None
+        if not candidates:
+            return query, params
+        # Drop "FROM source [AS] [alias]" and every "source." / "alias." qualifier
+        end = start + 2
+        qualifiers = {source.lower()}
+        if end < len(tokens) and _canonical(tokens[end]) == "as":
+            end += 1
+        if end < len(tokens) and tokens[end][0] == "ident" and _canonical(tokens[end]) not in _KEYWORDS | {"join"}:
+            qualifiers.add(_canonical(tokens[end]))
+            end += 1
+        if end < len(tokens) and tokens[end] == ("op", ","):
+            return query, params  # Implicit join
+        body = tokens[:start + 1] + tokens[end:]
+        unqualified = []
+        i = 0
+        while i < len(body):
+            if body[i][0] == "ident" and _canonical(body[i]) in qualifiers and i + 1 < len(body) and body[i + 1] == ("op", "."):
+                i += 2
+                continue
+            unqualified.append(body[i])
+            i += 1
+        names = _result_names(tokens, spans, text)
+        reserved = {column["name"].lower() for column in get_schema_catalog(db_path)["tables"][source]["columns"]}
+        order = sorted(candidates, key=lambda candidate: list(GRAINS).index(ROLLUPS[candidate[0]]["grain"]))
+        for name, state in order:
+            dimensions, measures = _columns(source)
+            columns = {c.lower() for c in [GRAINS[ROLLUPS[name]["grain"]], "Row_Count"] + dimensions + measures}
+            rewritten = _translate(unqualified, source, name, state, reserved | columns, names)
+            if rewritten is not None:
+                s.set("rollup.name", name)
+                return rewritten, params
+        return query, params
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Create or refresh the rollup tables")
+    parser.add_argument("--db", default="sales_database.db")
+    parser.add_argument("--rebuild", action="store_true", help="recompute every rollup from scratch")
+    args = parser.parse_args()
+    conn = sqlite3.connect(args.db)
+    try:
+        for name, mode in refresh_rollups(conn, rebuild=args.rebuild).items():
+            rows = conn.execute(f"SELECT COUNT(*) FROM {_quote(name)}").fetchone()[0]
+            print(f"{name}: {mode}, {rows} rows")
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
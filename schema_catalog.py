@@ -0,0 +1,165 @@
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+
+# How many distinct values to sample per column. A column with fewer distinct
+# values than this is treated as categorical and all of its values are kept.
+SAMPLE_LIMIT = 6
+
+_catalogs = {}  # db_path -> cached catalog
+_watchers = {}  # db_path -> (inode, connection) used to read the version pragmas
+_lock = threading.Lock()
+
+
+def _watcher(db_path):
+    # Keep one long-lived connection per database file. PRAGMA data_version only
+    # changes between two reads on the *same* connection, so it cannot be a
+    # fresh connection each time. Access is serialized by _lock.
+    inode = os.stat(db_path).st_ino
+    cached = _watchers.get(db_path)
+    if cached and cached[0] == inode:
+        return cached
+    if cached:
+        # The file was replaced on disk, the old connection points at the old file
+        cached[1].close()
+    conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True, check_same_thread=False)
+    _watchers[db_path] = (inode, conn)
+    return _watchers[db_path]
+
+
+def _read_version(conn):
+    schema_version = conn.execute("PRAGMA schema_version").fetchone()[0]
+    data_version = conn.execute("PRAGMA data_version").fetchone()[0]
+    return (schema_version, data_version)
+
+
+def _introspect(conn):
+    tables = {}
+    # Rollup tables (rollups.py) only serve rewritten queries; the model and
+    # the fast path never see them
+    rows = conn.execute(
+        "SELECT name FROM sqlite_master WHERE type='table' AND name NOT LIKE 'sqlite_%' "
+        "AND name NOT LIKE 'rollup\\_%' ESCAPE '\\' ORDER BY rowid"
+    ).fetchall()
+    for (table_name,) in rows:
+        row_count = conn.execute(f'SELECT COUNT(*) FROM "{table_name}"').fetchone()[0]
+        columns = []
+        for column in conn.execute(f'PRAGMA table_info("{table_name}")').fetchall():
+            column_name = column[1]
+            samples = [
+                value for (value,) in conn.execute(
+                    f'SELECT DISTINCT "{column_name}" FROM "{table_name}" '
+                    f'WHERE "{column_name}" IS NOT NULL LIMIT {SAMPLE_LIMIT + 1}'
+                )
+            ]
+            columns.append({
+                "name": column_name,
+                "type": column[2],
+                "primary_key": bool(column[5]),
+                "samples": samples[:SAMPLE_LIMIT],
+                # True when the samples are every distinct value of the column
+                "categorical": len(samples) <= SAMPLE_LIMIT,
+            })
+        tables[table_name] = {"row_count": row_count, "columns": columns}
+    return tables
+
+
+# Stable hash of the table/column structure; unlike the version pragmas it
+# survives restarts, so persistent caches can key on it
+def _fingerprint(tables):
+    structure = ";".join(
+        table_name + ":" + ",".join(f"{c['name']} {c['type']}" for c in table["columns"])
+        for table_name, table in tables.items()
+    )
+    return hashlib.sha1(structure.encode("utf-8")).hexdigest()[:16]
+
+
+# Return the cached catalog for db_path, re-introspecting only when the
+# database schema or data has changed since the last call
+def get_schema_catalog(db_path="sales_database.db"):
+    with _lock:
+        inode, conn = _watcher(db_path)
+        version = (inode,) + _read_version(conn)
+        catalog = _catalogs.get(db_path)
+        if catalog is None or catalog["version"] != version:
+            tables = _introspect(conn)
+            catalog = {
+                "version": version,
+                "fingerprint": _fingerprint(tables),
+                "tables": tables,
+            }
+            _catalogs[db_path] = catalog
+        return catalog
+
+
+# Cheap change token for db_path. It differs whenever the file is replaced or
+# modified, its schema changes, or another connection commits data.
+def get_database_version(db_path="sales_database.db"):
+    with _lock:
+        inode, conn = _watcher(db_path)
+        return (inode,) + _read_version(conn) + (os.stat(db_path).st_mtime_ns,)
+
+
+# Drop the cached catalog(s) so the next call re-introspects
+def invalidate(db_path=None):
+    with _lock:
+        if db_path is None:
+            _catalogs.clear()
+        else:
+            _catalogs.pop(db_path, None)
+
+
+# Text layout of the dates in a column, judged from its samples: "iso",
+# "M/D/YYYY" or None for columns that do not hold dates
+def date_format(column):
+    if not (column["type"].upper() in ("DATE", "DATETIME") or column["name"].lower().endswith("date")):
+        return None
+    samples = [str(value) for value in column["samples"]]
+    if samples and all(re.match(r"^\d{4}-\d{2}-\d{2}", value) for value in samples):
+        return "iso"
+    if samples and all(re.match(r"^\d{1,2}/\d{1,2}/\d{4}$", value) for value in samples):
+        return "M/D/YYYY"
+    return None
+
+
+# SQL expression giving a date column (referenced as name) as ISO YYYY-MM-DD
+# text, so it sorts and compares correctly; None for unknown formats
+def iso_date_sql(column, name=None):
+    name = name or f'"{column["name"]}"'
+    fmt = date_format(column)
+    if fmt == "iso":
+        return f"DATE({name})"
+    if fmt == "M/D/YYYY":
+        return (
+            f"printf('%s-%02d-%02d', substr({name}, -4), CAST({name} AS INTEGER), "
+            f"CAST(substr({name}, instr({name}, '/') + 1) AS INTEGER))"
+        )
+    return None
+
+
+# Render the catalog in the text format used by the SQL generation prompt.
+# tables limits the output to some tables, or (as a dict) to some columns of
+# each table. Engines other than SQLite see dates as DATE columns.
+def format_schema(catalog, tables=None, dialect="sqlite"):
+    schema = "Database Schema (EXACT STRUCTURE):\n"
+    for table_name, table in catalog["tables"].items():
+        if tables is not None and table_name not in tables:
+            continue
+        keep = tables.get(table_name) if isinstance(tables, dict) else None
+        schema += f"{table_name} ({table['row_count']} rows):\n"
+        for column in table["columns"]:
+            if keep is not None and column["name"] not in keep:
+                continue
+            dates = date_format(column)
+            column_type = "DATE" if dates and dialect != "sqlite" else column["type"]
+            schema += f"  - {column['name']} ({column_type})"
+            if column["categorical"] and column["samples"]:
+                values = ", ".join(repr(value) for value in column["samples"])
+                schema += f" values: {values}"
+            if dates == "M/D/YYYY" and dialect == "sqlite":
+                schema += " stored as 'M/D/YYYY' text"
+            schema += "\n"
+        schema += "\n"
+    return schema
@@ -0,0 +1,213 @@
+import contextvars
+import hashlib
+import os
+import re
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from tracing import span
+
+# Which engine speaks: "gtts" (Google Translate's TTS service) or "pyttsx3"
+# (offline, uses the platform's voices through espeak/SAPI/NSSS)
+TTS_BACKEND = os.getenv("SPEAK2DB_TTS_BACKEND", "gtts")
+TTS_LANG = os.getenv("SPEAK2DB_TTS_LANG", "en")
+TTS_WORKERS = int(os.getenv("SPEAK2DB_TTS_WORKERS", "4"))  # Chunks synthesized in parallel
+TTS_CHUNK_CHARS = 400  # Sentences are grouped into chunks of about this size
+AUDIO_DIR = os.path.join(os.getenv("SPEAK2DB_CACHE_DIR", ".speak2db_cache"), "audio")
+AUDIO_CACHE_BYTES = int(os.getenv("SPEAK2DB_AUDIO_CACHE_MB", "100")) * 1024 * 1024
+
+
+class GTTSBackend:
+    name = "gtts"
+    mime = "audio/mp3"
+    extension = "mp3"
+    parallel = True
+
+    def __init__(self, lang=TTS_LANG):
+        self.lang = lang
+        self.voice = lang
+
+    def synthesize(self, text):
+        from gtts import gTTS
+
+        fp = BytesIO()
+        gTTS(text, lang=self.lang).write_to_fp(fp)
+        return fp.getvalue()
+
+
+class Pyttsx3Backend:
+    name = "pyttsx3"
+    mime = "audio/wav"
+    extension = "wav"
+    parallel = False  # The engine is not thread-safe
+
+    def __init__(self):
+        import pyttsx3
+
+        self._engine = pyttsx3.init()
+        self._lock = threading.Lock()
+        self.voice = str(self._engine.getProperty("voice"))
+
+    def synthesize(self, text):
+        with self._lock, tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "speech.wav")
+            self._engine.save_to_file(text, path)
+            self._engine.runAndWait()
+            with open(path, "rb") as f:
+                return f.read()
+
+
+_backend_factories = {"gtts": GTTSBackend, "pyttsx3": Pyttsx3Backend}
+_backends = {}
+_backend_lock = threading.Lock()
+
+
+# Register factory() -> backend under name. A backend has name, mime,
+# extension, voice (part of the cache key), parallel and synthesize(text).
+def register_tts_backend(name, factory):
+    with _backend_lock:
+        _backend_factories[name] = factory
+        _backends.pop(name, None)
+
+
+def get_tts_backend(name=None):
+    name = name or TTS_BACKEND
+    with _backend_lock:
+        backend = _backends.get(name)
+        if backend is None:
+            if name not in _backend_factories:
+                raise ValueError(f"Unknown TTS backend {name!r}; choose from {', '.join(sorted(_backend_factories))}")
+            backend = _backends[name] = _backend_factories[name]()
+        return backend
+
+
+# Synthesized audio on disk, addressed by a hash of backend, voice and text,
+# so the intro message and repeated summaries are synthesized once. Least
+# recently used files are deleted once the directory exceeds max_bytes.
+class AudioCache:
+    def __init__(self, directory=AUDIO_DIR, max_bytes=AUDIO_CACHE_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self.size = sum(entry.stat().st_size for entry in os.scandir(directory) if entry.is_file())
+
+    def _path(self, backend, text):
+        key = hashlib.sha256(f"{backend.name}\0{backend.voice}\0{text}".encode()).hexdigest()
+        return os.path.join(self.directory, f"{key}.{backend.extension}")
+
+    def get(self, backend, text):
+        path = self._path(backend, text)
+        try:
+            with open(path, "rb") as f:
+                audio = f.read()
+        except FileNotFoundError:
+            return None
+        os.utime(path)  # Recently used files are evicted last
+        return audio
+
+    def put(self, backend, text, audio):
+        path = self._path(backend, text)
+        temporary = f"{path}.{threading.get_ident()}.tmp"
+        with open(temporary, "wb") as f:
+            f.write(audio)
+        with self._lock:
+            previous = os.path.getsize(path) if os.path.exists(path) else 0
+            os.replace(temporary, path)  # Atomic, so readers never see a partial file
+            self.size += len(audio) - previous
+            if self.size > self.max_bytes:
+                self._evict()
+
+    def _evict(self):
+        entries = sorted(
+            (entry for entry in os.scandir(self.directory) if entry.is_file() and not entry.name.endswith(".tmp")),
+            key=lambda entry: entry.stat().st_mtime,
+        )
+        for entry in entries:
+            if self.size <= self.max_bytes * 0.9:  # Leave headroom so every put does not evict
+                break
+            size = entry.stat().st_size
+            try:
+                os.remove(entry.path)
+            except FileNotFoundError:
+                continue
+            self.size -= size
+
+
+_audio_cache = None
+_audio_cache_lock = threading.Lock()
+
+
+# Shared, process-wide audio cache
+def get_audio_cache():
+    global _audio_cache
+    with _audio_cache_lock:
+        if _audio_cache is None:
+            _audio_cache = AudioCache()
+        return _audio_cache
+
+
+# Split text at sentence ends into chunks of about max_chars, so the first
+# chunk can play while the rest are synthesized
+def split_sentences(text, max_chars=TTS_CHUNK_CHARS):
+    sentences = [s.strip() for s in re.split(r"(?<=[.!?])\s+|\n+", text) if s.strip()]
+    chunks = []
+    for sentence in sentences:
+        if chunks and len(chunks[-1]) + 1 + len(sentence) <= max_chars:
+            chunks[-1] += " " + sentence
+        else:
+            chunks.append(sentence)
+    return chunks
+
+
+# Audio for one chunk of text, from the cache or the backend; None when
+# cancel was set before it started
+def _synthesize_chunk(backend, text, cancel=None):
+    if cancel is not None and cancel.is_set():
+        return None
+    cache = get_audio_cache()
+    with span("tts", **{"tts.backend": backend.name, "tts.chars": len(text)}) as s:
+        audio = cache.get(backend, text)
+        s.set("cache.result", "miss" if audio is None else "hit")
+        if audio is None:
+            audio = backend.synthesize(text)
+            cache.put(backend, text, audio)
+        s.set("audio.bytes", len(audio))
+        return audio
+
+
+# Yield (audio bytes, mime type) per chunk of text, in order, as soon as
+# each is ready; chunks are synthesized in parallel when the backend allows.
+# Once cancel (a threading.Event) is set no further chunk is started or
+# yielded; chunks already being synthesized finish.
+def synthesize_chunks(text, backend=None, cancel=None):
+    backend = backend or get_tts_backend()
+    chunks = split_sentences(text)
+    if len(chunks) <= 1 or not backend.parallel:
+        for chunk in chunks:
+            if cancel is not None and cancel.is_set():
+                return
+            yield _synthesize_chunk(backend, chunk), backend.mime
+        return
+    with ThreadPoolExecutor(max_workers=min(TTS_WORKERS, len(chunks)), thread_name_prefix="speak2db-tts") as pool:
+        # Each chunk runs in a copy of this context, so its span joins the caller's trace
+        futures = [
+            pool.submit(contextvars.copy_context().run, _synthesize_chunk, backend, chunk, cancel) for chunk in chunks
+        ]
+        try:
+            for future in futures:
+                audio = future.result()
+                if audio is None or (cancel is not None and cancel.is_set()):
+                    return
+                yield audio, backend.mime
+        finally:
+            for future in futures:
+                future.cancel()
+
+
+# Synthesize text to audio bytes in one piece; returns (audio, mime type)
+def synthesize_speech(text, backend=None):
+    backend = backend or get_tts_backend()
+    return _synthesize_chunk(backend, text), backend.mime
@@ -1,93 +1,281 @@
+import argparse
+import csv
+import re
 import sqlite3
-import pandas as pd
+import time
+from datetime import date
 
-# Load the CSV files into DataFrames
-customer_table = pd.read_csv("CustomerTable.csv")
-sales_table = pd.read_csv("SalesTable.csv")
-transaction_log = pd.read_csv("TransactionLog.csv")
+from rollups import SOURCES as ROLLUP_SOURCES, refresh_rollups
+
+DB_PATH = "sales_database.db"
+CHUNK_SIZE = 10000  # Rows per executemany batch
+
+# Declared schema of every table: CSV source, typed columns, keys and the
+# secondary indexes used for joins and date range filters
+TABLES = {
+    "CustomerTable": {
+        "csv": "CustomerTable.csv",
+        "columns": [
+            ("Customer_ID", "TEXT"),
+            ("First_Name", "TEXT"),
+            ("Last_Name", "TEXT"),
+            ("Email", "TEXT"),
+            ("Phone", "TEXT"),
+            ("Address", "TEXT"),
+            ("City", "TEXT"),
+            ("State", "TEXT"),
+            ("Registration_Date", "DATE"),
+        ],
+        "primary_key": "Customer_ID",
+        "foreign_keys": [],
+        "indexes": [("State",), ("Registration_Date",)],
+    },
+    "SalesTable": {
+        "csv": "SalesTable.csv",
+        "columns": [
+            ("Sale_ID", "TEXT"),
+            ("Customer_ID", "TEXT"),
+            ("Product_ID", "TEXT"),
+            ("Product_Name", "TEXT"),
+            ("Category", "TEXT"),
+            ("Quantity", "INTEGER"),
+            ("Unit_Price", "REAL"),
+            ("Discount", "REAL"),
+            ("Sale_Date", "DATE"),
+        ],
+        "primary_key": "Sale_ID",
+        "foreign_keys": [("Customer_ID", "CustomerTable", "Customer_ID")],
+        "indexes": [("Customer_ID",), ("Sale_Date",), ("Category", "Sale_Date")],
+    },
+    "TransactionLog": {
+        "csv": "TransactionLog.csv",
+        "columns": [
+            ("Transaction_ID", "TEXT"),
+            ("Customer_ID", "TEXT"),
+            ("Transaction_Date", "DATE"),
+            ("Transaction_Type", "TEXT"),
+            ("Amount", "REAL"),
+            ("Payment_Mode", "TEXT"),
+            ("Status", "TEXT"),
+            ("Channel", "TEXT"),
+            ("Merchant_ID", "TEXT"),
+        ],
+        "primary_key": "Transaction_ID",
+        "foreign_keys": [("Customer_ID", "CustomerTable", "Customer_ID")],
+        "indexes": [("Customer_ID",), ("Transaction_Date",), ("Status", "Transaction_Date")],
+    },
+}
+
+
+def connect(db_path=DB_PATH):
+    conn = sqlite3.connect(db_path)
+    conn.execute("PRAGMA journal_mode = WAL")
+    conn.execute("PRAGMA synchronous = NORMAL")  # Safe with WAL, much faster bulk loads
+    conn.execute("PRAGMA cache_size = -262144")  # 256 MiB while loading
+    return conn
+
+
+def table_ddl(table_name, date_format="iso"):
+    spec = TABLES[table_name]
+    lines = []
+    for column, column_type in spec["columns"]:
+        if column_type == "DATE" and date_format == "julian":
+            column_type = "REAL"  # Julian day numbers
+        key = " PRIMARY KEY" if column == spec["primary_key"] else ""
+        lines.append(f"{column} {column_type}{key}")
+    for column, parent, parent_column in spec["foreign_keys"]:
+        lines.append(f"FOREIGN KEY ({column}) REFERENCES {parent}({parent_column})")
+    body = ",\n            ".join(lines)
+    return f"CREATE TABLE IF NOT EXISTS {table_name} (\n            {body}\n        )"
 
-# Connect to SQLite database (or create one if it doesn't exist)
-conn = sqlite3.connect("sales_database.db", check_same_thread=False)
-cursor = conn.cursor()
 
 # Create tables in the database
-def create_tables():
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS CustomerTable (
-            Customer_ID TEXT PRIMARY KEY,
-            First_Name TEXT,
-            Last_Name TEXT,
-            Email TEXT,
-            Phone TEXT,
-            Address TEXT,
-            City TEXT,
-            State TEXT,
-            Registration_Date DATE
-        )
-    """)
-    
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS SalesTable (
-            Sale_ID TEXT PRIMARY KEY,
-            Customer_ID TEXT,
-            Product_ID TEXT,
-            Product_Name TEXT,
-            Category TEXT,
-            Quantity INTEGER,
-            Unit_Price REAL,
-            Discount REAL,
-            Sale_Date DATE,
-            FOREIGN KEY (Customer_ID) REFERENCES CustomerTable(Customer_ID)
-        )
-    """)
-    
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS TransactionLog (
-            Transaction_ID TEXT PRIMARY KEY,
-            Customer_ID TEXT,
-            Transaction_Date DATE,
-            Transaction_Type TEXT,
-            Amount REAL,
-            Payment_Mode TEXT,
-            Status TEXT,
-            Channel TEXT,
-            Merchant_ID TEXT,
-            FOREIGN KEY (Customer_ID) REFERENCES CustomerTable(Customer_ID)
-        )
-    """)
-
-# Insert data into the tables
-def insert_data():
-    # Insert data into CustomerTable
-    customer_table.to_sql("CustomerTable", conn, if_exists="replace", index=False)
-    
-    # Insert data into SalesTable
-    sales_table.to_sql("SalesTable", conn, if_exists="replace", index=False)
-    
-    # Insert data into TransactionLog
-    transaction_log.to_sql("TransactionLog", conn, if_exists="replace", index=False)
+def create_tables(conn, date_format="iso"):
+    for table_name in TABLES:
+        conn.execute(table_ddl(table_name, date_format))
+    conn.commit()
+
+
+# Tables created by an older to_sql() load have no PRIMARY KEY; a unique
+# index gives appends and upserts the conflict target they need
+def ensure_primary_key(conn, table_name):
+    key = TABLES[table_name]["primary_key"]
+    conn.execute(f"CREATE UNIQUE INDEX IF NOT EXISTS idx_{table_name}_pk ON {table_name} ({key})")
+
+
+def create_indexes(conn):
+    for table_name, spec in TABLES.items():
+        ensure_primary_key(conn, table_name)
+        for columns in spec["indexes"]:
+            name = f"idx_{table_name}_{'_'.join(columns)}"
+            conn.execute(f"CREATE INDEX IF NOT EXISTS {name} ON {table_name} ({', '.join(columns)})")
+    conn.execute("ANALYZE")
+    conn.commit()
+
+
+_US_DATE = re.compile(r"^(\d{1,2})/(\d{1,2})/(\d{4})$")
+_ISO_DATE = re.compile(r"^(\d{4})-(\d{1,2})-(\d{1,2})")
+
+
+# Dates arrive as M/D/YYYY, which SQLite's date functions cannot read and
+# which does not sort chronologically. Store them as ISO text (or Julian day
+# numbers) so range filters and DATE() work and can use an index.
+def normalize_date(value, date_format="iso"):
+    match = _US_DATE.match(value)
+    if match:
+        month, day, year = match.groups()
+    else:
+        match = _ISO_DATE.match(value)
+        if not match:
+            return value  # Leave unrecognised values untouched
+        year, month, day = match.groups()
+    parsed = date(int(year), int(month), int(day))
+    if date_format == "julian":
+        return parsed.toordinal() + 1721424.5
+    return parsed.isoformat()
+
+
+def _converter(column_type, date_format):
+    if column_type == "INTEGER":
+        return int
+    if column_type == "REAL":
+        return float
+    if column_type == "DATE":
+        return lambda value: normalize_date(value, date_format)
+    return str
+
+
+def insert_statement(table_name, mode):
+    spec = TABLES[table_name]
+    columns = [column for column, _ in spec["columns"]]
+    placeholders = ", ".join("?" for _ in columns)
+    if mode == "append":
+        # New rows only, rows whose key already exists are skipped
+        return f"INSERT OR IGNORE INTO {table_name} ({', '.join(columns)}) VALUES ({placeholders})"
+    statement = f"INSERT INTO {table_name} ({', '.join(columns)}) VALUES ({placeholders})"
+    if mode == "upsert":
+        updates = ", ".join(f"{column} = excluded.{column}" for column in columns if column != spec["primary_key"])
+        statement += f" ON CONFLICT({spec['primary_key']}) DO UPDATE SET {updates}"
+    return statement
+
+
+# Yield converted rows of csv_path in lists of at most chunk_size rows
+def read_chunks(csv_path, table_name, chunk_size=CHUNK_SIZE, date_format="iso"):
+    spec = TABLES[table_name]
+    with open(csv_path, newline="", encoding="utf-8") as f:
+        reader = csv.reader(f)
+        header = next(reader)
+        positions = {name.strip(): i for i, name in enumerate(header)}
+        fields = [
+            (positions.get(column), _converter(column_type, date_format))
+            for column, column_type in spec["columns"]
+        ]
+        chunk = []
+        for record in reader:
+            if not record:
+                continue
+            row = []
+            for position, convert in fields:
+                value = record[position].strip() if position is not None and position < len(record) else ""
+                row.append(convert(value) if value != "" else None)
+            chunk.append(tuple(row))
+            if len(chunk) >= chunk_size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+
+# Insert data into the tables. Each table is loaded in a single transaction,
+# streaming the CSV in chunks so memory use does not grow with file size.
+# mode is "replace" (rebuild the table), "append" (skip existing keys) or
+# "upsert" (update existing keys).
+def insert_data(conn, table_name, csv_path, mode="replace", chunk_size=CHUNK_SIZE,
+                date_format="iso", on_chunk=None):
+    statement = insert_statement(table_name, mode)
+    started = time.perf_counter()
+    rows = 0
+    if mode != "replace":
+        ensure_primary_key(conn, table_name)
+    conn.execute("BEGIN")
+    try:
+        if mode == "replace":
+            conn.execute(f"DROP TABLE IF EXISTS {table_name}")
+            conn.execute(table_ddl(table_name, date_format))
+        for chunk in read_chunks(csv_path, table_name, chunk_size, date_format):
+            conn.executemany(statement, chunk)
+            rows += len(chunk)
+            if on_chunk is not None:
+                on_chunk(conn, table_name, chunk)
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    return {"table": table_name, "rows": rows, "seconds": time.perf_counter() - started}
+
 
 # Example queries
-def example_queries():
+def example_queries(conn):
     # Query 1: Get all customers who purchased a specific product
     product_name = "Smartphone"
-    cursor.execute("""
+    cursor = conn.execute("""
         SELECT c.First_Name, c.Last_Name, c.Email, s.Product_Name, s.Sale_Date
         FROM CustomerTable c
         JOIN SalesTable s ON c.Customer_ID = s.Customer_ID
         WHERE s.Product_Name = ?
+        LIMIT 10
     """, (product_name,))
     results = cursor.fetchall()
     print("Customers who purchased a", product_name, ":")
     for row in results:
         print(row)
-    
+
 
 # Main function
 def main():
-    create_tables()
-    insert_data()
-    example_queries()
+    parser = argparse.ArgumentParser(description="Load the CSV exports into the sales database")
+    parser.add_argument("--db", default=DB_PATH)
+    parser.add_argument("--mode", choices=("replace", "append", "upsert"), default="replace")
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE)
+    parser.add_argument("--date-format", choices=("iso", "julian"), default="iso")
+    parser.add_argument(
+        "--table", action="append", metavar="TABLE=CSV",
+        help="load only these tables, optionally from another CSV file (repeatable)",
+    )
+    parser.add_argument("--no-rollups", action="store_true", help="do not refresh the rollup tables (rollups.py)")
+    parser.add_argument("--examples", action="store_true", help="run the example queries afterwards")
+    args = parser.parse_args()
+
+    sources = {table_name: spec["csv"] for table_name, spec in TABLES.items()}
+    if args.table:
+        selected = {}
+        for item in args.table:
+            table_name, _, csv_path = item.partition("=")
+            if table_name not in TABLES:
+                parser.error(f"unknown table {table_name}")
+            selected[table_name] = csv_path or TABLES[table_name]["csv"]
+        sources = selected
+
+    conn = connect(args.db)
+    try:
+        create_tables(conn, args.date_format)
+        for table_name, csv_path in sources.items():
+            rollups = table_name in ROLLUP_SOURCES and not args.no_rollups
+            on_chunk = None
+            if rollups and args.mode == "append":
+                # New rows are folded into the rollups in the load's own transaction
+                on_chunk = lambda conn, table, chunk: refresh_rollups(conn, table)
+            stats = insert_data(conn, table_name, csv_path, args.mode, args.chunk_size, args.date_format, on_chunk)
+            print(f"{stats['table']}: {stats['rows']} rows in {stats['seconds']:.2f}s")
+            if rollups and on_chunk is None:
+                modes = refresh_rollups(conn, table_name)
+                print(f"  rollups: {', '.join(f'{name} {mode}' for name, mode in modes.items())}")
+        create_indexes(conn)
+        if args.examples:
+            example_queries(conn)
+    finally:
+        conn.close()
+
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,76 @@
+import re
+
+_OPENING_FENCE = re.compile(r"```[ \t]*(?:sqlite|sql)?[ \t]*(?:\n|$)", re.I)
+
+
+# Index of the first ';' that is outside string literals, quoted identifiers
+# and comments, or None
+def statement_end(text):
+    i = 0
+    length = len(text)
+    while i < length:
+        char = text[i]
+        if char in ("'", '"', "`"):
+            close = text.find(char, i + 1)
+            # Doubled quotes ('') escape a quote, and are skipped as two literals
+            if close == -1:
+                return None
+            i = close + 1
+            continue
+        if text.startswith("--", i):
+            newline = text.find("\n", i)
+            if newline == -1:
+                return None
+            i = newline + 1
+            continue
+        if text.startswith("/*", i):
+            close = text.find("*/", i + 2)
+            if close == -1:
+                return None
+            i = close + 2
+            continue
+        if char == ";":
+            return i
+        i += 1
+    return None
+
+
+# First complete SQL statement in model output that may still be streaming
+# in: the body of a closed ```sql fence, or the text up to the first
+# top-level ';'. Returns None while the statement may still be growing.
+def complete_statement(text):
+    fence = _OPENING_FENCE.search(text)
+    if fence:
+        body = text[fence.end():]
+        end = statement_end(body)
+        closing = body.find("```")
+        if closing != -1 and (end is None or closing < end):
+            return body[:closing].strip() or None
+    else:
+        body = text
+        end = statement_end(body)
+    if end is not None:
+        return body[:end].strip() or None
+    return None
+
+
+_LANGUAGE_TAG = re.compile(r"^\s*(?:sqlite|sql)\s*(?:\n|:)", re.I)
+_STATEMENT_START = re.compile(r"\b(SELECT|WITH)\b", re.I)
+
+
+# The first SQL statement in complete model output, fenced or not. Unlike a
+# blanket replace("sql", ""), identifiers containing "sql" are left intact.
+def extract_sql(text):
+    statement = complete_statement(text)
+    if statement is None:
+        fence = _OPENING_FENCE.search(text)
+        statement = text[fence.end():] if fence else text
+        statement = statement.replace("```", "")
+    statement = _LANGUAGE_TAG.sub("", statement, count=1).strip()
+    # Drop any prose the model put before the query ("Here is the query:")
+    start = _STATEMENT_START.search(statement)
+    if start and start.start() > 0 and not statement[:start.start()].strip().upper().startswith(
+        ("SELECT", "WITH", "INSERT", "UPDATE", "DELETE", "CREATE", "DROP", "ALTER", "PRAGMA", "ATTACH")
+    ):
+        statement = statement[start.start():]
+    return statement.strip().rstrip(";").strip()
@@ -0,0 +1,171 @@
+import json
+import os
+import re
+import sqlite3
+
+# Largest estimated number of row visits a generated query may cost
+MAX_QUERY_COST = int(os.getenv("SPEAK2DB_MAX_QUERY_COST", "10000000"))
+SEARCH_ROWS = 10  # Rows assumed per indexed equality lookup
+MATERIALIZED_ROWS = 100  # Rows assumed for a grouped subquery/CTE result
+
+# Authorizer actions a read-only query may perform; anything else (writes,
+# PRAGMA, ATTACH, ...) is denied while the statement is being prepared
+_ALLOWED_ACTIONS = {
+    sqlite3.SQLITE_SELECT,
+    sqlite3.SQLITE_READ,
+    sqlite3.SQLITE_FUNCTION,
+    getattr(sqlite3, "SQLITE_RECURSIVE", 33),
+}
+
+
+class SQLValidationError(Exception):
+    pass
+
+
+# Check a statement before it runs, using SQLite's own parser: preparing
+# EXPLAIN QUERY PLAN fails on syntax errors and unknown tables or columns, and
+# the authorizer sees every table/column the statement reads. Returns the
+# plan and its estimated cost; raises SQLValidationError otherwise.
+def validate_sql(sql, conn, catalog, max_cost=MAX_QUERY_COST):
+    _check_select(sql)
+
+    tables = catalog["tables"]
+    columns = {name.lower(): {c["name"].lower() for c in table["columns"]} for name, table in tables.items()}
+    denied = []
+    reads = set()
+
+    def authorizer(action, arg1, arg2, database, source):
+        if action not in _ALLOWED_ACTIONS:
+            denied.append("statement is not a read-only SELECT")
+            return sqlite3.SQLITE_DENY
+        if action == sqlite3.SQLITE_READ:
+            table = (arg1 or "").lower()
+            if table not in columns:
+                denied.append(f"table {arg1} is not part of the schema")
+                return sqlite3.SQLITE_DENY
+            if arg2 and arg2.lower() not in columns[table]:
+                denied.append(f"column {arg1}.{arg2} is not part of the schema")
+                return sqlite3.SQLITE_DENY
+            reads.add(table)
+        return sqlite3.SQLITE_OK
+
+    conn.set_authorizer(authorizer)
+    try:
+        plan = conn.execute("EXPLAIN QUERY PLAN " + sql).fetchall()
+    except sqlite3.Error as e:
+        if denied:
+            raise SQLValidationError(f"Rejected: {denied[0]}.")
+        raise SQLValidationError(f"Invalid SQL: {e}")
+    finally:
+        conn.set_authorizer(None)
+
+    row_counts = {name.lower(): table["row_count"] for name, table in tables.items()}
+    cost = estimate_cost(plan, sql, row_counts, reads)
+    if cost > max_cost:
+        raise SQLValidationError(
+            f"Query is too expensive: about {cost:,.0f} row visits (limit {max_cost:,}). "
+            "It probably joins tables without a matching condition."
+        )
+    return {"plan": [row[3] for row in plan], "cost": cost}
+
+
+def _check_select(sql):
+    if not sql or not sql.strip():
+        raise SQLValidationError("The model did not return a SQL statement.")
+    if not re.match(r"\s*(SELECT|WITH)\b", sql, re.I):
+        raise SQLValidationError("Only SELECT queries are allowed.")
+
+
+# Names of the table functions (read_text, glob, read_csv, ...) anywhere in
+# a parsed DuckDB statement, as json_serialize_sql lays it out
+def _table_functions(node):
+    if isinstance(node, dict):
+        if node.get("type") == "TABLE_FUNCTION":
+            yield (node.get("function") or {}).get("function_name", "table function")
+        for value in node.values():
+            yield from _table_functions(value)
+    elif isinstance(node, list):
+        for value in node:
+            yield from _table_functions(value)
+
+
+# validate_sql for the DuckDB backend (duckdb_engine.py): the statement must
+# be a single SELECT over the schema's views, with no table functions that
+# read files or the environment, and binding it for EXPLAIN fails on syntax
+# errors and unknown tables, columns or functions. The engine itself denies
+# file access and writes; there is no cost estimate.
+def validate_duckdb_sql(sql, conn, catalog, max_cost=MAX_QUERY_COST):
+    import duckdb
+
+    _check_select(sql)
+    try:
+        statements = conn.extract_statements(sql)
+        if len(statements) != 1 or statements[0].type != duckdb.StatementType.SELECT:
+            raise SQLValidationError("Only a single SELECT query is allowed.")
+        tree = json.loads(conn.execute("SELECT json_serialize_sql(?)", [sql]).fetchone()[0])
+        functions = list(_table_functions(tree))
+        if functions:
+            raise SQLValidationError(f"Rejected: table function {functions[0]}() is not allowed.")
+        plan = conn.execute("EXPLAIN " + sql).fetchall()
+    except duckdb.Error as e:
+        raise SQLValidationError(f"Invalid SQL: {e}")
+    return {"plan": [row[1] for row in plan], "cost": None}
+
+
+VALIDATORS = {"sqlite": validate_sql, "duckdb": validate_duckdb_sql}  # By engine dialect
+
+
+def _alias_table(alias, sql, row_counts):
+    alias = alias.lower()
+    if alias in row_counts:
+        return alias
+    for table in row_counts:
+        if re.search(rf"\b{re.escape(table)}\s+(?:as\s+)?{re.escape(alias)}\b", sql, re.I):
+            return table
+    return None
+
+
+# Estimated row visits of an EXPLAIN QUERY PLAN: loops at the same level are
+# nested, so their row estimates multiply; subqueries add their own cost
+def estimate_cost(plan, sql, row_counts, reads):
+    children = {}
+    for node_id, parent, _, detail in plan:
+        children.setdefault(parent, []).append((node_id, detail))
+    fallback = max((row_counts[table] for table in reads), default=1)
+    subqueries = {}  # CTE/subquery name -> whether its result is grouped
+
+    def level_cost(parent):
+        loop_rows = 1
+        total = 0
+        for node_id, detail in children.get(parent, []):
+            sub = re.match(r"(?:MATERIALIZE|CO-ROUTINE) (\w+)", detail)
+            if sub:
+                total += level_cost(node_id)
+                grouped = any("GROUP BY" in d or "DISTINCT" in d for _, d in children.get(node_id, []))
+                subqueries[sub.group(1).lower()] = grouped
+                continue
+            loop = re.match(r"(SCAN|SEARCH) (\w+)(.*)", detail)
+            if loop:
+                kind, alias, rest = loop.groups()
+                if alias.lower() in subqueries:
+                    rows = MATERIALIZED_ROWS if subqueries[alias.lower()] else fallback
+                else:
+                    table = _alias_table(alias, sql, row_counts)
+                    rows = row_counts.get(table, fallback) if table else fallback
+                if kind == "SEARCH":
+                    if "AUTOMATIC" in rest:
+                        total += rows  # Building the transient index reads the table once
+                        rows = SEARCH_ROWS
+                    elif "=" in rest and not re.search(r"[<>]", rest):
+                        rows = 1 if "PRIMARY KEY" in rest or "rowid" in rest else SEARCH_ROWS
+                    else:
+                        rows = max(SEARCH_ROWS, rows // 4)  # Range lookup
+                loop_rows *= max(rows, 1)
+                total += loop_rows
+                total += level_cost(node_id)
+                continue
+            # Other nodes (subquery wrappers, compound selects) contribute their children
+            total += level_cost(node_id)
+        return total
+
+    return level_cost(0)
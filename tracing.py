@@ -0,0 +1,261 @@
+import bisect
+import contextvars
+import json
+import os
+import secrets
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+SERVICE_NAME = "speak2db"
+MAX_SPANS = int(os.getenv("SPEAK2DB_TRACE_BUFFER", "5000"))  # Finished spans kept for the dashboard
+# Serve Prometheus text on this port (e.g. 9464) when set
+METRICS_PORT = os.getenv("SPEAK2DB_METRICS_PORT")
+# Histogram bucket bounds in seconds
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+# Span attributes that are also summed into Prometheus counters
+_COUNTED = {
+    "llm.prompt_tokens": ("speak2db_llm_tokens_total", {"kind": "prompt"}),
+    "llm.completion_tokens": ("speak2db_llm_tokens_total", {"kind": "completion"}),
+    "db.rows": ("speak2db_rows_total", {}),
+    "db.bytes": ("speak2db_bytes_total", {}),
+    "audio.bytes": ("speak2db_bytes_total", {}),
+}
+
+_current_span = contextvars.ContextVar("speak2db_span", default=None)
+_current_trace = contextvars.ContextVar("speak2db_trace", default=None)
+_current_session = contextvars.ContextVar("speak2db_session", default=None)
+
+
+class Span:
+    def __init__(self, name, trace_id, parent_id, attributes):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = secrets.token_hex(8)
+        self.parent_id = parent_id
+        self.attributes = attributes
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+        self.error = None
+        self._started = time.perf_counter()
+        self.duration = None  # Seconds, once ended
+
+    def set(self, key, value):
+        self.attributes[key] = value
+
+    def end(self):
+        self.duration = time.perf_counter() - self._started
+        self.end_ns = self.start_ns + int(self.duration * 1e9)
+
+
+# Records spans around pipeline stages: a bounded buffer of recent spans for
+# the latency panel and OpenTelemetry export, plus cumulative aggregates for
+# Prometheus, which must not reset when old spans leave the buffer
+class Tracer:
+    def __init__(self, max_spans=MAX_SPANS):
+        self.spans = deque(maxlen=max_spans)
+        self._durations = {}  # stage -> [bucket counts..., +Inf count, sum]
+        self._errors = {}  # stage -> count
+        self._cache = {}  # (stage, result) -> count
+        self._counters = {}  # (metric, stage, labels) -> total
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def span(self, name, **attributes):
+        parent = _current_span.get()
+        trace_id = parent.trace_id if parent else (_current_trace.get() or secrets.token_hex(16))
+        session = _current_session.get()
+        if session is not None:
+            attributes.setdefault("session.id", session)
+        span = Span(name, trace_id, parent.span_id if parent else None, attributes)
+        token = _current_span.set(span)
+        try:
+            yield span
+        except Exception as e:
+            span.error = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            _current_span.reset(token)
+            span.end()
+            self._record(span)
+
+    def _record(self, span):
+        with self._lock:
+            self.spans.append(span)
+            histogram = self._durations.setdefault(span.name, [0] * (len(DURATION_BUCKETS) + 2))
+            histogram[bisect.bisect_left(DURATION_BUCKETS, span.duration)] += 1
+            histogram[-1] += span.duration
+            if span.error:
+                self._errors[span.name] = self._errors.get(span.name, 0) + 1
+            if "cache.result" in span.attributes:
+                key = (span.name, span.attributes["cache.result"])
+                self._cache[key] = self._cache.get(key, 0) + 1
+            if span.attributes.get("query.killed"):
+                key = ("speak2db_queries_killed_total", span.name, (("reason", span.attributes["query.killed"]),))
+                self._counters[key] = self._counters.get(key, 0) + 1
+            for attribute, (metric, labels) in _COUNTED.items():
+                value = span.attributes.get(attribute)
+                if isinstance(value, (int, float)):
+                    key = (metric, span.name, tuple(sorted(labels.items())))
+                    self._counters[key] = self._counters.get(key, 0) + value
+
+    def recent(self, session_id=None):
+        with self._lock:
+            spans = list(self.spans)
+        if session_id is None:
+            return spans
+        return [span for span in spans if span.attributes.get("session.id") == session_id]
+
+    # {stage: {"count", "p50", "p95", "last"}} in milliseconds over the buffered spans
+    def stage_stats(self, session_id=None):
+        durations = {}
+        for span in self.recent(session_id):
+            durations.setdefault(span.name, []).append(span.duration * 1000)
+        stats = {}
+        for name, values in durations.items():
+            ordered = sorted(values)
+            stats[name] = {
+                "count": len(values),
+                "p50": ordered[len(ordered) // 2],
+                "p95": ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))],
+                "last": values[-1],
+            }
+        return stats
+
+    # Buffered spans in the OTLP/JSON format accepted by OpenTelemetry collectors
+    def to_otel_json(self, session_id=None):
+        spans = []
+        for span in self.recent(session_id):
+            item = {
+                "traceId": span.trace_id,
+                "spanId": span.span_id,
+                "name": span.name,
+                "kind": 1,  # SPAN_KIND_INTERNAL
+                "startTimeUnixNano": str(span.start_ns),
+                "endTimeUnixNano": str(span.end_ns),
+                "attributes": [_otel_attribute(key, value) for key, value in span.attributes.items()],
+                "status": {"code": 2, "message": span.error} if span.error else {"code": 1},
+            }
+            if span.parent_id:
+                item["parentSpanId"] = span.parent_id
+            spans.append(item)
+        return json.dumps({
+            "resourceSpans": [{
+                "resource": {"attributes": [_otel_attribute("service.name", SERVICE_NAME)]},
+                "scopeSpans": [{"scope": {"name": SERVICE_NAME}, "spans": spans}],
+            }]
+        })
+
+    # Cumulative metrics in the Prometheus text exposition format
+    def to_prometheus(self):
+        with self._lock:
+            durations = {name: list(values) for name, values in self._durations.items()}
+            errors = dict(self._errors)
+            cache = dict(self._cache)
+            counters = dict(self._counters)
+        lines = [
+            "# HELP speak2db_stage_duration_seconds Duration of pipeline stages.",
+            "# TYPE speak2db_stage_duration_seconds histogram",
+        ]
+        for name, histogram in sorted(durations.items()):
+            cumulative = 0
+            for bound, count in zip(DURATION_BUCKETS, histogram):
+                cumulative += count
+                lines.append(f'speak2db_stage_duration_seconds_bucket{{stage="{name}",le="{bound}"}} {cumulative}')
+            cumulative += histogram[len(DURATION_BUCKETS)]
+            lines.append(f'speak2db_stage_duration_seconds_bucket{{stage="{name}",le="+Inf"}} {cumulative}')
+            lines.append(f'speak2db_stage_duration_seconds_sum{{stage="{name}"}} {histogram[-1]:.6f}')
+            lines.append(f'speak2db_stage_duration_seconds_count{{stage="{name}"}} {cumulative}')
+        lines += ["# HELP speak2db_stage_errors_total Stages that raised.", "# TYPE speak2db_stage_errors_total counter"]
+        for name, count in sorted(errors.items()):
+            lines.append(f'speak2db_stage_errors_total{{stage="{name}"}} {count}')
+        lines += ["# HELP speak2db_cache_lookups_total Cache lookups by result.", "# TYPE speak2db_cache_lookups_total counter"]
+        for (name, result), count in sorted(cache.items()):
+            lines.append(f'speak2db_cache_lookups_total{{stage="{name}",result="{result}"}} {count}')
+        declared = set()
+        for (metric, name, labels), total in sorted(counters.items()):
+            if metric not in declared:
+                lines.append(f"# TYPE {metric} counter")
+                declared.add(metric)
+            label_text = "".join(f',{key}="{value}"' for key, value in labels)
+            lines.append(f'{metric}{{stage="{name}"{label_text}}} {total:g}')
+        return "\n".join(lines) + "\n"
+
+
+def _otel_attribute(key, value):
+    if isinstance(value, bool):
+        return {"key": key, "value": {"boolValue": value}}
+    if isinstance(value, int):
+        return {"key": key, "value": {"intValue": str(value)}}
+    if isinstance(value, float):
+        return {"key": key, "value": {"doubleValue": value}}
+    return {"key": key, "value": {"stringValue": str(value)}}
+
+
+_tracer = None
+_tracer_lock = threading.Lock()
+
+
+# Shared, process-wide tracer
+def get_tracer():
+    global _tracer
+    with _tracer_lock:
+        if _tracer is None:
+            _tracer = Tracer()
+            if METRICS_PORT:
+                start_metrics_server(int(METRICS_PORT), _tracer)
+        return _tracer
+
+
+# Time a block as a span of the shared tracer:
+#   with span("llm", model=MODEL_NAME) as s:
+#       s.set("llm.completion_tokens", n)
+def span(name, **attributes):
+    return get_tracer().span(name, **attributes)
+
+
+# Start a new trace: spans that follow (outside any other span) share its id
+def new_trace():
+    _current_trace.set(secrets.token_hex(16))
+
+
+# Attribute spans in this context to a user session
+def set_session(session_id):
+    _current_session.set(session_id)
+
+
+def current_session():
+    return _current_session.get()
+
+
+# Serve /metrics in the Prometheus text format from a daemon thread
+def start_metrics_server(port, tracer=None):
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            body = (tracer or get_tracer()).to_prometheus().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(("", port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, name="speak2db-metrics", daemon=True).start()
+    return server
+
+
+# The current trace and session, to carry into work started on another
+# thread or event loop (contextvars do not follow run_coroutine_threadsafe)
+def capture():
+    return (_current_trace.get(), _current_session.get())
+
+
+def restore(state):
+    _current_trace.set(state[0])
+    _current_session.set(state[1])
@@ -0,0 +1,314 @@
+import contextvars
+import io
+import json
+import os
+import threading
+import time
+import wave
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from tracing import span
+
+# Which engine recognizes speech: "google" (the free Google Web Speech API)
+# or "vosk" (offline; pip install vosk, and point SPEAK2DB_VOSK_MODEL at a
+# downloaded model directory or leave it unset to fetch the small English one)
+STT_BACKEND = os.getenv("SPEAK2DB_STT_BACKEND", "google")
+STT_LANG = os.getenv("SPEAK2DB_STT_LANG", "en-US")
+VOSK_MODEL = os.getenv("SPEAK2DB_VOSK_MODEL")
+SAMPLE_RATE = 16000  # Audio is resampled to 16 kHz mono 16-bit PCM for every engine
+VAD_FRAME_MS = 30
+VAD_SILENCE_MS = int(os.getenv("SPEAK2DB_VAD_SILENCE_MS", "800"))  # Silence that ends an utterance
+VAD_MIN_RMS = 300  # Frames quieter than this (int16 RMS) are never speech
+VAD_PREROLL_MS = 300  # Audio kept from before speech starts, so the first syllable is not cut
+MAX_UTTERANCE_SECONDS = 15
+
+
+# Energy-based voice activity detection over fixed-size frames. The noise
+# floor adapts while nobody speaks; speech starts after a few loud frames and
+# ends after silence_ms of quiet ones.
+class VoiceActivityDetector:
+    def __init__(self, sample_rate=SAMPLE_RATE, frame_ms=VAD_FRAME_MS, silence_ms=VAD_SILENCE_MS,
+                 min_rms=VAD_MIN_RMS, ratio=3.0, start_frames=3):
+        self.frame_samples = sample_rate * frame_ms // 1000
+        self.min_rms = min_rms
+        self.ratio = ratio
+        self.start_frames = start_frames
+        self.end_frames = max(1, silence_ms // frame_ms)
+        self.noise = float(min_rms) / ratio
+        self.started = False
+        self.ended = False
+        self._voiced_run = 0
+        self._quiet_run = 0
+
+    # Classify one frame of int16 samples; returns whether it is voiced
+    def feed(self, frame):
+        rms = float(np.sqrt(np.mean(frame.astype(np.float64) ** 2))) if len(frame) else 0.0
+        voiced = rms > max(self.min_rms, self.noise * self.ratio)
+        if not voiced and not self.started:
+            self.noise = 0.95 * self.noise + 0.05 * rms
+        if not self.started:
+            self._voiced_run = self._voiced_run + 1 if voiced else 0
+            self.started = self._voiced_run >= self.start_frames
+        elif not self.ended:
+            self._quiet_run = 0 if voiced else self._quiet_run + 1
+            self.ended = self._quiet_run >= self.end_frames
+        return voiced
+
+
+class GoogleRecognizer:
+    name = "google"
+
+    def __init__(self, language=STT_LANG):
+        import speech_recognition as sr
+
+        self.language = language
+        self._sr = sr
+        self._recognizer = sr.Recognizer()
+
+    def start(self, sample_rate):
+        return _BufferedStream(self, sample_rate)
+
+    def recognize(self, pcm, sample_rate):
+        return self._recognizer.recognize_google(self._sr.AudioData(pcm, sample_rate, 2), language=self.language)
+
+
+# Collects audio for engines that recognize a whole utterance at once
+class _BufferedStream:
+    def __init__(self, recognizer, sample_rate):
+        self.recognizer = recognizer
+        self.sample_rate = sample_rate
+        self._chunks = []
+
+    def feed(self, pcm):
+        self._chunks.append(pcm)
+
+    def partial(self):
+        return ""
+
+    def result(self):
+        return self.recognizer.recognize(b"".join(self._chunks), self.sample_rate)
+
+
+class VoskRecognizer:
+    name = "vosk"
+
+    def __init__(self, model_path=VOSK_MODEL):
+        import vosk
+
+        self._vosk = vosk
+        self._model = vosk.Model(model_path) if model_path else vosk.Model(lang="en-us")
+
+    def start(self, sample_rate):
+        return _VoskStream(self._vosk.KaldiRecognizer(self._model, sample_rate))
+
+
+# Vosk decodes while audio arrives, so the result is ready as speech ends
+class _VoskStream:
+    def __init__(self, recognizer):
+        self._recognizer = recognizer
+
+    def feed(self, pcm):
+        self._recognizer.AcceptWaveform(pcm)
+
+    def partial(self):
+        return json.loads(self._recognizer.PartialResult()).get("partial", "")
+
+    def result(self):
+        import speech_recognition as sr
+
+        text = json.loads(self._recognizer.FinalResult()).get("text", "")
+        if not text:
+            raise sr.UnknownValueError()
+        return text
+
+
+_recognizer_factories = {"google": GoogleRecognizer, "vosk": VoskRecognizer}
+_recognizers = {}
+_recognizer_lock = threading.Lock()
+
+
+# Register factory() -> recognizer under name. A recognizer has name and
+# start(sample_rate) -> stream with feed(pcm bytes), partial() and result();
+# result() raises sr.UnknownValueError when nothing was understood.
+def register_recognizer(name, factory):
+    with _recognizer_lock:
+        _recognizer_factories[name] = factory
+        _recognizers.pop(name, None)
+
+
+def get_recognizer(name=None):
+    name = name or STT_BACKEND
+    with _recognizer_lock:
+        recognizer = _recognizers.get(name)
+        if recognizer is None:
+            if name not in _recognizer_factories:
+                raise ValueError(
+                    f"Unknown speech recognizer {name!r}; choose from {', '.join(sorted(_recognizer_factories))}"
+                )
+            recognizer = _recognizers[name] = _recognizer_factories[name]()
+        return recognizer
+
+
+# Final recognition runs here, never on the audio or script threads
+_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="speak2db-stt")
+
+
+# One utterance: audio goes through the VAD, is streamed to the recognizer
+# once speech starts, and recognition is finalized in the background as soon
+# as the speaker stops. state is "waiting", "listening", "recognizing" or "done".
+class SpeechSession:
+    def __init__(self, recognizer=None, sample_rate=SAMPLE_RATE, context=None):
+        self.recognizer = recognizer or get_recognizer()
+        self.sample_rate = sample_rate
+        self.vad = VoiceActivityDetector(sample_rate)
+        self.state = "waiting"
+        self.text = None
+        self.error = None
+        self._stream = None
+        self._pending = np.empty(0, dtype=np.int16)
+        self._preroll = deque(maxlen=max(1, VAD_PREROLL_MS // VAD_FRAME_MS))
+        self._speech_samples = 0
+        self._lock = threading.Lock()
+        self._done = threading.Event()
+        # Recognition spans join the trace of whoever started listening
+        self._context = context or contextvars.copy_context()
+
+    # Feed int16 mono samples at sample_rate
+    def feed(self, samples):
+        with self._lock:
+            if self.state not in ("waiting", "listening"):
+                return
+            self._pending = np.concatenate([self._pending, samples])
+            size = self.vad.frame_samples
+            while len(self._pending) >= size and self.state in ("waiting", "listening"):
+                frame, self._pending = self._pending[:size], self._pending[size:]
+                self.vad.feed(frame)
+                if self.state == "waiting":
+                    self._preroll.append(frame)
+                    if self.vad.started:
+                        self.state = "listening"
+                        self._stream = self.recognizer.start(self.sample_rate)
+                        for buffered in self._preroll:
+                            self._send(buffered)
+                else:
+                    self._send(frame)
+                    if self.vad.ended or self._speech_samples > MAX_UTTERANCE_SECONDS * self.sample_rate:
+                        self._finish()
+
+    def _send(self, frame):
+        self._speech_samples += len(frame)
+        self._stream.feed(frame.tobytes())
+
+    # No more audio is coming (the recording ended or the user stopped)
+    def finish(self):
+        import speech_recognition as sr
+
+        with self._lock:
+            if self.state == "waiting":
+                self.error = sr.UnknownValueError("no speech detected")
+                self.state = "done"
+                self._done.set()
+            elif self.state == "listening":
+                self._finish()
+
+    def _finish(self):
+        self.state = "recognizing"
+        _executor.submit(self._context.copy().run, self._recognize)
+
+    def _recognize(self):
+        seconds = self._speech_samples / self.sample_rate
+        try:
+            with span("stt", **{"stt.backend": self.recognizer.name, "audio.seconds": round(seconds, 2)}):
+                self.text = self._stream.result()
+        except Exception as e:
+            self.error = e
+        finally:
+            self.state = "done"
+            self._done.set()
+
+    def partial(self):
+        with self._lock:
+            return self._stream.partial() if self._stream is not None and self.state == "listening" else ""
+
+    # Recognized text once done; raises what recognition raised
+    def wait(self, timeout=None):
+        if not self._done.wait(timeout):
+            raise TimeoutError("speech recognition did not finish")
+        if self.error is not None:
+            raise self.error
+        return self.text
+
+
+# Decode a WAV file to int16 mono samples at sample_rate
+def wav_to_samples(data, sample_rate=SAMPLE_RATE):
+    with wave.open(io.BytesIO(data)) as wav:
+        channels, width, rate = wav.getnchannels(), wav.getsampwidth(), wav.getframerate()
+        raw = wav.readframes(wav.getnframes())
+    if width != 2:
+        raise ValueError(f"Expected 16-bit audio, got {8 * width}-bit")
+    samples = np.frombuffer(raw, dtype=np.int16).reshape(-1, channels).mean(axis=1)
+    if rate != sample_rate and len(samples):
+        positions = np.arange(0, len(samples), rate / sample_rate)
+        samples = np.interp(positions, np.arange(len(samples)), samples)
+    return samples.astype(np.int16)
+
+
+# Recognize a recorded WAV clip; silence around the speech is skipped
+def recognize_wav(data, recognizer=None):
+    session = SpeechSession(recognizer)
+    samples = wav_to_samples(data)
+    step = SAMPLE_RATE // 10
+    for start in range(0, len(samples), step):
+        session.feed(samples[start:start + step])
+    session.finish()
+    return session.wait()
+
+
+# Bridges live WebRTC audio to speech sessions: on_frame runs on the WebRTC
+# worker thread for every av.AudioFrame; the page polls take_result(). After a
+# result is taken, the next speech starts a new session.
+class VoiceListener:
+    def __init__(self, recognizer=None):
+        self.recognizer = recognizer
+        self.session = None
+        self.last_frame_at = 0.0
+        self._resampler = None
+        self._lock = threading.Lock()
+        self._context = contextvars.copy_context()  # The page's session, for recognition spans
+
+    def on_frame(self, frame):
+        import av
+
+        self.last_frame_at = time.monotonic()
+        with self._lock:
+            if self._resampler is None:
+                self._resampler = av.AudioResampler(format="s16", layout="mono", rate=SAMPLE_RATE)
+            if self.session is None:
+                self.session = SpeechSession(self.recognizer, context=self._context)
+            session = self.session
+            resampled = self._resampler.resample(frame)
+        for chunk in resampled:
+            session.feed(chunk.to_ndarray().reshape(-1))
+        return frame
+
+    def status(self):
+        session = self.session
+        return session.state if session is not None else "waiting"
+
+    # (text, error) of a finished utterance, once; (None, None) until then
+    def take_result(self):
+        with self._lock:
+            session = self.session
+            if session is None or session.state != "done":
+                return None, None
+            self.session = None
+        return session.text, session.error
+
+    def stop(self):
+        with self._lock:
+            session = self.session
+        if session is not None:
+            session.finish()